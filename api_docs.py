@@ -0,0 +1,110 @@
+"""
+Swagger UI and spec for the Flask app, built when first asked for
+
+Importing flasgger (and jsonschema behind it) is a large share of the Flask
+app's cold start, and the docs are rarely used in production. API_DOCS
+chooses how they are served:
+
+- lazy (default): flasgger is imported and the docs are built, from the
+  route docstrings as usual, on the first request for /apidocs/,
+  /apispec.json or the UI's static files
+- eager: built at startup
+- off: not served
+
+API_SPEC_PATH names a spec generated at build time, served for
+/apispec.json without loading flasgger at all:
+    python api_docs.py apispec.json
+"""
+
+import os
+import sys
+import threading
+
+
+def install_api_docs(app, config, template):
+    """Serve the API docs for `app` as API_DOCS and API_SPEC_PATH ask"""
+    mode = os.environ.get('API_DOCS', 'lazy')
+    if mode == 'off':
+        return
+    if mode == 'eager':
+        from flasgger import Swagger
+        Swagger(app, config=config, template=template)
+        return
+    app.wsgi_app = LazyApiDocs(app, app.wsgi_app, config, template, os.environ.get('API_SPEC_PATH') or None)
+
+
+class LazyApiDocs:
+    """
+    WSGI middleware sending requests for the docs to a copy of the app with
+    flasgger installed, made on the first such request. The copy has the
+    app's routes, so the spec is generated from their docstrings as before.
+    """
+
+    def __init__(self, app, wsgi_app, config, template, spec_path=None):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.config = config
+        self.template = template
+        self.spec_routes = {spec['route'] for spec in config['specs']}
+        self.prefixes = (config['specs_route'].rstrip('/'), config['static_url_path'] + '/')
+        self.spec_json = None
+        if spec_path:
+            with open(spec_path, 'rb') as f:
+                self.spec_json = f.read()
+        self._docs_app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if self.spec_json is not None and path in self.spec_routes:
+            start_response('200 OK', [('Content-Type', 'application/json'),
+                                      ('Content-Length', str(len(self.spec_json)))])
+            return [self.spec_json]
+        if path in self.spec_routes or path.startswith(self.prefixes):
+            return self.docs_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def docs_app(self):
+        with self._lock:
+            if self._docs_app is None:
+                self._docs_app = build_docs_app(self.app, self.config, self.template)
+            return self._docs_app
+
+
+def build_docs_app(app, config, template):
+    """A Flask app with `app`'s routes and flasgger's docs endpoints"""
+    from flask import Flask
+    from flasgger import Swagger
+
+    print("📖 Building API docs")
+    docs = Flask(app.import_name)
+    docs.config.update(app.config)
+    # The app's request hooks (CORS headers, request tracing) apply to the docs too
+    for name in ('before_request_funcs', 'after_request_funcs', 'teardown_request_funcs'):
+        setattr(docs, name, {key: list(funcs) for key, funcs in getattr(app, name).items()})
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint != 'static':
+            docs.add_url_rule(rule.rule, rule.endpoint, app.view_functions[rule.endpoint], methods=rule.methods)
+    Swagger(docs, config=config, template=template)
+    return docs
+
+
+def main(argv=None):
+    """Write the API spec to a file, for API_SPEC_PATH"""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print('usage: python api_docs.py OUTPUT.json', file=sys.stderr)
+        return 2
+    # Imported here so `app` can import this module
+    from app import app, swagger_config, swagger_template
+
+    docs = build_docs_app(app, swagger_config, swagger_template)
+    response = docs.test_client().get(swagger_config['specs'][0]['route'])
+    with open(argv[0], 'wb') as f:
+        f.write(response.data)
+    print(f"✅ Wrote the API spec to {argv[0]} ({len(response.data)} bytes)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,18 +5,49 @@ Transforms messy incident logs into professional documentation
 Aberdeen AI Builders Workshop - October 9, 2025
 """
 
-from flask import Flask, request, Response, stream_with_context
+from flask import Flask, g, request, Response, jsonify, stream_with_context
 from flask_cors import CORS
-from flasgger import Swagger
 import subprocess
+import functools
+import hashlib
 import json
+import os
 import time
 import threading
 import queue
 from datetime import datetime
 
+from api_docs import install_api_docs
+from backends import CLAUDE_TIMEOUT_SECONDS, ClaudeCLIError, WarmCLIBackend, backend_from_env
+from event_stream import COALESCE_CHARS, COALESCE_SECONDS, StreamEncoder, encoder_from_request
+from jobs import Job, JobCancelled, registry_from_env
+from local_renderers import LOCAL_RENDERERS
+from map_reduce import combine_digests, iter_window_digests, settings_from_env as map_reduce_from_env, split_windows
+from metrics import (
+    CACHED_RESPONSES,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    FIRST_OUTPUT_SECONDS,
+    GENERATION_SECONDS,
+    GENERATIONS,
+    METRICS,
+    NEAR_MATCH_RESPONSES,
+    OPEN_SSE_CONNECTIONS,
+    SPAWN_SECONDS,
+    SSE_STREAM_SECONDS,
+)
+from notes_preprocessor import budget_from_env, compact_notes
+from report_cache import cache_from_env, make_cache_key, normalize_notes
+from report_store import incident_title, notes_hash, store_from_env
+from resilience import CircuitOpenError, resilient_from_env
+from scheduling import request_priority
+from shared_state import shared_registry_from_env, shared_state_from_env, slot_limited_from_env
+from similarity_index import index_from_env
+from tracing import CURRENT_TRACE, bind as bind_trace, chrome_trace, current_trace, install_log_prefix, recorder_from_env, span
+from worker_pool import PoolFullError, pool_from_env
+
 app = Flask(__name__)
-CORS(app)  # Enable CORS for React frontend
+CORS(app, expose_headers=['X-Job-ID', 'X-Batch-ID', 'X-Session-ID', 'X-Request-ID', 'X-Generated-Sections',
+                          'Content-Disposition'])  # Enable CORS for React frontend
 
 # Swagger configuration
 swagger_config = {
@@ -49,7 +80,115 @@ swagger_template = {
     "schemes": ["http", "https"],
 }
 
-swagger = Swagger(app, config=swagger_config, template=swagger_template)
+# Built on first use unless API_DOCS=eager, to keep flasgger out of cold starts (see api_docs.py)
+install_api_docs(app, swagger_config, swagger_template)
+
+# Produces report text: the Claude CLI (optionally from a pool of warm processes),
+# or a local stub for load tests (see backends.py)
+CLI_BACKEND = backend_from_env()
+
+# Coordination with the other worker processes of a production server, when
+# SHARED_STATE_PATH is set (see shared_state.py and gunicorn.conf.py)
+SHARED_STATE = shared_state_from_env()
+
+# CLI_BACKEND behind adaptive timeouts, retries and a circuit breaker (see resilience.py),
+# and behind the host-wide limit on concurrent CLI calls when workers share state
+GENERATION_BACKEND = resilient_from_env(CLI_BACKEND)
+if SHARED_STATE:
+    GENERATION_BACKEND = slot_limited_from_env(GENERATION_BACKEND, SHARED_STATE)
+
+# Completed reports, keyed on notes + format + template (see report_cache.py)
+REPORT_CACHE = cache_from_env()
+
+
+def built_on_first_use(build):
+    """
+    Decorate a factory so it runs on the first call, once however many
+    threads ask at the same time; later calls return what it built. Keeps
+    subsystems the hot endpoint does not need out of every worker's start.
+    """
+    lock = threading.Lock()
+    built = []
+
+    @functools.wraps(build)
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(build())
+        return built[0]
+
+    get.built = lambda: bool(built)
+    return get
+
+
+@built_on_first_use
+def report_store():
+    """Every finished report, searchable and kept indefinitely (see report_store.py); None when disabled"""
+    return store_from_env()
+
+
+@built_on_first_use
+def similar_incidents():
+    """
+    MinHash/LSH index of earlier incidents, so notes nearly identical to one
+    already reported on reuse its reports (see similarity_index.py); None
+    when disabled
+    """
+    return index_from_env()
+
+
+def warm_up_in_background():
+    """
+    Build the report store and similarity index on a thread while the server
+    starts. Every generation uses them, so left to first use they would add
+    their setup, and the load of up to SIMILARITY_INDEX_MAX signatures, to
+    the first report. Servers call this once they are up; a failed build is
+    retried on first use.
+    """
+    def warm_up():
+        for build in (report_store, similar_incidents):
+            try:
+                build()
+            except Exception as e:
+                print(f"⚠️ Could not build {build.__name__} at startup: {str(e)}")
+
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+# Caps concurrent Claude CLI generations and queues the rest (see worker_pool.py)
+GENERATION_POOL = pool_from_env()
+
+# Running, queued and recently finished generations, for cancellation and
+# single-flight deduplication of identical requests (see jobs.py), shared
+# with the other workers when there are any
+JOBS = shared_registry_from_env(SHARED_STATE) if SHARED_STATE else registry_from_env()
+
+# Request IDs for events and log lines, and a ring buffer of recent request
+# traces served by /debug/traces (see tracing.py). Servers prefix log lines
+# with request IDs once they start (tracing.install_log_prefix).
+TRACES = recorder_from_env()
+
+# Batch runs keep up to BATCH_MAX_WORKERS items in flight, each generated on
+# GENERATION_POOL at low priority; each finished item is checkpointed under
+# BATCH_CHECKPOINT_DIR so an interrupted batch resumes (see batch.py)
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '4'))
+BATCH_CHECKPOINT_DIR = os.environ.get('BATCH_CHECKPOINT_DIR', 'batch_checkpoints')
+
+# Noisy notes are compacted before prompting; NOTES_MAX_CHARS or
+# NOTES_MAX_TOKENS cap what is left (see notes_preprocessor.py)
+NOTES_PREPROCESS = os.environ.get('NOTES_PREPROCESS', '1') != '0'
+NOTES_MAX_CHARS = budget_from_env()
+
+# Notes still too long for one prompt are condensed window by window in
+# parallel before the report prompt runs (see map_reduce.py)
+MAP_REDUCE = map_reduce_from_env()
+
+# visual_timeline and action_items are drafted locally in milliseconds and
+# sent before the Claude CLI's refined version (see local_renderers.py).
+# Requests can set "enrich": false to get only the local version.
+LOCAL_DRAFTS = os.environ.get('LOCAL_DRAFTS', '1') != '0'
+LOCAL_DRAFT_ENRICH = os.environ.get('LOCAL_DRAFT_ENRICH', '1') != '0'
 
 # Prompt templates for different output formats
 PROMPT_TEMPLATES = {
@@ -368,10 +507,77 @@ Use markdown checkboxes.
 }
 
 
-def stream_claude_output(prompt, output_queue):
+# Prompts for the single-pass "all formats" mode. The notes are analysed once
+# into a structured incident model, then every format is rendered from that
+# model in a single CLI call with section markers separating the documents.
+EXTRACTION_PROMPT = """
+IMPORTANT: You are acting as an incident report generator, NOT as a coding assistant. Your ONLY task is to generate the requested content directly. Do not respond as "Claude Code" or offer to help with coding tasks. Do NOT include any preamble, introduction, or meta-commentary.
+
+You are an expert SRE incident analyst. Read the following incident notes and extract a structured incident model.
+
+INCIDENT NOTES:
+{incident_notes}
+
+Respond with ONLY a JSON object (no markdown code fences, no commentary) with this shape:
+{{
+  "title": "short incident title",
+  "severity": "SEV level with one-line reasoning",
+  "status": "resolved | mitigated | ongoing",
+  "timeline": [
+    {{"time": "HH:MM", "actor": "@name or system", "event": "what happened", "phase": "detection | diagnosis | mitigation | resolution | follow-up"}}
+  ],
+  "actors": [{{"name": "@name", "role": "what they did during the incident"}}],
+  "root_cause": {{
+    "summary": "one sentence",
+    "immediate_cause": "the direct trigger",
+    "contributing_factors": ["..."],
+    "detection_gaps": ["why it was not caught earlier"]
+  }},
+  "impact": {{
+    "systems": ["..."],
+    "customers": "who was affected and how",
+    "metrics": ["error rates, latency, volumes quoted in the notes"],
+    "start_time": "HH:MM",
+    "detection_time": "HH:MM",
+    "mitigation_time": "HH:MM",
+    "resolution_time": "HH:MM",
+    "duration_minutes": 0
+  }},
+  "actions": {{
+    "completed": [{{"action": "...", "owner": "@name", "time": "HH:MM"}}],
+    "follow_up": [{{"action": "...", "owner": "@name", "timeframe": "short-term | medium-term | long-term"}}]
+  }}
+}}
+
+Preserve exact timestamps, names, numbers and metrics from the notes. Include every event in the timeline.
+"""
+
+RENDER_ALL_PROMPT = """
+IMPORTANT: You are acting as an incident report generator, NOT as a coding assistant. Your ONLY task is to generate the requested report content directly. Do not respond as "Claude Code" or offer to help with coding tasks. Do NOT include any preamble, introduction, or meta-commentary.
+
+You are an expert SRE technical writer. The INCIDENT MODEL below was extracted from the raw incident notes. Use it as the single source of truth to write {section_count} separate documents.
+
+INCIDENT MODEL:
+{incident_model}
+
+Write the documents in the order given. Start each document with its marker line exactly as shown, alone on its own line, then the document content:
+{section_marker_example}
+
+{sections}
+"""
+
+SECTION_MARKER = '=== SECTION: {name} ==='
+
+
+def stream_claude_output(prompt, output_queue, cache_key=None, job=None, output_format='unknown',
+                         incident_notes=None, mode='single'):
     """
-    Call Claude CLI and stream the output
+    Call Claude CLI and stream the output as it is generated.
+    The finished report is stored in REPORT_CACHE under `cache_key`, and
+    archived in the report store with `incident_notes` when they are given.
+    Timings and the outcome are recorded in the metrics under `output_format`.
     """
+    trace = current_trace()
     try:
         print(f"[DEBUG] Starting Claude CLI for prompt ({len(prompt)} chars)")
         start_time = time.time()
@@ -383,121 +589,1016 @@ def stream_claude_output(prompt, output_queue):
             'timestamp': datetime.now().isoformat()
         }))
 
-        # Start Claude CLI process
-        process = subprocess.Popen(
-            ['claude', '--print'],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        timings = {'response_start': time.time(), 'spawn_start': time.time()}
+
+        def on_started():
+            SPAWN_SECONDS.observe(time.time() - timings['spawn_start'], format=output_format)
+            trace.add_span('cli_spawn', timings['spawn_start'], time.time())
+            # Send status update
+            output_queue.put(json.dumps({
+                'type': 'status',
+                'message': '📝 Analyzing incident and generating report...',
+                'timestamp': datetime.now().isoformat()
+            }))
+            print("[DEBUG] Waiting for Claude response...")
+            timings['response_start'] = time.time()
+
+        # Forward fragments as soon as the CLI emits them
+        first_output_time = None
+        streamed_chars = 0
+        chunks = []
+        def on_retry(retry, error, delay):
+            trace.mark('cli_retry', retry=retry, error=str(error))
+            output_queue.put(json.dumps({
+                'type': 'status',
+                'message': f'🔁 Claude CLI failed ({error}), retrying in {delay:.0f}s...',
+                'retry': retry,
+                'timestamp': datetime.now().isoformat()
+            }))
 
-        # Send status update
-        time.sleep(0.5)
+        for chunk in GENERATION_BACKEND.iter_output(prompt, on_started=on_started, job=job,
+                                                    label=output_format, on_retry=on_retry):
+            if first_output_time is None:
+                first_output_time = time.time() - timings['response_start']
+                print(f"[DEBUG] First output after {first_output_time:.1f}s")
+                FIRST_OUTPUT_SECONDS.observe(first_output_time, format=output_format)
+                trace.add_span('first_output', timings['response_start'], time.time())
+                timings['first_output'] = time.time()
+            streamed_chars += len(chunk)
+            chunks.append(chunk)
+            # The bulk of the stream: no per-chunk timestamp or progress (see event_stream.py)
+            output_queue.put({'type': 'content', 'chunk': chunk})
+        trace.add_span('cli_stream', timings.get('first_output', time.time()), time.time(),
+                       chars=streamed_chars, chunks=len(chunks))
+        elapsed = time.time() - timings['response_start']
+        print(f"✅ Claude responded in {elapsed:.1f}s ({streamed_chars} chars)")
+        GENERATION_SECONDS.observe(elapsed, format=output_format)
+        GENERATIONS.inc(format=output_format, outcome='success')
+
+        if cache_key:
+            with trace.span('cache_store'):
+                cache_report(cache_key, ''.join(chunks), generation_time=elapsed)
+
+        # Send completion
+        total_time = time.time() - start_time
+        report_id = None
+        if incident_notes is not None:
+            with trace.span('archive'):
+                report_id = archive_report(incident_notes, output_format, ''.join(chunks), mode=mode,
+                                           generation_time=elapsed, first_output_time=first_output_time,
+                                           total_time=total_time)
         output_queue.put(json.dumps({
-            'type': 'status',
-            'message': '📝 Analyzing incident and generating report...',
+            'type': 'complete',
+            'success': True,
+            'cached': False,
+            'report_id': report_id,
+            'total_time': f"{total_time:.1f}s",
+            'generation_time': f"{elapsed:.1f}s",
+            'first_output_time': f"{first_output_time:.1f}s",
             'timestamp': datetime.now().isoformat()
         }))
 
-        # Send the prompt and wait for response
-        print(f"[DEBUG] Waiting for Claude response...")
-        response_start = time.time()
-        stdout, stderr = process.communicate(input=prompt, timeout=300)
-        elapsed = time.time() - response_start
-
-        if process.returncode == 0 and stdout:
-            print(f"✅ Claude responded in {elapsed:.1f}s ({len(stdout)} chars)")
+    except Exception as e:
+        output_queue.put(json.dumps(error_event_for(e, output_format)))
+
+
+def circuit_open_event(error):
+    """SSE error event for a generation refused because the Claude CLI keeps failing"""
+    retry_after = max(1, int(error.retry_after))
+    return {
+        'type': 'error',
+        'error': str(error),
+        'circuit_open': True,
+        'retry_after': retry_after,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def generation_outcome(error):
+    """The GENERATIONS outcome label for an exception that ended a generation"""
+    if isinstance(error, JobCancelled):
+        return 'cancelled'
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, subprocess.TimeoutExpired):
+        return 'timeout'
+    return 'error'
+
+
+def error_event_for(error, output_format):
+    """Log and count a generation that ended with `error`; returns its SSE error event"""
+    outcome = generation_outcome(error)
+    GENERATIONS.inc(format=output_format, outcome=outcome)
+    if outcome == 'cancelled':
+        print(f"🛑 Generation cancelled: {error}")
+        return {
+            'type': 'error',
+            'error': 'Generation cancelled',
+            'cancelled': True,
+            'timestamp': datetime.now().isoformat()
+        }
+    if outcome == 'circuit_open':
+        print(f"🔌 {str(error)}")
+        return circuit_open_event(error)
+    if outcome == 'timeout':
+        return {
+            'type': 'error',
+            'error': f'Claude CLI timed out after {error.timeout:.0f}s',
+            'timestamp': datetime.now().isoformat()
+        }
+    if isinstance(error, ClaudeCLIError):
+        print(f"❌ Claude failed: {str(error)}")
+    else:
+        print(f"❌ Error: {str(error)}")
+    return {
+        'type': 'error',
+        'error': str(error),
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def preprocess_notes(incident_notes):
+    """
+    Compact the notes for prompting. Returns (notes, events) where events
+    holds a status event describing the compaction, if any lines were
+    collapsed or dropped.
+    """
+    if not NOTES_PREPROCESS:
+        return incident_notes, []
+    notes, stats = compact_notes(incident_notes, NOTES_MAX_CHARS)
+    if not (stats['duplicates_collapsed'] or stats['boilerplate_dropped'] or stats['budget_dropped']):
+        return notes, []
+    print(f"🧹 Compacted incident notes: {stats['original_chars']} → {stats['compacted_chars']} chars "
+          f"({stats['duplicates_collapsed']} duplicates, {stats['boilerplate_dropped']} boilerplate, "
+          f"{stats['budget_dropped']} over budget)")
+    return notes, [{
+        'type': 'status',
+        'message': f"🧹 Compacted incident notes: {stats['original_chars']} → {stats['compacted_chars']} chars",
+        'compaction': dict(stats),
+        'timestamp': datetime.now().isoformat()
+    }]
+
+
+def local_draft_event(output_format, incident_notes, section=None):
+    """
+    A `draft` event holding the format rendered by its local renderer, or
+    None when the format has none (or local drafts are turned off)
+    """
+    renderer = LOCAL_RENDERERS.get(output_format)
+    if not LOCAL_DRAFTS or renderer is None:
+        return None
+    start_time = time.perf_counter()
+    try:
+        content = renderer(incident_notes)
+    except Exception as e:
+        print(f"❌ Local {output_format} renderer failed: {str(e)}")
+        return None
+    render_time = (time.perf_counter() - start_time) * 1000
+    print(f"⚡ Rendered {output_format} locally in {render_time:.1f}ms")
+    draft = {
+        'type': 'draft',
+        'content': content,
+        'renderer': 'local',
+        'render_time': f"{render_time:.0f}ms",
+        'timestamp': datetime.now().isoformat()
+    }
+    if section:
+        draft['section'] = section
+    return draft
+
+
+def local_report_events(draft):
+    """Events serving a local draft as the finished report, without the CLI"""
+    return [
+        {'type': 'status', 'message': f"⚡ Rendered locally in {draft['render_time']}",
+         'timestamp': draft['timestamp']},
+        {'type': 'content', 'chunk': draft['content'], 'timestamp': draft['timestamp']},
+        {'type': 'complete', 'success': True, 'cached': False, 'renderer': 'local',
+         'total_time': '0.0s', 'generation_time': draft['render_time'], 'timestamp': draft['timestamp']},
+    ]
+
+
+def needs_map_reduce(incident_notes):
+    """Whether notes are long enough to be condensed window by window first"""
+    return 0 < MAP_REDUCE['threshold_chars'] < len(incident_notes)
+
+
+def summarise_windows(incident_notes, output_queue=None, job=None, force_regenerate=False):
+    """
+    Map pass: split oversized notes into windows and condense them in
+    parallel, with a status event per finished window. Returns the combined
+    digests, which stand in for the notes in the report prompt. Runs in a
+    GENERATION_POOL slot; windows beyond the first run in idle slots
+    borrowed from the pool, so the pass stays within its concurrency cap.
+    """
+    windows = split_windows(incident_notes, MAP_REDUCE['window_chars'])
+    borrowed = GENERATION_POOL.borrow(min(MAP_REDUCE['max_parallel'], len(windows)) - 1)
+    parallel = 1 + borrowed
+    print(f"🧩 Summarising {len(incident_notes)} chars of notes in {len(windows)} windows ({parallel} at a time)")
 
-            # Send status
+    def put(message, **fields):
+        if output_queue is not None:
             output_queue.put(json.dumps({
                 'type': 'status',
-                'message': f'✨ Generated in {elapsed:.1f}s. Streaming output...',
+                'message': message,
+                **fields,
                 'timestamp': datetime.now().isoformat()
             }))
 
-            # Stream the output in chunks
-            chars = list(stdout)
-            chunk_size = 20
-            total_chars = len(chars)
-
-            for i in range(0, total_chars, chunk_size):
-                chunk = ''.join(chars[i:i+chunk_size])
-                output_queue.put(json.dumps({
-                    'type': 'content',
-                    'chunk': chunk,
-                    'progress': f"{min(100, int((i+chunk_size)/total_chars*100))}%",
-                    'timestamp': datetime.now().isoformat()
-                }))
-                time.sleep(0.02)  # Typing effect
-
-            # Send completion
-            total_time = time.time() - start_time
+    start_time = time.time()
+    digests = {}
+    try:
+        put(f'🧩 Notes are too long for one pass; summarising {len(windows)} windows, {parallel} at a time...',
+            windows=len(windows))
+        for window, digest, cached in iter_window_digests(windows, GENERATION_BACKEND, REPORT_CACHE,
+                                                           parallel, job, force_regenerate):
+            digests[window['index']] = digest
+            put(window_status_message(window, len(digests), len(windows), cached),
+                window=window['index'], windows=len(windows), completed_windows=len(digests))
+    finally:
+        GENERATION_POOL.give_back(borrowed)
+    print(f"✅ Summarised {len(windows)} windows in {time.time() - start_time:.1f}s")
+    return combine_digests(windows, digests)
+
+
+def window_status_message(window, completed, total, cached):
+    period = f" ({window['start']} – {window['end']})" if window['start'] else ''
+    source = ' from cache' if cached else ''
+    return f"🧩 Window {window['index']}/{total}{period} summarised{source} [{completed}/{total}]"
+
+
+def stream_map_reduce(incident_notes, output_queue, output_format, cache_key=None,
+                      force_regenerate=False, job=None):
+    """
+    Generate a report from notes too long for one prompt: condense them
+    window by window, then stream the chosen format from the digests.
+    The report is cached under `cache_key`, computed from the full notes.
+    """
+    try:
+        digest = summarise_windows(incident_notes, output_queue, job, force_regenerate)
+    except Exception as e:
+        output_queue.put(json.dumps(error_event_for(e, output_format)))
+        return
+
+    prompt = PROMPT_TEMPLATES[output_format].format(
+        incident_notes=digest,
+        date=datetime.now().strftime('%B %d, %Y')
+    )
+    stream_claude_output(prompt, output_queue, cache_key=cache_key, job=job, output_format=output_format,
+                         incident_notes=incident_notes, mode='map_reduce')
+
+
+def generate_report(incident_notes, output_format, force_regenerate=False, job=None, priority=None, client=None):
+    """
+    Generate one report without streaming, going through REPORT_CACHE.
+    Returns (content, generation_time, cached). Errors from the CLI are
+    raised to the caller. With a `priority` class the CLI work waits its
+    turn on GENERATION_POOL like any other generation (batch items use
+    'low'); cache hits return without queuing.
+    """
+    incident_notes, _ = preprocess_notes(incident_notes)
+    prompt_template = PROMPT_TEMPLATES[output_format]
+    cache_key = make_cache_key(incident_notes, output_format, prompt_template)
+    remember_incident(incident_notes, {output_format: cache_key})
+    entry = None if force_regenerate else REPORT_CACHE.get(cache_key)
+    if entry:
+        CACHED_RESPONSES.inc(format=output_format)
+        return entry['content'], entry['generation_time'], True
+
+    mode = 'map_reduce' if needs_map_reduce(incident_notes) else 'single'
+
+    def produce():
+        start_time = time.time()
+        prompt_notes = incident_notes
+        if mode == 'map_reduce':
+            prompt_notes = summarise_windows(incident_notes, job=job, force_regenerate=force_regenerate)
+        prompt = prompt_template.format(
+            incident_notes=prompt_notes,
+            date=datetime.now().strftime('%B %d, %Y')
+        )
+        content = ''.join(GENERATION_BACKEND.iter_output(prompt, job=job, label=output_format))
+        return content, time.time() - start_time
+
+    try:
+        content, elapsed = run_on_pool(produce, job, priority, client) if priority else produce()
+    except Exception as e:
+        GENERATIONS.inc(format=output_format, outcome=generation_outcome(e))
+        raise
+    GENERATION_SECONDS.observe(elapsed, format=output_format)
+    GENERATIONS.inc(format=output_format, outcome='success')
+    cache_report(cache_key, content, generation_time=elapsed)
+    archive_report(incident_notes, output_format, content, mode=mode, generation_time=elapsed, total_time=elapsed)
+    return content, elapsed, False
+
+
+class DiscardedOutput:
+    """Output queue for pool work whose queue status events nobody follows"""
+
+    def put(self, message):
+        pass
+
+
+def run_on_pool(fn, job=None, priority='low', client=None):
+    """
+    Call `fn()` on a GENERATION_POOL worker in `priority` class and return
+    its result on this thread, for callers that need the result rather than
+    a stream (batch items). While the pool's queue is full this waits for
+    room instead of failing. Raises what `fn` raises, or JobCancelled if
+    `job` is cancelled first.
+    """
+    done = threading.Event()
+    outcome = {}
+    trace = current_trace()
+
+    def run():
+        try:
+            with bind_trace(trace):
+                outcome['result'] = fn()
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+
+    while True:
+        if job:
+            job.raise_if_cancelled()
+        try:
+            GENERATION_POOL.submit(run, DiscardedOutput(), job, priority=priority, client=client)
+            break
+        except PoolFullError as e:
+            time.sleep(min(5, max(1, e.retry_after)))
+    # A cancelled job leaves the queue without running, so done may never be set
+    while not done.wait(1):
+        if job:
+            job.raise_if_cancelled()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+def build_render_all_prompt(incident_model, formats):
+    """
+    Build the single render prompt for several formats from PROMPT_TEMPLATES,
+    pointing each template at the incident model instead of the raw notes.
+    """
+    sections = [
+        f"{SECTION_MARKER.format(name=name)}\n{template_instructions(name, '(see INCIDENT MODEL above)')}"
+        for name in formats
+    ]
+
+    if not isinstance(incident_model, str):
+        incident_model = json.dumps(incident_model, indent=1, ensure_ascii=False)
+
+    return RENDER_ALL_PROMPT.format(
+        section_count=len(formats),
+        incident_model=incident_model,
+        section_marker_example=SECTION_MARKER.format(name='<name>'),
+        sections='\n\n'.join(sections)
+    )
+
+
+def template_instructions(name, notes_placeholder):
+    """
+    A format's prompt template without the shared preamble, with
+    `notes_placeholder` where the notes would go, for prompts that give the
+    notes elsewhere
+    """
+    instructions = PROMPT_TEMPLATES[name].format(
+        incident_notes=notes_placeholder,
+        date=datetime.now().strftime('%B %d, %Y')
+    )
+    # The shared preamble is already at the top of the combined prompt
+    return '\n'.join(
+        line for line in instructions.strip().splitlines()
+        if not line.startswith('IMPORTANT:')
+    ).strip()
+
+
+def parse_incident_model(text):
+    """
+    Parse the extraction stage output into a dict. Falls back to the raw text
+    when the CLI did not return valid JSON, which still works as render input.
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end + 1])
+        except ValueError:
+            pass
+    return text.strip()
+
+
+class SectionSplitter:
+    """
+    Split streamed text into sections on marker lines.
+
+    `feed()` returns (section, text) pairs. Text is passed through as soon as
+    it cannot be the start of a marker, so sections still stream
+    incrementally; call `flush()` at the end for any held-back text.
+    """
+
+    marker_prefix = SECTION_MARKER.split('{')[0]
+
+    def __init__(self, formats):
+        self.formats = formats
+        self.current = None
+        self.pending = ''
+
+    def feed(self, fragment):
+        parts = []
+        self.pending += fragment
+        while self.pending:
+            newline = self.pending.find('\n')
+            if newline == -1:
+                # Hold back a partial line only while it could still be a marker
+                if self.marker_prefix.startswith(self.pending) or self.pending.startswith(self.marker_prefix):
+                    break
+                if self.current:
+                    parts.append((self.current, self.pending))
+                self.pending = ''
+                break
+
+            line, self.pending = self.pending[:newline + 1], self.pending[newline + 1:]
+            stripped = line.strip()
+            if stripped.startswith(self.marker_prefix):
+                name = stripped[len(self.marker_prefix):].rstrip('= ').strip()
+                if name in self.formats:
+                    self.current = name
+                    continue
+            if self.current:
+                parts.append((self.current, line))
+        return parts
+
+    def flush(self):
+        parts = [(self.current, self.pending)] if self.current and self.pending else []
+        self.pending = ''
+        return parts
+
+
+def split_sections(fragments, formats):
+    """Yield (section, text) pairs from a stream of text fragments"""
+    splitter = SectionSplitter(formats)
+    for fragment in fragments:
+        yield from splitter.feed(fragment)
+    yield from splitter.flush()
+
+
+def stream_all_formats(incident_notes, output_queue, formats=None, force_regenerate=False, job=None,
+                       near_match=True):
+    """
+    Generate every report format from one shared analysis of the notes.
+
+    Stage 1 extracts a structured incident model; stage 2 renders all formats
+    from it in one CLI call. Content events carry a `section` tag. Cached
+    sections, and with `near_match` those of a near-identical incident, are
+    replayed first and only the missing ones are rendered.
+    """
+    formats = formats or list(PROMPT_TEMPLATES)
+    try:
+        start_time = time.time()
+        cache_keys = {
+            name: make_cache_key(incident_notes, name, PROMPT_TEMPLATES[name])
+            for name in formats
+        }
+        remember_incident(incident_notes, cache_keys)
+
+        cached = []
+        if not force_regenerate:
+            for name in formats:
+                entry = REPORT_CACHE.get(cache_keys[name])
+                match = find_near_match(incident_notes, name) if not entry and near_match else None
+                if entry:
+                    CACHED_RESPONSES.inc(format=name)
+                    events = cached_report_events(entry, section=name)
+                elif match:
+                    events = near_match_events(*match, section=name)
+                else:
+                    continue
+                for event in events:
+                    output_queue.put(json.dumps(event))
+                cached.append(name)
+        formats = [name for name in formats if name not in cached]
+
+        if not formats:
             output_queue.put(json.dumps({
                 'type': 'complete',
                 'success': True,
-                'total_time': f"{total_time:.1f}s",
-                'generation_time': f"{elapsed:.1f}s",
+                'cached': True,
+                'sections': cached,
+                'missing_sections': [],
+                'total_time': f"{time.time() - start_time:.1f}s",
                 'timestamp': datetime.now().isoformat()
             }))
+            return
+
+        print(f"[DEBUG] Generating {len(formats)} formats in one pass ({len(incident_notes)} chars of notes)")
+
+        # Formats with a local renderer get a draft straight away
+        for name in formats:
+            draft = local_draft_event(name, incident_notes, section=name)
+            if draft:
+                output_queue.put(json.dumps(draft))
+
+        model_key = make_cache_key(incident_notes, 'incident_model', EXTRACTION_PROMPT)
+        model_entry = None if force_regenerate else REPORT_CACHE.get(model_key)
+        if model_entry:
+            incident_model = parse_incident_model(model_entry['content'])
         else:
-            print(f"❌ Claude failed: {stderr}")
+            extraction_notes = incident_notes
+            if needs_map_reduce(incident_notes):
+                # The model is extracted from the window digests
+                extraction_notes = summarise_windows(incident_notes, output_queue, job, force_regenerate)
             output_queue.put(json.dumps({
-                'type': 'error',
-                'error': stderr or 'Process failed',
+                'type': 'status',
+                'message': '🔍 Extracting timeline, root cause and impact...',
                 'timestamp': datetime.now().isoformat()
             }))
+            extraction = ''.join(GENERATION_BACKEND.iter_output(
+                EXTRACTION_PROMPT.format(incident_notes=extraction_notes), job=job, label='incident_model'
+            ))
+            incident_model = parse_incident_model(extraction)
+            cache_report(model_key, extraction, generation_time=time.time() - start_time)
+        extraction_time = time.time() - start_time
+        print(f"✅ Incident model ready in {extraction_time:.1f}s")
 
-    except subprocess.TimeoutExpired:
-        process.kill()
         output_queue.put(json.dumps({
-            'type': 'error',
-            'error': 'Claude CLI timed out after 5 minutes',
+            'type': 'incident_model',
+            'model': incident_model,
             'timestamp': datetime.now().isoformat()
         }))
-    except Exception as e:
-        print(f"❌ Error: {str(e)}")
         output_queue.put(json.dumps({
-            'type': 'error',
-            'error': str(e),
+            'type': 'status',
+            'message': f'📝 Writing {len(formats)} reports from the incident model...',
+            'timestamp': datetime.now().isoformat()
+        }))
+
+        render_start = time.time()
+        completed = []
+        sections = {}
+
+        def finish_section(name):
+            content, elapsed = ''.join(sections[name]), time.time() - render_start
+            cache_report(cache_keys[name], content, generation_time=elapsed)
+            report_id = archive_report(incident_notes, name, content, mode='all', generation_time=elapsed,
+                                       total_time=time.time() - start_time)
+            output_queue.put(json.dumps({
+                'type': 'section_complete',
+                'section': name,
+                'report_id': report_id,
+                'timestamp': datetime.now().isoformat()
+            }))
+
+        fragments = GENERATION_BACKEND.iter_output(build_render_all_prompt(incident_model, formats), job=job,
+                                                   label='all')
+        for section, chunk in split_sections(fragments, formats):
+            if not completed or completed[-1] != section:
+                if completed:
+                    finish_section(completed[-1])
+                completed.append(section)
+                sections[section] = []
+            sections[section].append(chunk)
+            output_queue.put({'type': 'content', 'section': section, 'chunk': chunk})
+        if completed:
+            finish_section(completed[-1])
+
+        missing = [name for name in formats if name not in completed]
+        render_time = time.time() - render_start
+        total_time = time.time() - start_time
+        print(f"✅ Rendered {len(completed)}/{len(formats)} reports in {render_time:.1f}s")
+        GENERATION_SECONDS.observe(total_time, format='all')
+        GENERATIONS.inc(format='all', outcome='success' if not missing else 'error')
+
+        output_queue.put(json.dumps({
+            'type': 'complete',
+            'success': not missing,
+            'cached': False,
+            'sections': cached + completed,
+            'missing_sections': missing,
+            'extraction_time': f"{extraction_time:.1f}s",
+            'generation_time': f"{render_time:.1f}s",
+            'total_time': f"{total_time:.1f}s",
             'timestamp': datetime.now().isoformat()
         }))
 
+    except Exception as e:
+        output_queue.put(json.dumps(error_event_for(e, 'all')))
+
+
+def cached_report_events(entry, section=None):
+    """
+    Build the SSE events that replay a cached report, mirroring what a live
+    generation emits so clients need no special handling.
+    """
+    tag = {'section': section} if section else {}
+    events = [
+        {'type': 'status', 'message': '⚡ Loaded from cache', **tag},
+        {'type': 'content', 'chunk': entry['content'], **tag},
+    ]
+    if section:
+        events.append({'type': 'section_complete', 'section': section, 'cached': True})
+    else:
+        generation_time = entry.get('generation_time')
+        events.append({
+            'type': 'complete',
+            'success': True,
+            'cached': True,
+            'total_time': '0.0s',
+            'generation_time': f"{generation_time:.1f}s" if generation_time is not None else None,
+        })
+    timestamp = datetime.now().isoformat()
+    return [dict(event, timestamp=timestamp) for event in events]
+
+
+def archive_report(incident_notes, output_format, content, mode='single', **timings):
+    """
+    Keep a finished report in the report store; returns its ID, or None when
+    the store is disabled or the write failed
+    """
+    store = report_store()
+    if store is None or not content.strip():
+        return None
+    try:
+        return store.save(incident_notes, output_format, PROMPT_TEMPLATES.get(output_format, ''),
+                                 content, mode=mode, **timings)
+    except Exception as e:
+        print(f"⚠️ Could not archive {output_format} report: {str(e)}")
+        return None
+
+
+def cache_report(cache_key, content, generation_time=None):
+    """
+    Keep a finished report in REPORT_CACHE; a failed write (a locked or full
+    SQLite file) is logged rather than failing a report that already streamed
+    """
+    try:
+        REPORT_CACHE.put(cache_key, content, generation_time=generation_time)
+    except Exception as e:
+        print(f"⚠️ Could not cache report: {str(e)}")
+
+
+def remember_incident(incident_notes, cache_keys):
+    """Index the notes with their report cache keys ({format: key}) for near-match lookups"""
+    index = similar_incidents()
+    if index is not None:
+        index.add(incident_notes, cache_keys)
 
-def generate_sse_stream(prompt):
+
+def find_near_match(incident_notes, output_format):
+    """
+    The cached report of the most similar earlier incident with this format,
+    as (entry, similarity), or None
     """
-    Generate Server-Sent Events stream
+    index = similar_incidents()
+    if index is None:
+        return None
+    start_time = time.perf_counter()
+    for similarity, key in index.query(incident_notes, output_format):
+        entry = REPORT_CACHE.get(key)
+        if entry:
+            print(f"🔎 Near match for {output_format}: {similarity:.0%} similar "
+                  f"({(time.perf_counter() - start_time) * 1000:.1f}ms)")
+            NEAR_MATCH_RESPONSES.inc(format=output_format)
+            return entry, similarity
+    return None
+
+
+def near_match_events(entry, similarity, section=None):
     """
-    output_queue = queue.Queue()
+    Replay a near match's report like a cached one, flagging the final
+    event so the client can offer to regenerate
+    """
+    events = cached_report_events(entry, section)
+    events[0]['message'] = f"≈ Reused the report of a {similarity:.0%} similar incident"
+    events[-1].update(near_match=True, similarity=round(similarity, 3))
+    return events
 
-    # Start streaming in a separate thread
-    thread = threading.Thread(target=stream_claude_output, args=(prompt, output_queue))
-    thread.daemon = True
-    thread.start()
 
+def generate_sse_stream(subscription, output_format='unknown', encoder=None):
+    """
+    Generate the event stream for one client following a job, in the wire
+    format `encoder` was built for (plain SSE by default). The request's
+    trace gets the time spent waiting for events and writing frames.
+    """
+    encoder = encoder or StreamEncoder()
+    trace = current_trace()
+    sent = {'frames': 0, 'bytes': 0, 'wait_seconds': 0.0, 'write_seconds': 0.0}
     # Stream events as they arrive
     timeout_counter = 0
     max_timeout = 300
 
-    while True:
-        try:
-            message = output_queue.get(timeout=1)
-            yield f"data: {message}\n\n"
-
-            # Check if done
-            data = json.loads(message)
-            if data['type'] in ['complete', 'error']:
+    OPEN_SSE_CONNECTIONS.inc()
+    opened_at = time.time()
+    try:
+        while True:
+            if subscription.job.done and subscription.index >= len(subscription.job.events):
+                # Resumed after the final event; there is nothing left to send
+                subscription.finished = True
                 break
+            try:
+                waited_from = time.time()
+                frame = subscription.get_frame(timeout=1, window=COALESCE_SECONDS, max_chars=COALESCE_CHARS)
+                sent['wait_seconds'] += time.time() - waited_from
+                if subscription.skipped:
+                    yield encoder.frame({'type': 'status', 'message': f'⚠️ {subscription.skipped} earlier events are no longer available', 'skipped_events': subscription.skipped, 'timestamp': datetime.now().isoformat()})
+                    subscription.skipped = 0
+                data = encoder.frame(frame.event, frame.encoded, subscription.last_id)
+                if not sent['frames']:
+                    trace.mark('first_frame', event_id=subscription.last_id)
+                write_from = time.time()
+                # Resumes once the server has written the frame to the client
+                yield data
+                written = time.time()
+                if written - write_from >= 0.001:
+                    trace.add_span('sse_write', write_from, written, bytes=len(data))
+                sent['frames'] += 1
+                sent['bytes'] += len(data)
+                sent['write_seconds'] += written - write_from
+
+                # Check if done
+                if frame.event['type'] in ['complete', 'error']:
+                    subscription.finished = True
+                    break
+
+            except queue.Empty:
+                sent['wait_seconds'] += time.time() - waited_from
+                timeout_counter += 1
+                if timeout_counter >= max_timeout:
+                    subscription.timed_out = True
+                    yield encoder.frame({'type': 'error', 'error': 'Timeout after 5 minutes'})
+                    break
+
+                # Heartbeat every 10 seconds
+                if timeout_counter % 10 == 0:
+                    yield encoder.frame({'type': 'heartbeat', 'message': f'Processing... ({timeout_counter}s)', 'timestamp': datetime.now().isoformat()})
+        yield encoder.close()
+    finally:
+        OPEN_SSE_CONNECTIONS.dec()
+        SSE_STREAM_SECONDS.observe(time.time() - opened_at, format=output_format)
+        sent['wait_seconds'] = round(sent['wait_seconds'], 3)
+        sent['write_seconds'] = round(sent['write_seconds'], 3)
+        trace.add_span('sse_stream', opened_at, time.time(), job_id=subscription.job.id, **sent)
+
+
+def plan_generation(incident_notes, output_format, force_regenerate=False, enrich=True, near_match=True,
+                    priority=None):
+    """
+    Work out how to serve a generation request. Returns
+    {'description', 'cached_events'} when the report is cached, reused from
+    a near-identical incident (unless `near_match` is off) or rendered
+    locally with `enrich` off; otherwise the keyword arguments for
+    start_generation(), with the queue priority: `priority` if it is a
+    valid class, else one detected from the notes.
+    """
+    # Every format is generated from the same compacted notes
+    with span('preprocess_notes', chars=len(incident_notes)):
+        incident_notes, notes_events = preprocess_notes(incident_notes)
+
+    # One shared analysis for every format, multiplexed on one stream
+    if output_format == 'all':
+        return {
+            'worker': lambda output_queue, job: stream_all_formats(
+                incident_notes, output_queue, force_regenerate=force_regenerate, job=job,
+                near_match=near_match
+            ),
+            'description': 'all',
+            'key': request_key('all', normalize_notes(incident_notes), *([] if near_match else ['exact'])),
+            'join_finished': not force_regenerate,
+            'initial_events': notes_events,
+            'priority': request_priority(incident_notes, 'all', priority),
+        }
 
-        except queue.Empty:
-            timeout_counter += 1
-            if timeout_counter >= max_timeout:
-                yield f"data: {json.dumps({'type': 'error', 'error': 'Timeout after 5 minutes'})}\n\n"
-                break
+    # Get the appropriate prompt template
+    if output_format not in PROMPT_TEMPLATES:
+        output_format = 'executive_summary'
+    prompt_template = PROMPT_TEMPLATES[output_format]
+
+    # Replay a previously generated report for identical input
+    with span('cache_lookup') as lookup:
+        cache_key = make_cache_key(incident_notes, output_format, prompt_template)
+        remember_incident(incident_notes, {output_format: cache_key})
+        entry = None if force_regenerate else REPORT_CACHE.get(cache_key)
+        lookup['hit'] = entry is not None
+    if entry:
+        print(f"⚡ Cache hit for {output_format}")
+        CACHED_RESPONSES.inc(format=output_format)
+        return {'description': output_format, 'cached_events': notes_events + cached_report_events(entry)}
+
+    # Reuse the report of a nearly identical incident; the client can regenerate
+    with span('near_match_lookup'):
+        match = find_near_match(incident_notes, output_format) if near_match and not force_regenerate else None
+    if match:
+        return {'description': output_format, 'cached_events': notes_events + near_match_events(*match)}
+
+    # Send a locally rendered draft first; the CLI refines it unless `enrich` is off
+    with span('local_draft'):
+        draft = local_draft_event(output_format, incident_notes)
+    if draft and not enrich:
+        return {'description': output_format, 'cached_events': notes_events + local_report_events(draft)}
+    if draft:
+        notes_events = notes_events + [draft]
+
+    # Condense oversized notes window by window, then write the report
+    if needs_map_reduce(incident_notes):
+        return {
+            'worker': lambda output_queue, job: stream_map_reduce(
+                incident_notes, output_queue, output_format, cache_key=cache_key,
+                force_regenerate=force_regenerate, job=job
+            ),
+            'description': output_format,
+            'key': request_key('map_reduce', output_format, normalize_notes(incident_notes)),
+            'join_finished': not force_regenerate,
+            'initial_events': notes_events,
+            'priority': request_priority(incident_notes, output_format, priority),
+        }
+
+    # Format the prompt with incident notes and current date
+    with span('format_prompt'):
+        prompt = prompt_template.format(
+            incident_notes=incident_notes,
+            date=datetime.now().strftime('%B %d, %Y')
+        )
+    return {
+        'worker': lambda output_queue, job: stream_claude_output(
+            prompt, output_queue, cache_key=cache_key, job=job, output_format=output_format,
+            incident_notes=incident_notes
+        ),
+        'description': output_format,
+        'key': request_key(prompt),
+        'join_finished': not force_regenerate,
+        'initial_events': notes_events,
+        'priority': request_priority(incident_notes, output_format, priority),
+    }
+
+
+def request_key(*parts):
+    """Single-flight key for a generation request"""
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class JobOutput:
+    """
+    Output queue handed to a job's worker: publishes each event to the job's
+    broadcast and keeps the report text for GET /api/jobs/<id>. Takes an
+    event's JSON, or the event dict itself on hot paths so it is encoded
+    once, when first sent.
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def put(self, message):
+        event = message if isinstance(message, dict) else json.loads(message)
+        self.job.record_event(event)
+        self.job.events.put(message, event)
+
+
+def start_generation(worker, description='', key=None, join_finished=True, detached=False,
+                     initial_events=(), priority='normal', client=None):
+    """
+    Attach to an identical job, or start `worker` on the worker pool.
+
+    If an identical request (same `key`) is already in flight, or finished
+    within the retention window and `join_finished` is set, the caller is
+    subscribed to that job. Otherwise `initial_events` are published and
+    `worker` is called on a pool thread with the job's output queue and the
+    Job, queued by `priority` class and fairly among clients. Returns
+    (subscription, created).
+    Raises PoolFullError when the pool's wait queue is full; the rejection is
+    published to the job first so anyone who attached meanwhile gets it.
+    """
+    trace = current_trace()
+    subscription, created = JOBS.claim(
+        Job(description, key=key), include_finished=join_finished, detached=detached
+    )
+    job = subscription.job
+
+    if created:
+        job.trace = trace
+        trace.mark('job_created', job_id=job.id)
+        for event in initial_events:
+            JobOutput(job).put(json.dumps(event))
+        submitted_at = time.time()
+
+        def run():
+            succeeded = False
+            trace.add_span('queue_wait', submitted_at, time.time(), priority=priority)
+            try:
+                # Log lines and spans from the generation belong to the request that started it
+                with bind_trace(trace), trace.span('generation', job_id=job.id):
+                    worker(JobOutput(job), job)
+                succeeded = job.final_event is not None and job.final_event['type'] == 'complete'
+            finally:
+                JOBS.finish(job, succeeded)
 
-            # Heartbeat every 10 seconds
-            if timeout_counter % 10 == 0:
-                yield f"data: {json.dumps({'type': 'heartbeat', 'message': f'Processing... ({timeout_counter}s)', 'timestamp': datetime.now().isoformat()})}\n\n"
+        try:
+            GENERATION_POOL.submit(run, job.events, job, priority=priority, client=client)
+        except PoolFullError as e:
+            retry_after = max(1, int(e.retry_after))
+            print(f"🚦 Rejected generation, queue full (retry after {retry_after}s)")
+            JobOutput(job).put(json.dumps({'type': 'error', 'error': str(e), 'retry_after': retry_after}))
+            JOBS.finish(job, succeeded=False)
+            JOBS.release(subscription)
+            raise
+    else:
+        print(f"🔗 Attached to in-flight job {job.id} ({description})")
+        trace.mark('attached_to_job', job_id=job.id,
+                   job_request_id=job.trace.request_id if job.trace else None)
+    return subscription, created
+
+
+def start_cached_job(description, events):
+    """Register an already finished, detached job holding replayed cache events"""
+    subscription, _ = JOBS.claim(Job(description), detached=True)
+    job = subscription.job
+    output = JobOutput(job)
+    for event in events:
+        output.put(json.dumps(event))
+    JOBS.finish(job, succeeded=True)
+    JOBS.release(subscription)
+    return job
+
+
+def request_client():
+    """Who a request is from, for fair queuing: its API key, else its address"""
+    return request.headers.get('X-API-Key') or request.remote_addr
+
+
+def request_encoder():
+    """The stream encoder a request asked for with `stream`, `compress` and `timestamps`"""
+    return encoder_from_request(request.args, request.headers.get('Accept-Encoding'),
+                                request_id=current_trace().request_id or None)
+
+
+def events_response(events, status=200, headers=None):
+    """A complete (not streamed) event stream response, in the wire format the request asked for"""
+    encoder = request_encoder()
+    with span('replay_events', events=len(events)) as replay:
+        body = b''.join(encoder.frame(event) for event in events) + encoder.close()
+        replay['bytes'] = len(body)
+    return Response(body, status=status, headers={**(headers or {}), **encoder.headers},
+                    content_type=encoder.content_type)
+
+
+def event_stream_response(subscription):
+    """
+    Event stream response following a job, in the wire format the request
+    asked for; closing it releases the subscription
+    """
+    job = subscription.job
+    encoder = request_encoder()
+    response = Response(
+        stream_with_context(generate_sse_stream(subscription, output_format=job.description, encoder=encoder)),
+        headers={'X-Job-ID': job.id, **encoder.headers},
+        content_type=encoder.content_type
+    )
+    # If the client goes away before the final event and nobody else is
+    # following the job, this cancels it so its CLI process and slot are freed
+    response.call_on_close(lambda: JOBS.release(subscription))
+    return response
+
+
+def stream_generation(worker, description='', key=None, join_finished=True, initial_events=(),
+                      priority='normal', client=None):
+    """
+    Stream a generation job's events to the client, starting or joining the
+    job with start_generation(). Returns a 429 straight away when the pool's
+    wait queue is full.
+    """
+    try:
+        subscription, _ = start_generation(worker, description, key, join_finished,
+                                           initial_events=initial_events, priority=priority, client=client)
+    except PoolFullError as e:
+        retry_after = max(1, int(e.retry_after))
+        return events_response([{'type': 'error', 'error': str(e), 'retry_after': retry_after}],
+                               status=429, headers={'Retry-After': str(retry_after)})
+    return event_stream_response(subscription)
+
+
+@app.before_request
+def start_request_trace():
+    """Give every API request an ID and, when sampled, a trace of where its time goes"""
+    trace = None
+    if request.path.startswith('/api/'):
+        trace = TRACES.start(request.endpoint or request.path, request.headers.get('X-Request-ID'))
+    g.trace_token = CURRENT_TRACE.set(trace)
+
+
+@app.teardown_request
+def end_request_trace(error=None):
+    """Forget the request's trace; server threads are reused, and so is their context"""
+    token = g.pop('trace_token', None)
+    if token is not None:
+        CURRENT_TRACE.reset(token)
+
+
+@app.after_request
+def add_request_id(response):
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        response.headers['X-Request-ID'] = trace.request_id
+        # Closing happens once a streamed response has been fully sent
+        response.call_on_close(trace.finish)
+    return response
 
 
 @app.route('/api/generate_report', methods=['POST'])
@@ -510,7 +1611,24 @@ def api_generate_report():
       - application/json
     produces:
       - text/event-stream
+      - application/x-ndjson
     parameters:
+      - name: stream
+        in: query
+        type: string
+        enum: [sse, ndjson]
+        default: sse
+        description: Wire format - SSE frames, or one JSON event per line without event IDs
+      - name: compress
+        in: query
+        type: boolean
+        default: false
+        description: Compress the stream with brotli or gzip, as Accept-Encoding allows
+      - name: timestamps
+        in: query
+        type: boolean
+        default: false
+        description: Add the send time to events without a timestamp (content events have none)
       - name: body
         in: body
         required: true
@@ -531,7 +1649,10 @@ def api_generate_report():
                 [14:35] @mike: latency dropping back to normal
             format:
               type: string
-              description: Output format for the generated report
+              description: >
+                Output format for the generated report. `all` extracts one
+                shared incident model and streams every format on one
+                connection, tagging content events with `section`.
               enum:
                 - executive_summary
                 - visual_timeline
@@ -540,8 +1661,35 @@ def api_generate_report():
                 - resolution
                 - action_items
                 - executive_communication
+                - all
               default: executive_summary
               example: executive_summary
+            force_regenerate:
+              type: boolean
+              description: Skip the report cache and always run the Claude CLI
+              default: false
+            enrich:
+              type: boolean
+              description: >
+                For visual_timeline and action_items, refine the locally
+                rendered draft with the Claude CLI. When false the local
+                version is returned as the report straight away.
+              default: true
+            near_match:
+              type: boolean
+              description: >
+                Reuse the report of an earlier incident whose notes are at
+                least SIMILARITY_THRESHOLD similar. The final event then
+                has `near_match` and `similarity`; send force_regenerate
+                to get a fresh report.
+              default: true
+            priority:
+              type: string
+              enum: [critical, high, normal, low]
+              description: >
+                Queue priority when generations have to wait for a worker.
+                By default it is detected from the incident's severity, one
+                class higher for exec-facing formats.
     responses:
       200:
         description: Server-Sent Events stream with generated report
@@ -550,20 +1698,51 @@ def api_generate_report():
           properties:
             type:
               type: string
-              enum: [status, content, complete, error, heartbeat]
+              enum: [status, draft, content, complete, error, heartbeat, incident_model, section_complete]
               description: Event type
             message:
               type: string
               description: Status message (for status/heartbeat events)
+            queue_position:
+              type: integer
+              description: Position in the generation queue (for status events while waiting)
+            estimated_wait:
+              type: string
+              description: Estimated time until generation starts (for status events while waiting)
+            priority:
+              type: string
+              description: Priority class of the queued generation (for queue status events)
+            queue_wait:
+              type: string
+              description: Time spent waiting for a worker (for the status event sent when a queued generation starts)
             chunk:
               type: string
               description: Content chunk (for content events)
-            progress:
+            content:
               type: string
-              description: Progress percentage (for content events)
+              description: >
+                Complete locally rendered report (for draft events, sent
+                before the refined version streams in)
+            section:
+              type: string
+              description: Report format the chunk belongs to (format=all only)
             generation_time:
               type: string
               description: Time taken to generate (for complete events)
+            first_output_time:
+              type: string
+              description: Time until the first content chunk arrived (for complete events)
+            cached:
+              type: boolean
+              description: True when the report was replayed from the cache (for complete events)
+            near_match:
+              type: boolean
+              description: >
+                True when the report was reused from a near-identical earlier
+                incident (for complete and section_complete events)
+            similarity:
+              type: number
+              description: Estimated similarity of the notes to that incident (with near_match)
             total_time:
               type: string
               description: Total processing time (for complete events)
@@ -572,8 +1751,22 @@ def api_generate_report():
               description: Error message (for error events)
         examples:
           status_event: {"type": "status", "message": "Connecting to Claude CLI...", "timestamp": "2025-10-09T18:00:00"}
-          content_event: {"type": "content", "chunk": "# Executive Summary\n", "progress": "10%", "timestamp": "2025-10-09T18:00:05"}
+          content_event: {"type": "content", "chunk": "# Executive Summary\n"}
           complete_event: {"type": "complete", "success": true, "generation_time": "12.5s", "total_time": "13.2s", "timestamp": "2025-10-09T18:00:15"}
+      429:
+        description: Too many queued generations - retry after the number of seconds in the Retry-After header
+        schema:
+          type: object
+          properties:
+            type:
+              type: string
+              example: error
+            error:
+              type: string
+              example: Server is busy generating other reports, please retry shortly
+            retry_after:
+              type: integer
+              example: 60
       400:
         description: Bad request - missing incident notes
         schema:
@@ -586,38 +1779,1245 @@ def api_generate_report():
               type: string
               example: No incident notes provided
     """
+    trace = current_trace()
     try:
-        data = request.get_json()
-        incident_notes = data.get('incident_notes', '').strip()
-        output_format = data.get('format', 'executive_summary')
+        with trace.span('parse_request', bytes=request.content_length):
+            data = request.get_json()
+            incident_notes = data.get('incident_notes', '').strip()
+            output_format = data.get('format', 'executive_summary')
+            force_regenerate = bool(data.get('force_regenerate', False))
+            enrich = bool(data.get('enrich', LOCAL_DRAFT_ENRICH))
+            near_match = bool(data.get('near_match', True))
+            priority = data.get('priority')
+        # Traces are filtered by format on /debug/traces
+        trace.name = output_format
 
         if not incident_notes:
-            return Response(
-                f"data: {json.dumps({'type': 'error', 'error': 'No incident notes provided'})}\n\n",
-                content_type='text/event-stream'
-            )
+            return events_response([{'type': 'error', 'error': 'No incident notes provided'}])
 
-        # Get the appropriate prompt template
-        prompt_template = PROMPT_TEMPLATES.get(output_format, PROMPT_TEMPLATES['executive_summary'])
-
-        # Format the prompt with incident notes and current date
-        prompt = prompt_template.format(
-            incident_notes=incident_notes,
-            date=datetime.now().strftime('%B %d, %Y')
-        )
+        with trace.span('plan'):
+            plan = plan_generation(incident_notes, output_format, force_regenerate, enrich, near_match, priority)
+        if 'cached_events' in plan:
+            return events_response(plan['cached_events'])
 
         # Stream the response
-        return Response(
-            stream_with_context(generate_sse_stream(prompt)),
-            content_type='text/event-stream'
-        )
+        return stream_generation(client=request_client(), **plan)
 
     except Exception as e:
         print(f"❌ API Error: {str(e)}")
-        return Response(
-            f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n",
-            content_type='text/event-stream'
-        )
+        return events_response([{'type': 'error', 'error': str(e)}])
+
+
+@app.route('/api/jobs', methods=['POST'])
+def api_create_job():
+    """Start a report generation in the background
+    ---
+    tags:
+      - Jobs
+    consumes:
+      - application/json
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: Same fields as /api/generate_report
+        schema:
+          type: object
+          required:
+            - incident_notes
+          properties:
+            incident_notes:
+              type: string
+            format:
+              type: string
+              default: executive_summary
+            force_regenerate:
+              type: boolean
+              default: false
+            enrich:
+              type: boolean
+              default: true
+            near_match:
+              type: boolean
+              default: true
+            priority:
+              type: string
+              enum: [critical, high, normal, low]
+    responses:
+      202:
+        description: >
+          The job is running (or was already running for an identical
+          request, or was served from the cache). It keeps running when
+          nobody is listening; follow it on events_url and fetch the report
+          from result_url.
+        schema:
+          type: object
+          properties:
+            job_id:
+              type: string
+            status:
+              type: string
+              enum: [running, succeeded, failed, cancelled]
+            events_url:
+              type: string
+            result_url:
+              type: string
+      400:
+        description: Bad request - missing incident notes
+      429:
+        description: Too many queued generations - retry after the number of seconds in the Retry-After header
+    """
+    data = request.get_json() or {}
+    incident_notes = data.get('incident_notes', '').strip()
+    if not incident_notes:
+        return jsonify({'error': 'No incident notes provided'}), 400
+
+    plan = plan_generation(
+        incident_notes,
+        data.get('format', 'executive_summary'),
+        bool(data.get('force_regenerate', False)),
+        bool(data.get('enrich', LOCAL_DRAFT_ENRICH)),
+        bool(data.get('near_match', True)),
+        data.get('priority')
+    )
+    if 'cached_events' in plan:
+        job = start_cached_job(plan['description'], plan['cached_events'])
+    else:
+        try:
+            subscription, _ = start_generation(detached=True, client=request_client(), **plan)
+        except PoolFullError as e:
+            retry_after = max(1, int(e.retry_after))
+            return jsonify({'error': str(e), 'retry_after': retry_after}), 429, {'Retry-After': str(retry_after)}
+        job = subscription.job
+        # Nobody is reading yet; clients follow the job on its events URL
+        JOBS.release(subscription)
+
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'events_url': f'/api/jobs/{job.id}/events',
+        'result_url': f'/api/jobs/{job.id}',
+    }), 202, {'X-Job-ID': job.id}
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_get_job(job_id):
+    """Get a job's status and, once it has finished, its report
+    ---
+    tags:
+      - Jobs
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: >
+          Job status. `result` maps each section to its report text
+          (`report` for single formats) and fills in as the job streams.
+          `drafts` holds locally rendered drafts the same way.
+          Finished jobs are kept for JOB_RETENTION_SECONDS.
+        schema:
+          type: object
+          properties:
+            job_id:
+              type: string
+            description:
+              type: string
+            status:
+              type: string
+              enum: [running, succeeded, failed, cancelled]
+            created_at:
+              type: string
+            finished_at:
+              type: string
+            event_count:
+              type: integer
+            result:
+              type: object
+            drafts:
+              type: object
+            final_event:
+              type: object
+      404:
+        description: Unknown or expired job
+    """
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({
+        'job_id': job.id,
+        'description': job.description,
+        'status': job.status,
+        'created_at': datetime.fromtimestamp(job.created_at).isoformat(),
+        'finished_at': datetime.fromtimestamp(job.done_at).isoformat() if job.done_at else None,
+        'event_count': len(job.events),
+        'result': job.result_text(),
+        'drafts': job.drafts,
+        'final_event': job.final_event,
+    })
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def api_job_events(job_id):
+    """Follow a job's events, resuming after the last one received
+    ---
+    tags:
+      - Jobs
+    produces:
+      - text/event-stream
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+      - name: Last-Event-ID
+        in: header
+        type: integer
+        required: false
+        description: ID of the last event received; the stream resumes after it
+      - name: last_event_id
+        in: query
+        type: integer
+        required: false
+        description: Same as the Last-Event-ID header, for clients that cannot set headers
+      - name: stream
+        in: query
+        type: string
+        enum: [sse, ndjson]
+        description: Wire format, as for /api/generate_report
+      - name: compress
+        in: query
+        type: boolean
+        description: Compress the stream, as for /api/generate_report
+    responses:
+      200:
+        description: >
+          Server-Sent Events with `id:` fields, the same events as
+          /api/generate_report. Events dropped from the job's bounded log
+          (JOB_EVENT_LOG_MAX) are reported with a status event carrying
+          `skipped_events`.
+      404:
+        description: Unknown or expired job
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        start = int(last_event_id) + 1 if last_event_id else 0
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an integer'}), 400
+
+    subscription = JOBS.subscribe(job_id, max(0, start))
+    if not subscription:
+        return jsonify({'error': 'Job not found'}), 404
+    return event_stream_response(subscription)
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def api_cancel_job(job_id):
+    """Cancel a running or queued report generation
+    ---
+    tags:
+      - Incident Reports
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+        description: Job ID from the X-Job-ID header of the generate_report response
+    responses:
+      200:
+        description: The job was cancelled; its Claude CLI process is terminated
+        schema:
+          type: object
+          properties:
+            job_id:
+              type: string
+            status:
+              type: string
+              example: cancelled
+      404:
+        description: No running or queued job with this ID
+      409:
+        description: The job has already finished
+    """
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.done:
+        return jsonify({'job_id': job.id, 'status': 'finished'}), 409
+
+    JOBS.cancel(job, 'cancelled by request')
+    return jsonify({'job_id': job.id, 'status': 'cancelled'})
+
+
+def live_full_prompt(incident_notes, output_format):
+    """Prompt for the first version of a live session's report"""
+    incident_notes, _ = preprocess_notes(incident_notes)
+    return PROMPT_TEMPLATES[output_format].format(
+        incident_notes=incident_notes,
+        date=datetime.now().strftime('%B %d, %Y')
+    )
+
+
+@built_on_first_use
+def session_registry():
+    """
+    Live incident sessions: notes are appended as the incident goes on and
+    only the affected reports are updated (see live_sessions.py)
+    """
+    from live_sessions import sessions_from_env
+    return sessions_from_env(
+        backend=GENERATION_BACKEND,
+        submit=GENERATION_POOL.submit,
+        full_prompt=live_full_prompt,
+        instructions=lambda name: template_instructions(name, '(see CURRENT REPORT and NEW INCIDENT NOTES above)'),
+    )
+
+
+# Heartbeat interval on the long-lived session streams
+SESSION_HEARTBEAT_SECONDS = 15
+
+
+def session_sse_stream(subscription, encoder=None):
+    """
+    Generate the event stream for one client following a live session,
+    until the session is closed
+    """
+    encoder = encoder or StreamEncoder()
+    job = subscription.job
+    OPEN_SSE_CONNECTIONS.inc()
+    opened_at = last_sent = time.time()
+    try:
+        while not (job.cancelled and subscription.index >= len(job.events)):
+            try:
+                frame = subscription.get_frame(timeout=1, window=COALESCE_SECONDS, max_chars=COALESCE_CHARS)
+            except queue.Empty:
+                if time.time() - last_sent >= SESSION_HEARTBEAT_SECONDS:
+                    last_sent = time.time()
+                    yield encoder.frame({'type': 'heartbeat', 'timestamp': datetime.now().isoformat()})
+                continue
+
+            if subscription.skipped:
+                yield encoder.frame({'type': 'status', 'message': f'⚠️ {subscription.skipped} earlier events are no longer available', 'skipped_events': subscription.skipped, 'timestamp': datetime.now().isoformat()})
+                subscription.skipped = 0
+            last_sent = time.time()
+            yield encoder.frame(frame.event, frame.encoded, subscription.last_id)
+            if frame.event['type'] == 'session_closed':
+                break
+        yield encoder.close()
+    finally:
+        OPEN_SSE_CONNECTIONS.dec()
+        SSE_STREAM_SECONDS.observe(time.time() - opened_at, format='session')
+        job.unsubscribe()
+
+
+def session_urls(session):
+    return {
+        'session_id': session.id,
+        'events_url': f'/api/sessions/{session.id}/events',
+        'append_url': f'/api/sessions/{session.id}/append',
+        'session_url': f'/api/sessions/{session.id}',
+    }
+
+
+@app.route('/api/sessions', methods=['POST'])
+def api_create_session():
+    """Open a live incident session
+    ---
+    tags:
+      - Live Sessions
+    consumes:
+      - application/json
+    parameters:
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            incident_notes:
+              type: string
+              description: Notes so far, if any; more are sent to the append URL
+            formats:
+              type: array
+              items:
+                type: string
+              description: >
+                Formats to keep up to date. visual_timeline and action_items
+                are maintained locally; the others are written by the Claude
+                CLI and updated when new events affect them.
+              default: [executive_summary, visual_timeline, root_cause_analysis, impact_assessment, resolution, action_items, executive_communication]
+    responses:
+      201:
+        description: The session is open; follow it on events_url and send new lines to append_url
+        schema:
+          type: object
+          properties:
+            session_id:
+              type: string
+            events_url:
+              type: string
+            append_url:
+              type: string
+            session_url:
+              type: string
+      400:
+        description: Unknown format
+      429:
+        description: Too many live sessions are open (LIVE_SESSION_MAX)
+    """
+    data = request.get_json(silent=True) or {}
+    formats = data.get('formats') or list(PROMPT_TEMPLATES)
+    unknown = sorted(set(formats) - set(PROMPT_TEMPLATES))
+    if unknown:
+        return jsonify({'error': f"Unknown format(s): {', '.join(unknown)}"}), 400
+
+    from live_sessions import TooManySessions
+
+    try:
+        session = session_registry().create(list(dict.fromkeys(formats)), data.get('incident_notes', '').strip(),
+                                          client=request_client())
+    except TooManySessions as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify(session_urls(session)), 201
+
+
+@app.route('/api/sessions/<session_id>/append', methods=['POST'])
+def api_append_session(session_id):
+    """Append new note lines to a live session
+    ---
+    tags:
+      - Live Sessions
+    consumes:
+      - application/json
+    parameters:
+      - name: session_id
+        in: path
+        type: string
+        required: true
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - lines
+          properties:
+            lines:
+              type: string
+              description: Only the lines added since the last append
+              example: |
+                [14:40] @sarah: dropped the dashboard query, p95 back to 200ms
+    responses:
+      202:
+        description: >
+          The lines are queued. They are applied as one batch once appends
+          pause for LIVE_DEBOUNCE_SECONDS (or LIVE_MAX_BATCH_DELAY_SECONDS
+          after the first queued line), and the updates are pushed on the
+          events stream.
+        schema:
+          type: object
+          properties:
+            session_id:
+              type: string
+            pending_lines:
+              type: integer
+            version:
+              type: integer
+      400:
+        description: No lines provided
+      404:
+        description: Unknown or closed session
+    """
+    session = session_registry().get(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    lines = (request.get_json(silent=True) or {}).get('lines', '')
+    if not lines.strip():
+        return jsonify({'error': 'No lines provided'}), 400
+
+    from live_sessions import SessionClosed
+
+    try:
+        pending = session.append(lines)
+    except SessionClosed:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify({'session_id': session.id, 'pending_lines': pending, 'version': session.version}), 202
+
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def api_get_session(session_id):
+    """Get a live session's current reports
+    ---
+    tags:
+      - Live Sessions
+    parameters:
+      - name: session_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: >
+          `reports` maps each format to its latest text. `lines_behind`
+          counts the lines each CLI-written report has not seen yet, and
+          `pending_formats` lists the ones waiting to be updated.
+        schema:
+          type: object
+          properties:
+            session_id:
+              type: string
+            version:
+              type: integer
+            total_lines:
+              type: integer
+            reports:
+              type: object
+            pending_formats:
+              type: array
+              items:
+                type: string
+            lines_behind:
+              type: object
+      404:
+        description: Unknown or closed session
+    """
+    session = session_registry().get(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify(session.status())
+
+
+@app.route('/api/sessions/<session_id>/events', methods=['GET'])
+def api_session_events(session_id):
+    """Follow a live session's updates
+    ---
+    tags:
+      - Live Sessions
+    produces:
+      - text/event-stream
+    parameters:
+      - name: session_id
+        in: path
+        type: string
+        required: true
+      - name: Last-Event-ID
+        in: header
+        type: integer
+        required: false
+        description: ID of the last event received; the stream resumes after it
+      - name: stream
+        in: query
+        type: string
+        enum: [sse, ndjson]
+        description: Wire format, as for /api/generate_report
+      - name: compress
+        in: query
+        type: boolean
+        description: Compress the stream, as for /api/generate_report
+    responses:
+      200:
+        description: >
+          A long-lived Server-Sent Events stream with `id:` fields. Each
+          applied batch sends a `session_update` event with only what is
+          new (events, timeline_lines, action_items, phases) and `report`
+          events with the locally kept formats. CLI updates stream as
+          `content` events tagged with `section`, ending in
+          `section_complete` (or `section_error`). The stream ends with
+          `session_closed`.
+      404:
+        description: Unknown or closed session
+    """
+    session = session_registry().get(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        start = int(last_event_id) + 1 if last_event_id else 0
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an integer'}), 400
+
+    encoder = request_encoder()
+    return Response(
+        stream_with_context(session_sse_stream(session.job.subscribe(max(0, start)), encoder=encoder)),
+        headers={'X-Session-ID': session.id, **encoder.headers},
+        content_type=encoder.content_type
+    )
+
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def api_close_session(session_id):
+    """Close a live session
+    ---
+    tags:
+      - Live Sessions
+    parameters:
+      - name: session_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: The session is closed and any CLI update in progress is cancelled
+      404:
+        description: Unknown or closed session
+    """
+    session = session_registry().close(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify({'session_id': session.id, 'status': 'closed', 'version': session.version})
+
+
+@app.route('/api/reports', methods=['GET'])
+def api_list_reports():
+    """List archived reports, newest first
+    ---
+    tags:
+      - Reports
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        default: 20
+        description: Page size, at most 100
+      - name: cursor
+        in: query
+        type: string
+        description: The `next_cursor` of the previous page
+      - name: format
+        in: query
+        type: string
+        description: Only reports in this format
+      - name: incident_id
+        in: query
+        type: string
+        description: Only reports written from these notes (the hash in `incident_id`)
+    responses:
+      200:
+        description: >
+          One page of report summaries (without their content). `next_cursor`
+          is null on the last page.
+        schema:
+          type: object
+          properties:
+            reports:
+              type: array
+              items:
+                type: object
+            next_cursor:
+              type: string
+      503:
+        description: The report store is disabled (REPORT_STORE_PATH is empty)
+    """
+    store = report_store()
+    if store is None:
+        return jsonify({'error': 'Report store is disabled'}), 503
+    try:
+        reports, next_cursor = store.list(
+            limit=request.args.get('limit', 20, type=int),
+            before=request.args.get('cursor') or None,
+            output_format=request.args.get('format'),
+            incident_id=request.args.get('incident_id'),
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'reports': reports, 'next_cursor': next_cursor})
+
+
+@app.route('/api/reports/search', methods=['GET'])
+def api_search_reports():
+    """Full-text search over archived reports and their incident notes
+    ---
+    tags:
+      - Reports
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: >
+          Words that must all appear in the report or its notes; "quote"
+          phrases. Matching is stemmed, so "lagging" finds "lag".
+      - name: limit
+        in: query
+        type: integer
+        default: 20
+      - name: cursor
+        in: query
+        type: string
+        description: The `next_cursor` of the previous page
+      - name: format
+        in: query
+        type: string
+    responses:
+      200:
+        description: >
+          Best matches first, each with a `snippet` of the matching text
+          with the terms in **bold**
+        schema:
+          type: object
+          properties:
+            reports:
+              type: array
+              items:
+                type: object
+            next_cursor:
+              type: string
+      400:
+        description: Missing query or invalid cursor
+      503:
+        description: The report store is disabled
+    """
+    store = report_store()
+    if store is None:
+        return jsonify({'error': 'Report store is disabled'}), 503
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'error': 'No search query provided'}), 400
+    try:
+        reports, next_cursor = store.search(
+            text,
+            limit=request.args.get('limit', 20, type=int),
+            after=request.args.get('cursor') or None,
+            output_format=request.args.get('format'),
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'query': text, 'reports': reports, 'next_cursor': next_cursor})
+
+
+@app.route('/api/reports/<int:report_id>', methods=['GET'])
+def api_get_report(report_id):
+    """Get an archived report with the incident notes it was written from
+    ---
+    tags:
+      - Reports
+    parameters:
+      - name: report_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: The report, its notes, format, template version and timings
+      404:
+        description: Unknown report
+      503:
+        description: The report store is disabled
+    """
+    store = report_store()
+    if store is None:
+        return jsonify({'error': 'Report store is disabled'}), 503
+    report = store.get(report_id)
+    if not report:
+        return jsonify({'error': 'Report not found'}), 404
+    return jsonify(report)
+
+
+def gather_export_sections(incident_notes, names, priority=None, client=None):
+    """
+    The sections of an export, in document order. Reports already written
+    for these notes come from the report cache or, failing that, the report
+    store; the rest are started at once on the worker pool (or joined, when
+    an identical generation is in flight) and hold the `subscription` to
+    wait on. Raises PoolFullError, after releasing what it started, when
+    the pool's wait queue is full.
+    """
+    from export_bundle import SECTION_TITLES, order_sections
+
+    prompt_notes, _ = preprocess_notes(incident_notes)
+    sections = []
+    try:
+        for name in order_sections(names):
+            section = {'name': name, 'title': SECTION_TITLES[name]}
+            with span('export_lookup', section=name) as lookup:
+                plan = plan_generation(incident_notes, name, enrich=LOCAL_DRAFT_ENRICH, near_match=False,
+                                       priority=priority)
+                stored = None
+                if 'cached_events' not in plan and report_store() is not None:
+                    stored = report_store().latest(prompt_notes, name, PROMPT_TEMPLATES[name])
+                if 'cached_events' in plan:
+                    local = plan['cached_events'][-1].get('renderer') == 'local'
+                    section.update(content=event_content(plan['cached_events']), source='local' if local else 'cache')
+                elif stored:
+                    section.update(content=stored, source='store')
+                else:
+                    section['subscription'], _ = start_generation(client=client, **plan)
+                    section['source'] = 'generated'
+                lookup['source'] = section['source']
+            sections.append(section)
+    except PoolFullError:
+        release_export(sections)
+        raise
+    return sections
+
+
+def event_content(events):
+    """The report text in a list of replayed events"""
+    return ''.join(event['chunk'] for event in events if event['type'] == 'content')
+
+
+def iter_export_sections(sections):
+    """
+    Yield each section with its `content` in document order, waiting for
+    those being generated; a failed generation is yielded with its `error`
+    """
+    trace = current_trace()
+    for section in sections:
+        subscription = section.get('subscription')
+        if subscription is not None:
+            with trace.span('export_wait', section=section['name']):
+                final_event = wait_for_final_event(subscription)
+            if final_event['type'] == 'complete':
+                section['content'] = subscription.job.result_text().get('report', '')
+            else:
+                section['error'] = final_event.get('error')
+            release_export([section])
+        yield section
+
+
+def wait_for_final_event(subscription):
+    """Read a job's events up to its final one and return it, or a timeout error"""
+    while True:
+        try:
+            subscription.get(timeout=CLAUDE_TIMEOUT_SECONDS)
+        except queue.Empty:
+            subscription.timed_out = True
+            return {'type': 'error', 'error': f'No progress for {CLAUDE_TIMEOUT_SECONDS}s'}
+        if subscription.event['type'] in ('complete', 'error'):
+            subscription.finished = True
+            return subscription.event
+
+
+def release_export(sections):
+    """Stop following the sections' generations; unfinished ones nobody else follows are cancelled"""
+    for section in sections:
+        subscription = section.pop('subscription', None)
+        if subscription is not None:
+            JOBS.release(subscription)
+
+
+@app.route('/api/export', methods=['POST'])
+def api_export():
+    """Export a complete post-mortem built from the incident's reports
+    ---
+    tags:
+      - Reports
+    consumes:
+      - application/json
+    produces:
+      - text/markdown
+      - text/html
+      - application/zip
+    description: >
+      Assembles one post-mortem from the report sections, in the order of the
+      example post-mortem. Sections already generated for these notes come
+      from the report cache or the report store; only the missing ones are
+      generated, in parallel. The document is streamed section by section,
+      so early sections arrive while later ones are still being written.
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - incident_notes
+          properties:
+            incident_notes:
+              type: string
+            sections:
+              type: array
+              items:
+                type: string
+              description: Report formats to include, or "all"
+              default: all
+            export_format:
+              type: string
+              enum: [markdown, html, zip]
+              default: markdown
+              description: >
+                One Markdown document, a standalone HTML page, or a zip of
+                one Markdown file per section
+            priority:
+              type: string
+              enum: [critical, high, normal, low]
+              description: Queue priority for sections that have to be generated
+    responses:
+      200:
+        description: >
+          The post-mortem as an attachment. X-Generated-Sections lists the
+          sections that were not already available. A section whose
+          generation fails is replaced by a note with the error.
+      400:
+        description: Missing incident notes, or an unknown section or export format
+      429:
+        description: Too many queued generations - retry after the number of seconds in the Retry-After header
+    """
+    # Imported on first use, like the rest of the export path
+    from export_bundle import EXPORT_FORMATS, SECTION_TITLES, write_bundle
+
+    data = request.get_json() or {}
+    incident_notes = data.get('incident_notes', '').strip()
+    if not incident_notes:
+        return jsonify({'error': 'No incident notes provided'}), 400
+
+    names = data.get('sections') or ['all']
+    if isinstance(names, str):
+        names = names.split(',')
+    if names == ['all']:
+        names = list(SECTION_TITLES)
+    unknown = sorted(set(names) - set(SECTION_TITLES))
+    if unknown:
+        return jsonify({'error': f"Unknown section(s): {', '.join(unknown)}"}), 400
+    export_format = data.get('export_format', 'markdown')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"export_format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        sections = gather_export_sections(incident_notes, names, data.get('priority'), request_client())
+    except PoolFullError as e:
+        retry_after = max(1, int(e.retry_after))
+        return jsonify({'error': str(e), 'retry_after': retry_after}), 429, {'Retry-After': str(retry_after)}
+    generating = [section['name'] for section in sections if 'subscription' in section]
+    print(f"📦 Exporting {len(sections)} sections as {export_format} ({len(generating)} to generate)")
+
+    content_type, extension = EXPORT_FORMATS[export_format]
+    bundle = write_bundle(export_format, incident_title(incident_notes), iter_export_sections(sections),
+                          toc=[section['title'] for section in sections])
+    response = Response(
+        stream_with_context(bundle),
+        headers={
+            'Content-Disposition': f'attachment; filename="post-mortem-{notes_hash(incident_notes)[:8]}.{extension}"',
+            'X-Generated-Sections': ','.join(generating),
+        },
+        content_type=content_type
+    )
+    # Disconnecting cancels the generations nobody else is following
+    response.call_on_close(lambda: release_export(sections))
+    return response
+
+
+def circuit_breaker_stats():
+    """Scrape-time values from the Claude CLI circuit breaker"""
+    backend = GENERATION_BACKEND.stats()
+    return [
+        ('circuit_breaker_open', 'gauge', 'Whether new Claude CLI calls are being refused (1 while open)',
+         int(backend['breaker'] == 'open')),
+        ('circuit_breaker_trips_total', 'counter', 'Times the Claude CLI circuit breaker opened',
+         backend['breaker_trips']),
+    ]
+
+
+def cli_pool_stats(pool):
+    """Scrape-time values from a pool of warm CLI processes; nothing without one"""
+    if pool is None:
+        return []
+    stats = pool.stats()
+    return [
+        ('cli_pool_ready', 'gauge', 'Warm Claude CLI processes waiting for a generation', stats['ready']),
+        ('cli_pool_warm_checkouts_total', 'counter', 'Generations that got a warm Claude CLI process',
+         stats['warm_checkouts']),
+        ('cli_pool_cold_spawns_total', 'counter', 'Generations that found the pool empty and spawned the CLI',
+         stats['cold_spawns']),
+        ('cli_pool_crashed_total', 'counter', 'Warm Claude CLI processes that exited while idle',
+         stats['replaced']['crashed']),
+        ('cli_pool_expired_total', 'counter', 'Warm Claude CLI processes retired after sitting idle too long',
+         stats['replaced']['expired']),
+    ]
+
+
+def shared_state_stats(jobs):
+    """Scrape-time values from the state shared between workers; nothing without it"""
+    if SHARED_STATE is None:
+        return []
+    stats = SHARED_STATE.stats()
+    return [
+        ('shared_state_workers', 'gauge', 'Worker processes heartbeating into the shared state file',
+         stats['workers']),
+        ('cli_slots_in_use', 'gauge', 'Claude CLI calls running across all workers on this host',
+         stats['cli_slots_in_use']),
+        ('followed_jobs_total', 'counter', 'Jobs this worker followed from another worker', jobs['followed']),
+    ]
+
+
+def collect_server_stats():
+    """Scrape-time values from the cache, worker pool and job registry"""
+    cache, pool, jobs = REPORT_CACHE.stats(), GENERATION_POOL.stats(), JOBS.stats()
+    return [
+        ('report_cache_hits_total', 'counter', 'Report cache lookups that found a report', cache['hits']),
+        ('report_cache_misses_total', 'counter', 'Report cache lookups that found nothing', cache['misses']),
+        ('report_cache_entries', 'gauge', 'Reports held in the in-memory cache tier', cache['entries']),
+        ('report_cache_bytes', 'gauge', 'Size of the reports in the in-memory cache tier', cache['bytes']),
+        ('queue_depth', 'gauge', 'Generations waiting for a worker', pool['queued']),
+        ('active_generations', 'gauge', 'Generations running on a worker', pool['active']),
+        ('rejected_generations_total', 'counter', 'Generations rejected because the queue was full', pool['rejected']),
+        ('cancelled_jobs_total', 'counter', 'Jobs cancelled by disconnects, timeouts or DELETE', jobs['cancelled']),
+        ('coalesced_requests_total', 'counter', 'Requests that attached to an identical job', jobs['coalesced']),
+        ('live_sessions', 'gauge', 'Open live incident sessions', session_registry().stats()['open'] if session_registry.built() else 0),
+        *circuit_breaker_stats(),
+        *cli_pool_stats(getattr(CLI_BACKEND, 'pool', None)),
+        *shared_state_stats(jobs),
+    ]
+
+
+METRICS.set_collector('server', collect_server_stats)
+
+
+@app.route('/debug/traces', methods=['GET'])
+def debug_traces():
+    """Recent request traces in Chrome trace-event JSON
+    ---
+    tags:
+      - Debug
+    produces:
+      - application/json
+    description: >
+      The most recent sampled request traces (TRACE_BUFFER_SIZE,
+      TRACE_SAMPLE_RATE), one process track per request. Save the response
+      and open it in Perfetto (ui.perfetto.dev) or chrome://tracing.
+    parameters:
+      - name: name
+        in: query
+        type: string
+        description: Only traces with this name - the format for report generations, else the endpoint
+      - name: request_id
+        in: query
+        type: string
+        description: Only the trace of this request
+      - name: limit
+        in: query
+        type: integer
+        description: At most this many of the most recent traces
+    responses:
+      200:
+        description: Chrome trace-event JSON (traceEvents, displayTimeUnit)
+    """
+    limit = request.args.get('limit', type=int)
+    traces = TRACES.traces(name=request.args.get('name'), request_id=request.args.get('request_id'), limit=limit)
+    return jsonify(chrome_trace(traces))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics
+    ---
+    tags:
+      - Monitoring
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: >
+          Metrics in the Prometheus text format - per-format histograms for
+          subprocess spawn, first output, generation and SSE streaming time,
+          generation outcomes (success, error, timeout, cancelled), cache
+          hits, queue depth, active subprocesses and open SSE connections
+    """
+    return Response(METRICS.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+def read_batch_request():
+    """
+    Read a batch from a JSON body or a multipart upload. Returns
+    (incidents, options) where options holds the raw formats,
+    force_regenerate and batch_id fields, and max_workers as an int (None
+    when not given). Raises ValueError for a malformed upload or max_workers.
+    """
+    from batch import parse_incidents_jsonl
+
+    if request.files:
+        incidents = []
+        for upload in request.files.getlist('incidents'):
+            name = upload.filename or 'upload'
+            if name.endswith('.jsonl'):
+                incidents.extend(parse_incidents_jsonl(upload.stream, source=name))
+            else:
+                incidents.append({
+                    'id': os.path.splitext(name)[0],
+                    'incident_notes': upload.read().decode('utf-8')
+                })
+        options = request.form.to_dict()
+        options['force_regenerate'] = options.get('force_regenerate', '').lower() in ('1', 'true', 'yes')
+    else:
+        options = request.get_json() or {}
+        incidents = options.get('incidents') or []
+        for number, incident in enumerate(incidents, start=1):
+            incident.setdefault('id', str(number))
+
+    max_workers = options.get('max_workers')
+    try:
+        options['max_workers'] = int(max_workers) if max_workers not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError(f'max_workers must be an integer, not {max_workers!r}')
+    return incidents, options
+
+
+def batch_ndjson_stream(subscription):
+    """
+    Stream a batch job's lines as NDJSON for one client
+    """
+    while True:
+        try:
+            message = subscription.get(timeout=CLAUDE_TIMEOUT_SECONDS)
+        except queue.Empty:
+            subscription.timed_out = True
+            yield json.dumps({'type': 'error', 'error': 'Timeout after 5 minutes'}) + '\n'
+            break
+
+        yield message + '\n'
+        if json.loads(message)['type'] in ['batch_complete', 'error']:
+            subscription.finished = True
+            break
+
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """Generate reports for many incidents and formats in one request
+    ---
+    tags:
+      - Incident Reports
+    consumes:
+      - application/json
+      - multipart/form-data
+    produces:
+      - application/x-ndjson
+    description: >
+      Accepts a JSON body, or a multipart upload with one file per incident
+      (`.jsonl` files may hold many). Items run in parallel and each result is
+      streamed as one NDJSON line when it finishes. Finished items are
+      checkpointed, so sending the same batch again after an interruption
+      only generates what is missing. The same fields are accepted as form
+      fields for uploads, with `formats` comma-separated.
+    parameters:
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            incidents:
+              type: array
+              items:
+                type: object
+                required:
+                  - incident_notes
+                properties:
+                  id:
+                    type: string
+                  incident_notes:
+                    type: string
+                  formats:
+                    type: array
+                    items:
+                      type: string
+                    description: Formats for this incident only
+            formats:
+              type: array
+              items:
+                type: string
+              description: Formats for every incident, or "all"
+              default: [executive_summary]
+            max_workers:
+              type: integer
+              description: Items in flight at once, capped at BATCH_MAX_WORKERS; they run on the generation pool at low priority
+            force_regenerate:
+              type: boolean
+              description: Skip the report cache and discard the batch checkpoint
+              default: false
+            batch_id:
+              type: string
+              description: Checkpoint to resume; defaults to a hash of the batch contents
+      - name: incidents
+        in: formData
+        type: file
+        required: false
+        description: Incident files (multipart upload)
+    responses:
+      200:
+        description: >
+          NDJSON stream - a batch_start line, one result line per item in
+          completion order (status ok or error, with content or error), then
+          a batch_complete line. The X-Batch-ID and X-Job-ID headers identify
+          the checkpoint and the running job.
+        examples:
+          result_line: {"type": "result", "incident_id": "01-low-app-restart-502s", "format": "executive_summary", "status": "ok", "content": "# Executive Summary...", "cached": false, "generation_time": "12.5s", "completed": 1, "total": 22}
+      400:
+        description: Bad request - no incidents, an unknown format or a non-integer max_workers
+    """
+    from batch import BatchCheckpoint, batch_id_for, run_batch
+
+    try:
+        incidents, options = read_batch_request()
+    except ValueError as e:
+        return jsonify({'type': 'error', 'error': str(e)}), 400
+
+    formats = options.get('formats') or ['executive_summary']
+    if isinstance(formats, str):
+        formats = formats.split(',')
+    if formats == ['all']:
+        formats = list(PROMPT_TEMPLATES)
+    requested = set(formats)
+    for incident in incidents:
+        requested.update(incident.get('formats') or [])
+    unknown = sorted(requested - set(PROMPT_TEMPLATES))
+
+    if not incidents or any(not str(i.get('incident_notes', '')).strip() for i in incidents):
+        return jsonify({'type': 'error', 'error': 'Every incident needs incident_notes'}), 400
+    if unknown:
+        return jsonify({'type': 'error', 'error': f"Unknown format(s): {', '.join(unknown)}"}), 400
+
+    max_workers = max(1, min(options['max_workers'] or BATCH_MAX_WORKERS, BATCH_MAX_WORKERS))
+    force_regenerate = bool(options.get('force_regenerate'))
+    batch_id = ''.join(
+        c for c in str(options.get('batch_id') or batch_id_for(incidents, formats))
+        if c.isalnum() or c in '-_'
+    )
+
+    subscription, created = JOBS.claim(
+        Job(f'batch {batch_id}', key=request_key('batch', batch_id)),
+        include_finished=not force_regenerate
+    )
+    job = subscription.job
+
+    if created:
+        os.makedirs(BATCH_CHECKPOINT_DIR, exist_ok=True)
+        checkpoint_path = os.path.join(BATCH_CHECKPOINT_DIR, f'{batch_id}.ndjson')
+        if force_regenerate and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        def run():
+            succeeded = False
+            checkpoint = BatchCheckpoint(checkpoint_path)
+            try:
+                print(f"📦 Starting batch {batch_id}: {len(incidents)} incidents, {max_workers} workers")
+                # Items queue on the generation pool behind interactive requests
+                generate = functools.partial(generate_report, priority='low', client=f'batch:{batch_id}')
+                for line in run_batch(incidents, formats, generate, max_workers=max_workers,
+                                      checkpoint=checkpoint, force_regenerate=force_regenerate, job=job):
+                    job.events.put(json.dumps(line))
+                    succeeded = line.get('success', False)
+            except Exception as e:
+                print(f"❌ Batch {batch_id} failed: {str(e)}")
+                job.events.put(json.dumps({'type': 'error', 'error': str(e)}))
+            finally:
+                checkpoint.close()
+                JOBS.finish(job, succeeded)
+
+        threading.Thread(target=run, name=f'batch-{batch_id}', daemon=True).start()
+    else:
+        print(f"🔗 Attached to in-flight batch {batch_id}")
+
+    response = Response(
+        stream_with_context(batch_ndjson_stream(subscription)),
+        headers={'X-Job-ID': job.id, 'X-Batch-ID': batch_id},
+        content_type='application/x-ndjson'
+    )
+    # Disconnecting stops the batch; finished items stay in the checkpoint
+    response.call_on_close(lambda: JOBS.release(subscription))
+    return response
 
 
 if __name__ == '__main__':
@@ -639,4 +3039,9 @@ if __name__ == '__main__':
     print("🚀 Starting Flask app on http://127.0.0.1:5000")
     print("=" * 60)
 
+    # The reloader runs this block in a watching parent too; only the child serves requests
+    if isinstance(CLI_BACKEND, WarmCLIBackend) and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        CLI_BACKEND.pool.start()
+    install_log_prefix()
+    warm_up_in_background()
     app.run(debug=True, port=5000)
@@ -0,0 +1,940 @@
+"""
+Asyncio serving path for the Incident Summariser
+
+Serves the same /api/generate_report contract as the Flask app from a single
+event loop: the Claude CLI runs as an asyncio subprocess and each SSE stream
+is an async generator, so one process can hold hundreds of open streams
+without a thread per stream. Heartbeats and timeouts use wall-clock time.
+
+Run it with any ASGI server, for example:
+    uvicorn asgi_app:app --port 5000
+
+The Flask app (python app.py) remains available as a fallback.
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from app import (
+    CLAUDE_TIMEOUT_SECONDS,
+    CLI_BACKEND,
+    EXTRACTION_PROMPT,
+    GENERATION_BACKEND,
+    LOCAL_DRAFT_ENRICH,
+    MAP_REDUCE,
+    PROMPT_TEMPLATES,
+    REPORT_CACHE,
+    SHARED_STATE,
+    TRACES,
+    SectionSplitter,
+    archive_report,
+    build_render_all_prompt,
+    cache_report,
+    cached_report_events,
+    circuit_breaker_stats,
+    circuit_open_event,
+    cli_pool_stats,
+    find_near_match,
+    local_draft_event,
+    local_report_events,
+    near_match_events,
+    needs_map_reduce,
+    parse_incident_model,
+    preprocess_notes,
+    remember_incident,
+    report_store,
+    request_key,
+    shared_state_stats,
+    warm_up_in_background,
+    window_status_message,
+)
+from backends import WarmCLIBackend
+from event_stream import COALESCE_CHARS, COALESCE_SECONDS, StreamEncoder, encoder_from_request
+from jobs import EventEntry, Job, registry_from_env
+from map_reduce import aiter_window_digests, combine_digests, split_windows
+from metrics import (
+    CACHED_RESPONSES,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    FIRST_OUTPUT_SECONDS,
+    GENERATION_SECONDS,
+    GENERATIONS,
+    METRICS,
+    OPEN_SSE_CONNECTIONS,
+    SSE_STREAM_SECONDS,
+)
+from report_cache import make_cache_key, normalize_notes
+from resilience import CircuitOpenError
+from scheduling import request_priority
+from shared_state import shared_registry_from_env
+from tracing import bind as bind_trace, chrome_trace, current_trace, install_log_prefix
+from worker_pool import AsyncGenerationPool, PoolFullError, pool_from_env
+
+HEARTBEAT_SECONDS = 10
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Last-Event-ID, X-API-Key'),
+    (b'access-control-allow-methods', b'GET, POST, DELETE, OPTIONS'),
+    (b'access-control-expose-headers', b'X-Job-ID, X-Request-ID'),
+]
+
+GENERATION_POOL = pool_from_env(AsyncGenerationPool)
+JOBS = shared_registry_from_env(SHARED_STATE) if SHARED_STATE else registry_from_env()
+
+
+def event(event_type, **fields):
+    return {'type': event_type, **fields, 'timestamp': datetime.now().isoformat()}
+
+
+async def generate_report_events(prompt, cache_key, output_format='unknown', incident_notes=None, mode='single'):
+    """Async version of app.stream_claude_output, yielding event dicts"""
+    trace = current_trace()
+    start_time = time.time()
+    yield event('status', message='🔌 Connecting to Claude CLI...')
+    yield event('status', message='📝 Analyzing incident and generating report...')
+
+    first_output_time = None
+    chunks = []
+    streamed_chars = 0
+    async for chunk in GENERATION_BACKEND.aiter_output(prompt, label=output_format):
+        if first_output_time is None:
+            first_output_time = time.time() - start_time
+            FIRST_OUTPUT_SECONDS.observe(first_output_time, format=output_format)
+            trace.add_span('first_output', start_time, time.time())
+        streamed_chars += len(chunk)
+        chunks.append(chunk)
+        yield {'type': 'content', 'chunk': chunk}
+    if first_output_time is not None:
+        trace.add_span('cli_stream', start_time + first_output_time, time.time(), chars=streamed_chars,
+                       chunks=len(chunks))
+
+    elapsed = time.time() - start_time
+    print(f"✅ Claude responded in {elapsed:.1f}s ({streamed_chars} chars)")
+    GENERATION_SECONDS.observe(elapsed, format=output_format)
+    # The cache, report store and similarity index are SQLite files, written off the event loop
+    await asyncio.to_thread(cache_report, cache_key, ''.join(chunks), generation_time=elapsed)
+    report_id = None
+    if incident_notes is not None:
+        report_id = await asyncio.to_thread(
+            archive_report, incident_notes, output_format, ''.join(chunks), mode=mode,
+            generation_time=elapsed, first_output_time=first_output_time, total_time=elapsed
+        )
+    yield event(
+        'complete',
+        success=True,
+        cached=False,
+        report_id=report_id,
+        total_time=f"{elapsed:.1f}s",
+        generation_time=f"{elapsed:.1f}s",
+        first_output_time=f"{first_output_time:.1f}s"
+    )
+
+
+async def summarise_windows_events(incident_notes, digest, force_regenerate=False):
+    """
+    Async version of app.summarise_windows, yielding its status events. The
+    combined digests are appended to `digest` (a list) when all windows are done.
+    """
+    windows = split_windows(incident_notes, MAP_REDUCE['window_chars'])
+    borrowed = GENERATION_POOL.borrow(min(MAP_REDUCE['max_parallel'], len(windows)) - 1)
+    parallel = 1 + borrowed
+    print(f"🧩 Summarising {len(incident_notes)} chars of notes in {len(windows)} windows ({parallel} at a time)")
+    start_time = time.time()
+    digests = {}
+    try:
+        yield event('status', message=f'🧩 Notes are too long for one pass; summarising {len(windows)} windows, '
+                                      f'{parallel} at a time...', windows=len(windows))
+        async for window, window_digest, cached in aiter_window_digests(
+                windows, GENERATION_BACKEND, REPORT_CACHE, parallel, force_regenerate):
+            digests[window['index']] = window_digest
+            yield event('status', message=window_status_message(window, len(digests), len(windows), cached),
+                        window=window['index'], windows=len(windows), completed_windows=len(digests))
+    finally:
+        GENERATION_POOL.give_back(borrowed)
+    print(f"✅ Summarised {len(windows)} windows in {time.time() - start_time:.1f}s")
+    digest.append(combine_digests(windows, digests))
+
+
+async def generate_map_reduce_events(incident_notes, cache_key, output_format, force_regenerate=False):
+    """Async version of app.stream_map_reduce, yielding event dicts"""
+    digest = []
+    async for window_event in summarise_windows_events(incident_notes, digest, force_regenerate):
+        yield window_event
+    prompt = PROMPT_TEMPLATES[output_format].format(
+        incident_notes=digest[0],
+        date=datetime.now().strftime('%B %d, %Y')
+    )
+    async for report_event in generate_report_events(prompt, cache_key, output_format, incident_notes, 'map_reduce'):
+        yield report_event
+
+
+async def generate_all_formats_events(incident_notes, force_regenerate=False, near_match=True):
+    """Async version of app.stream_all_formats, yielding event dicts"""
+    start_time = time.time()
+    formats = list(PROMPT_TEMPLATES)
+    cache_keys = {
+        name: make_cache_key(incident_notes, name, PROMPT_TEMPLATES[name])
+        for name in formats
+    }
+    await asyncio.to_thread(remember_incident, incident_notes, cache_keys)
+
+    cached = []
+    if not force_regenerate:
+        for name in formats:
+            entry = await asyncio.to_thread(REPORT_CACHE.get, cache_keys[name])
+            match = None
+            if not entry and near_match:
+                match = await asyncio.to_thread(find_near_match, incident_notes, name)
+            if entry:
+                CACHED_RESPONSES.inc(format=name)
+                replayed = cached_report_events(entry, section=name)
+            elif match:
+                replayed = near_match_events(*match, section=name)
+            else:
+                continue
+            for cached_event in replayed:
+                yield cached_event
+            cached.append(name)
+    formats = [name for name in formats if name not in cached]
+
+    if not formats:
+        yield event('complete', success=True, cached=True, sections=cached, missing_sections=[],
+                    total_time=f"{time.time() - start_time:.1f}s")
+        return
+
+    for name in formats:
+        draft = local_draft_event(name, incident_notes, section=name)
+        if draft:
+            yield draft
+
+    model_key = make_cache_key(incident_notes, 'incident_model', EXTRACTION_PROMPT)
+    model_entry = None if force_regenerate else await asyncio.to_thread(REPORT_CACHE.get, model_key)
+    if model_entry:
+        incident_model = parse_incident_model(model_entry['content'])
+    else:
+        prompt_notes = [incident_notes]
+        if needs_map_reduce(incident_notes):
+            # The model is extracted from the window digests
+            prompt_notes = []
+            async for window_event in summarise_windows_events(incident_notes, prompt_notes, force_regenerate):
+                yield window_event
+        yield event('status', message='🔍 Extracting timeline, root cause and impact...')
+        extraction = ''.join([
+            chunk async for chunk in GENERATION_BACKEND.aiter_output(
+                EXTRACTION_PROMPT.format(incident_notes=prompt_notes[0]), label='incident_model'
+            )
+        ])
+        incident_model = parse_incident_model(extraction)
+        await asyncio.to_thread(cache_report, model_key, extraction, generation_time=time.time() - start_time)
+    extraction_time = time.time() - start_time
+
+    yield event('incident_model', model=incident_model)
+    yield event('status', message=f'📝 Writing {len(formats)} reports from the incident model...')
+
+    render_start = time.time()
+    completed = []
+    sections = {}
+    splitter = SectionSplitter(formats)
+
+    async def section_events(parts):
+        for section, chunk in parts:
+            if not completed or completed[-1] != section:
+                if completed:
+                    yield await finish_section(completed[-1])
+                completed.append(section)
+                sections[section] = []
+            sections[section].append(chunk)
+            yield {'type': 'content', 'section': section, 'chunk': chunk}
+
+    async def finish_section(name):
+        content, elapsed = ''.join(sections[name]), time.time() - render_start
+        await asyncio.to_thread(cache_report, cache_keys[name], content, generation_time=elapsed)
+        report_id = await asyncio.to_thread(archive_report, incident_notes, name, content, mode='all',
+                                            generation_time=elapsed, total_time=time.time() - start_time)
+        return event('section_complete', section=name, report_id=report_id)
+
+    async for fragment in GENERATION_BACKEND.aiter_output(build_render_all_prompt(incident_model, formats),
+                                                          label='all'):
+        async for section_event in section_events(splitter.feed(fragment)):
+            yield section_event
+    async for section_event in section_events(splitter.flush()):
+        yield section_event
+    if completed:
+        yield await finish_section(completed[-1])
+
+    missing = [name for name in formats if name not in completed]
+    render_time = time.time() - render_start
+    print(f"✅ Rendered {len(completed)}/{len(formats)} reports in {render_time:.1f}s")
+    GENERATION_SECONDS.observe(time.time() - start_time, format='all')
+    yield event(
+        'complete',
+        success=not missing,
+        cached=False,
+        sections=cached + completed,
+        missing_sections=missing,
+        extraction_time=f"{extraction_time:.1f}s",
+        generation_time=f"{render_time:.1f}s",
+        total_time=f"{time.time() - start_time:.1f}s"
+    )
+
+
+async def registry_call(method, *args, **kwargs):
+    """
+    Call a JOBS method. With shared state these are SQLite transactions that
+    can wait on other workers' locks, so they run on a thread, shielded so a
+    cancelled request still records its claim, release or finish.
+    """
+    if SHARED_STATE is None:
+        return method(*args, **kwargs)
+    return await asyncio.shield(asyncio.to_thread(method, *args, **kwargs))
+
+
+def publish(job, message):
+    """Publish an event to a job's followers and keep its report text"""
+    job.record_event(message)
+    job.events.put(message)
+
+
+async def run_job(job, producer, ticket):
+    """
+    Run `producer` once the ticket gets a generation slot, publishing its
+    events to the job's broadcast. Cancelling the job cancels this task,
+    which kills its CLI process and frees the pool slot.
+    """
+    last = None
+    outcome = 'error'
+    trace = current_trace()
+    try:
+        with trace.span('queue_wait', priority=ticket.priority):
+            await GENERATION_POOL.acquire(ticket)
+        with trace.span('generation', job_id=job.id):
+            async for last in producer:
+                publish(job, last)
+        if last is not None and last['type'] == 'complete' and last['success']:
+            outcome = 'success'
+    except asyncio.CancelledError:
+        print(f"🛑 Generation cancelled: {job.cancel_reason}")
+        outcome = 'cancelled'
+        publish(job, event('error', error='Generation cancelled', cancelled=True))
+        raise
+    except CircuitOpenError as e:
+        print(f"🔌 {e}")
+        outcome = 'circuit_open'
+        publish(job, circuit_open_event(e))
+    except asyncio.TimeoutError:
+        outcome = 'timeout'
+        publish(job, event('error', error='Claude CLI timed out'))
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        publish(job, event('error', error=str(e)))
+    finally:
+        GENERATIONS.inc(format=job.description, outcome=outcome)
+        GENERATION_POOL.release(ticket)
+        await registry_call(JOBS.finish, job, succeeded=last is not None and last['type'] == 'complete')
+
+
+async def sse_stream(subscription):
+    """
+    Yield (event ID, jobs.EventEntry) pairs for one client following a job,
+    with content merged into frames as in the Flask server, plus
+    heartbeats (with no ID) every
+    HEARTBEAT_SECONDS of silence. The stream times out after
+    CLAUDE_TIMEOUT_SECONDS without any event. When the client stops reading
+    early and nobody else follows the job, the job is cancelled.
+    """
+    started = last_event = time.monotonic()
+    next_heartbeat = started + HEARTBEAT_SECONDS
+    OPEN_SSE_CONNECTIONS.inc()
+    try:
+        while True:
+            if subscription.job.done and subscription.index >= len(subscription.job.events):
+                # Resumed after the final event; there is nothing left to send
+                subscription.finished = True
+                break
+            now = time.monotonic()
+            deadline = last_event + CLAUDE_TIMEOUT_SECONDS
+            if now >= deadline:
+                subscription.timed_out = True
+                yield None, event('error', error='Timeout after 5 minutes')
+                break
+            try:
+                # Wait for the next event without reading it, so a timeout never interrupts a frame
+                await asyncio.wait_for(subscription.job.events.aget(subscription.index),
+                                       min(next_heartbeat, deadline) - now)
+            except asyncio.TimeoutError:
+                now = time.monotonic()
+                if now >= next_heartbeat:
+                    yield None, event('heartbeat', message=f'Processing... ({now - started:.0f}s)')
+                    next_heartbeat = now + HEARTBEAT_SECONDS
+                continue
+
+            frame = await subscription.aget_frame(COALESCE_SECONDS, COALESCE_CHARS)
+            last_event = time.monotonic()
+            next_heartbeat = last_event + HEARTBEAT_SECONDS
+            if subscription.skipped:
+                yield None, event('status', message=f'⚠️ {subscription.skipped} earlier events are no longer available',
+                                  skipped_events=subscription.skipped)
+                subscription.skipped = 0
+            if frame.event['type'] in ('complete', 'error'):
+                subscription.finished = True
+            yield subscription.last_id, frame
+            if subscription.finished:
+                break
+    finally:
+        OPEN_SSE_CONNECTIONS.dec()
+        SSE_STREAM_SECONDS.observe(time.monotonic() - started, format=subscription.job.description)
+        await registry_call(JOBS.release, subscription)
+
+
+async def stream_until_disconnect(receive, send, events, headers=(), encoder=None):
+    """Send an SSE stream, abandoning it if the client disconnects first"""
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    sender = asyncio.create_task(send_sse(send, events, headers=headers, encoder=encoder))
+    watcher = asyncio.create_task(wait_for_disconnect())
+    done, _ = await asyncio.wait({sender, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    watcher.cancel()
+    if sender not in done:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+    # Runs the stream's cleanup now even if it was suspended mid-send
+    await events.aclose()
+
+
+async def read_json_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return json.loads(body or b'{}')
+
+
+async def send_sse(send, events, status=200, headers=(), encoder=None):
+    """
+    Send events in the wire format of `encoder` (plain SSE by default). The
+    request's trace gets the time spent waiting for events and writing frames.
+    """
+    encoder = encoder or StreamEncoder()
+    trace = current_trace()
+    sent = {'frames': 0, 'bytes': 0, 'wait_seconds': 0.0, 'write_seconds': 0.0}
+    opened_at = time.time()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', encoder.content_type.encode()),
+            (b'cache-control', b'no-cache'),
+            *CORS_HEADERS,
+            *[(name.lower().encode(), value.encode()) for name, value in encoder.headers.items()],
+            *headers,
+        ],
+    })
+    try:
+        waited_from = time.time()
+        async for item in events:
+            sent['wait_seconds'] += time.time() - waited_from
+            # Job streams yield (event ID, EventEntry) pairs; plain events are dicts with no ID
+            event_id, sse_event = item if isinstance(item, tuple) else (None, item)
+            if isinstance(sse_event, EventEntry):
+                body = encoder.frame(sse_event.event, sse_event.encoded, event_id)
+            else:
+                body = encoder.frame(sse_event, event_id=event_id)
+            if not sent['frames']:
+                trace.mark('first_frame', event_id=event_id)
+            write_from = time.time()
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            sent['write_seconds'] += time.time() - write_from
+            sent['frames'] += 1
+            sent['bytes'] += len(body)
+            waited_from = time.time()
+        await send({'type': 'http.response.body', 'body': encoder.close()})
+    finally:
+        sent['wait_seconds'] = round(sent['wait_seconds'], 3)
+        sent['write_seconds'] = round(sent['write_seconds'], 3)
+        trace.add_span('sse_stream', opened_at, time.time(), **sent)
+
+
+def request_encoder(scope):
+    """The stream encoder a request asked for with `stream`, `compress` and `timestamps`"""
+    query = {name: values[0] for name, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+    return encoder_from_request(query, dict(scope['headers']).get(b'accept-encoding', b'').decode(),
+                                request_id=current_trace().request_id or None)
+
+
+async def as_async(items):
+    for item in items:
+        yield item
+
+
+async def plan_generation(incident_notes, output_format, force_regenerate=False, enrich=True, near_match=True,
+                          priority=None):
+    """
+    Async counterpart of app.plan_generation: returns {'description',
+    'cached_events'} for a cached or near-match report, otherwise the
+    keyword arguments for start_generation()
+    """
+    incident_notes, notes_events = preprocess_notes(incident_notes)
+
+    if output_format == 'all':
+        return {
+            'producer': generate_all_formats_events(incident_notes, force_regenerate, near_match),
+            'description': 'all',
+            'key': request_key('all', normalize_notes(incident_notes), *([] if near_match else ['exact'])),
+            'join_finished': not force_regenerate,
+            'initial_events': notes_events,
+            'priority': request_priority(incident_notes, 'all', priority),
+        }
+
+    if output_format not in PROMPT_TEMPLATES:
+        output_format = 'executive_summary'
+    prompt_template = PROMPT_TEMPLATES[output_format]
+
+    cache_key = make_cache_key(incident_notes, output_format, prompt_template)
+    await asyncio.to_thread(remember_incident, incident_notes, {output_format: cache_key})
+    entry = None if force_regenerate else await asyncio.to_thread(REPORT_CACHE.get, cache_key)
+    if entry:
+        print(f"⚡ Cache hit for {output_format}")
+        CACHED_RESPONSES.inc(format=output_format)
+        return {'description': output_format, 'cached_events': notes_events + cached_report_events(entry)}
+
+    match = None
+    if near_match and not force_regenerate:
+        match = await asyncio.to_thread(find_near_match, incident_notes, output_format)
+    if match:
+        return {'description': output_format, 'cached_events': notes_events + near_match_events(*match)}
+
+    draft = local_draft_event(output_format, incident_notes)
+    if draft and not enrich:
+        return {'description': output_format, 'cached_events': notes_events + local_report_events(draft)}
+    if draft:
+        notes_events = notes_events + [draft]
+
+    if needs_map_reduce(incident_notes):
+        return {
+            'producer': generate_map_reduce_events(incident_notes, cache_key, output_format, force_regenerate),
+            'description': output_format,
+            'key': request_key('map_reduce', output_format, normalize_notes(incident_notes)),
+            'join_finished': not force_regenerate,
+            'initial_events': notes_events,
+            'priority': request_priority(incident_notes, output_format, priority),
+        }
+
+    prompt = prompt_template.format(
+        incident_notes=incident_notes,
+        date=datetime.now().strftime('%B %d, %Y')
+    )
+    return {
+        'producer': generate_report_events(prompt, cache_key, output_format, incident_notes),
+        'description': output_format,
+        'key': request_key(prompt),
+        'join_finished': not force_regenerate,
+        'initial_events': notes_events,
+        'priority': request_priority(incident_notes, output_format, priority),
+    }
+
+
+async def start_generation(producer, description='', key=None, join_finished=True, detached=False,
+                     initial_events=(), priority='normal', client=None):
+    """
+    Attach to an identical job, or publish `initial_events` and run
+    `producer` as a new one once it gets a generation slot, queued by
+    `priority` class and fairly among clients. Returns the subscription. Raises PoolFullError when
+    the wait queue is full, after publishing the rejection to the job.
+    """
+    subscription, created = await registry_call(
+        JOBS.claim, Job(description, key=key), include_finished=join_finished, detached=detached
+    )
+    job = subscription.job
+    trace = current_trace()
+    if not created:
+        print(f"🔗 Attached to in-flight job {job.id} ({job.description})")
+        trace.mark('attached_to_job', job_id=job.id,
+                   job_request_id=job.trace.request_id if job.trace else None)
+        return subscription
+
+    job.trace = trace
+    trace.mark('job_created', job_id=job.id)
+    for initial_event in initial_events:
+        publish(job, initial_event)
+    try:
+        ticket = GENERATION_POOL.submit(job.events.put, priority=priority, client=client)
+    except PoolFullError as e:
+        retry_after = max(1, int(e.retry_after))
+        print(f"🚦 Rejected generation, queue full (retry after {retry_after}s)")
+        publish(job, {'type': 'error', 'error': str(e), 'retry_after': retry_after})
+        await registry_call(JOBS.finish, job, succeeded=False)
+        await registry_call(JOBS.release, subscription)
+        raise
+    task = asyncio.create_task(run_job(job, producer, ticket), name=f'job-{job.id[:8]}')
+    # Jobs can be cancelled from registry threads (shared state), so hand the cancel to the loop
+    loop = asyncio.get_running_loop()
+    job.add_cancel_callback(lambda: loop.call_soon_threadsafe(task.cancel))
+    return subscription
+
+
+async def start_cached_job(description, events):
+    """Register an already finished, detached job holding replayed cache events"""
+    subscription, _ = await registry_call(JOBS.claim, Job(description), detached=True)
+    job = subscription.job
+    for cached_event in events:
+        publish(job, cached_event)
+    await registry_call(JOBS.finish, job, succeeded=True)
+    await registry_call(JOBS.release, subscription)
+    return job
+
+
+def request_client(scope):
+    """Who a request is from, for fair queuing: its API key, else its address"""
+    api_key = dict(scope['headers']).get(b'x-api-key', b'').decode()
+    return api_key or (scope.get('client') or ('unknown',))[0]
+
+
+async def api_generate_report(scope, receive, send):
+    """POST /api/generate_report, same contract as the Flask endpoint"""
+    encoder = request_encoder(scope)
+    trace = current_trace()
+    try:
+        with trace.span('parse_request'):
+            data = await read_json_body(receive)
+            incident_notes = data.get('incident_notes', '').strip()
+            output_format = data.get('format', 'executive_summary')
+            force_regenerate = bool(data.get('force_regenerate', False))
+            enrich = bool(data.get('enrich', LOCAL_DRAFT_ENRICH))
+            near_match = bool(data.get('near_match', True))
+            priority = data.get('priority')
+        # Traces are filtered by format on /debug/traces
+        trace.name = output_format
+
+        if not incident_notes:
+            await send_sse(send, as_async([{'type': 'error', 'error': 'No incident notes provided'}]), encoder=encoder)
+            return
+
+        with trace.span('plan'):
+            plan = await plan_generation(incident_notes, output_format, force_regenerate, enrich, near_match,
+                                         priority)
+        if 'cached_events' in plan:
+            await send_sse(send, as_async(plan['cached_events']), encoder=encoder)
+            return
+
+        try:
+            subscription = await start_generation(client=request_client(scope), **plan)
+        except PoolFullError as e:
+            retry_after = max(1, int(e.retry_after))
+            await send_sse(
+                send,
+                as_async([{'type': 'error', 'error': str(e), 'retry_after': retry_after}]),
+                status=429,
+                headers=[(b'retry-after', str(retry_after).encode())],
+                encoder=encoder
+            )
+            return
+
+        await stream_until_disconnect(
+            receive, send, sse_stream(subscription),
+            headers=[(b'x-job-id', subscription.job.id.encode())],
+            encoder=encoder
+        )
+
+    except Exception as e:
+        print(f"❌ API Error: {str(e)}")
+        await send_sse(send, as_async([{'type': 'error', 'error': str(e)}]), encoder=encoder)
+
+
+async def send_empty(send, status):
+    await send({'type': 'http.response.start', 'status': status, 'headers': CORS_HEADERS})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def send_json(send, payload, status=200, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), *CORS_HEADERS, *headers],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(payload).encode('utf-8')})
+
+
+async def api_create_job(scope, receive, send):
+    """POST /api/jobs, same contract as the Flask endpoint"""
+    data = await read_json_body(receive)
+    incident_notes = data.get('incident_notes', '').strip()
+    if not incident_notes:
+        await send_json(send, {'error': 'No incident notes provided'}, status=400)
+        return
+
+    plan = await plan_generation(
+        incident_notes,
+        data.get('format', 'executive_summary'),
+        bool(data.get('force_regenerate', False)),
+        bool(data.get('enrich', LOCAL_DRAFT_ENRICH)),
+        bool(data.get('near_match', True)),
+        data.get('priority')
+    )
+    if 'cached_events' in plan:
+        job = await start_cached_job(plan['description'], plan['cached_events'])
+    else:
+        try:
+            subscription = await start_generation(detached=True, client=request_client(scope), **plan)
+        except PoolFullError as e:
+            retry_after = max(1, int(e.retry_after))
+            await send_json(send, {'error': str(e), 'retry_after': retry_after}, status=429,
+                            headers=[(b'retry-after', str(retry_after).encode())])
+            return
+        job = subscription.job
+        # Nobody is reading yet; clients follow the job on its events URL
+        await registry_call(JOBS.release, subscription)
+
+    await send_json(send, {
+        'job_id': job.id,
+        'status': job.status,
+        'events_url': f'/api/jobs/{job.id}/events',
+        'result_url': f'/api/jobs/{job.id}',
+    }, status=202, headers=[(b'x-job-id', job.id.encode())])
+
+
+async def api_get_job(send, job_id):
+    """GET /api/jobs/<id>, same contract as the Flask endpoint"""
+    job = await registry_call(JOBS.get, job_id)
+    if not job:
+        await send_json(send, {'error': 'Job not found'}, status=404)
+        return
+
+    await send_json(send, {
+        'job_id': job.id,
+        'description': job.description,
+        'status': job.status,
+        'created_at': datetime.fromtimestamp(job.created_at).isoformat(),
+        'finished_at': datetime.fromtimestamp(job.done_at).isoformat() if job.done_at else None,
+        'event_count': len(job.events),
+        'result': job.result_text(),
+        'drafts': job.drafts,
+        'final_event': job.final_event,
+    })
+
+
+async def api_job_events(scope, receive, send, job_id):
+    """GET /api/jobs/<id>/events, same contract as the Flask endpoint"""
+    headers = dict(scope['headers'])
+    query = parse_qs(scope.get('query_string', b'').decode())
+    last_event_id = headers.get(b'last-event-id', b'').decode() or query.get('last_event_id', [''])[0]
+    try:
+        start = int(last_event_id) + 1 if last_event_id else 0
+    except ValueError:
+        await send_json(send, {'error': 'Last-Event-ID must be an integer'}, status=400)
+        return
+
+    subscription = await registry_call(JOBS.subscribe, job_id, max(0, start))
+    if not subscription:
+        await send_json(send, {'error': 'Job not found'}, status=404)
+        return
+    await stream_until_disconnect(
+        receive, send, sse_stream(subscription),
+        headers=[(b'x-job-id', subscription.job.id.encode())],
+        encoder=request_encoder(scope)
+    )
+
+
+async def api_cancel_job(send, job_id):
+    """DELETE /api/jobs/<id>, same contract as the Flask endpoint"""
+    job = await registry_call(JOBS.get, job_id)
+    if not job:
+        await send_json(send, {'error': 'Job not found'}, status=404)
+        return
+
+    if job.done:
+        await send_json(send, {'job_id': job.id, 'status': 'finished'}, status=409)
+        return
+
+    await registry_call(JOBS.cancel, job, 'cancelled by request')
+    await send_json(send, {'job_id': job.id, 'status': 'cancelled'})
+
+
+def query_int(query, name, default):
+    try:
+        return int(query.get(name, [default])[0])
+    except ValueError:
+        return default
+
+
+async def api_list_reports(scope, send):
+    """GET /api/reports, same contract as the Flask endpoint"""
+    store = await asyncio.to_thread(report_store)
+    if store is None:
+        await send_json(send, {'error': 'Report store is disabled'}, status=503)
+        return
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        reports, next_cursor = await asyncio.to_thread(
+            store.list,
+            limit=query_int(query, 'limit', 20),
+            before=query.get('cursor', [None])[0],
+            output_format=query.get('format', [None])[0],
+            incident_id=query.get('incident_id', [None])[0],
+        )
+    except ValueError:
+        await send_json(send, {'error': 'Invalid cursor'}, status=400)
+        return
+    await send_json(send, {'reports': reports, 'next_cursor': next_cursor})
+
+
+async def api_search_reports(scope, send):
+    """GET /api/reports/search, same contract as the Flask endpoint"""
+    store = await asyncio.to_thread(report_store)
+    if store is None:
+        await send_json(send, {'error': 'Report store is disabled'}, status=503)
+        return
+    query = parse_qs(scope.get('query_string', b'').decode())
+    text = query.get('q', [''])[0].strip()
+    if not text:
+        await send_json(send, {'error': 'No search query provided'}, status=400)
+        return
+    try:
+        reports, next_cursor = await asyncio.to_thread(
+            store.search,
+            text,
+            limit=query_int(query, 'limit', 20),
+            after=query.get('cursor', [None])[0],
+            output_format=query.get('format', [None])[0],
+        )
+    except ValueError:
+        await send_json(send, {'error': 'Invalid cursor'}, status=400)
+        return
+    await send_json(send, {'query': text, 'reports': reports, 'next_cursor': next_cursor})
+
+
+async def api_get_report(send, report_id):
+    """GET /api/reports/<id>, same contract as the Flask endpoint"""
+    store = await asyncio.to_thread(report_store)
+    if store is None:
+        await send_json(send, {'error': 'Report store is disabled'}, status=503)
+        return
+    report = await asyncio.to_thread(store.get, int(report_id)) if report_id.isdigit() else None
+    if not report:
+        await send_json(send, {'error': 'Report not found'}, status=404)
+        return
+    await send_json(send, report)
+
+
+def collect_server_stats():
+    """Scrape-time values from this server's cache, slot pool and job registry"""
+    cache, pool, jobs = REPORT_CACHE.stats(), GENERATION_POOL.stats(), JOBS.stats()
+    return [
+        ('report_cache_hits_total', 'counter', 'Report cache lookups that found a report', cache['hits']),
+        ('report_cache_misses_total', 'counter', 'Report cache lookups that found nothing', cache['misses']),
+        ('report_cache_entries', 'gauge', 'Reports held in the in-memory cache tier', cache['entries']),
+        ('report_cache_bytes', 'gauge', 'Size of the reports in the in-memory cache tier', cache['bytes']),
+        ('queue_depth', 'gauge', 'Generations waiting for a slot', pool['queued']),
+        ('active_generations', 'gauge', 'Generations holding a slot', pool['active']),
+        ('rejected_generations_total', 'counter', 'Generations rejected because the queue was full', pool['rejected']),
+        ('cancelled_jobs_total', 'counter', 'Jobs cancelled by disconnects, timeouts or DELETE', jobs['cancelled']),
+        ('coalesced_requests_total', 'counter', 'Requests that attached to an identical job', jobs['coalesced']),
+        *circuit_breaker_stats(),
+        *cli_pool_stats(getattr(CLI_BACKEND, 'async_pool', None)),
+        *shared_state_stats(jobs),
+    ]
+
+
+# Replaces the Flask app's collector, whose pool and registry are unused here
+METRICS.set_collector('server', collect_server_stats)
+
+
+async def send_metrics(send):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', METRICS_CONTENT_TYPE.encode()), *CORS_HEADERS],
+    })
+    await send({'type': 'http.response.body', 'body': METRICS.render().encode('utf-8')})
+
+
+async def send_traces(scope, send):
+    """GET /debug/traces, same contract as the Flask endpoint"""
+    query = {name: values[0] for name, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+    limit = int(query['limit']) if query.get('limit', '').isdigit() else None
+    traces = TRACES.traces(name=query.get('name'), request_id=query.get('request_id'), limit=limit)
+    await send_json(send, chrome_trace(traces))
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                install_log_prefix()
+                warm_up_in_background()
+                if isinstance(CLI_BACKEND, WarmCLIBackend):
+                    CLI_BACKEND.async_pool.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if isinstance(CLI_BACKEND, WarmCLIBackend):
+                    await CLI_BACKEND.async_pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+    if not scope['path'].startswith('/api/'):
+        await route(scope, receive, send)
+        return
+
+    # Every API request gets an ID and, when sampled, a trace (see tracing.py)
+    trace = TRACES.start(f"{scope['method']} {scope['path']}",
+                         dict(scope['headers']).get(b'x-request-id', b'').decode() or None)
+
+    async def send_with_request_id(message):
+        if message['type'] == 'http.response.start':
+            message = dict(message, headers=[*message['headers'], (b'x-request-id', trace.request_id.encode())])
+        await send(message)
+
+    # Tasks started while handling the request, like its generation, inherit the trace
+    with bind_trace(trace):
+        try:
+            await route(scope, receive, send_with_request_id)
+        finally:
+            trace.finish()
+
+
+async def route(scope, receive, send):
+    """Dispatch an HTTP request to its handler"""
+    if scope['method'] == 'OPTIONS':
+        await send_empty(send, 204)
+    elif scope['path'] == '/api/generate_report' and scope['method'] == 'POST':
+        await api_generate_report(scope, receive, send)
+    elif scope['path'] == '/api/jobs' and scope['method'] == 'POST':
+        await api_create_job(scope, receive, send)
+    elif scope['path'].startswith('/api/jobs/') and scope['path'].endswith('/events') and scope['method'] == 'GET':
+        await api_job_events(scope, receive, send, scope['path'][len('/api/jobs/'):-len('/events')])
+    elif scope['path'].startswith('/api/jobs/') and scope['method'] == 'GET':
+        await api_get_job(send, scope['path'][len('/api/jobs/'):])
+    elif scope['path'].startswith('/api/jobs/') and scope['method'] == 'DELETE':
+        await api_cancel_job(send, scope['path'][len('/api/jobs/'):])
+    elif scope['path'] == '/api/reports' and scope['method'] == 'GET':
+        await api_list_reports(scope, send)
+    elif scope['path'] == '/api/reports/search' and scope['method'] == 'GET':
+        await api_search_reports(scope, send)
+    elif scope['path'].startswith('/api/reports/') and scope['method'] == 'GET':
+        await api_get_report(send, scope['path'][len('/api/reports/'):])
+    elif scope['path'] == '/metrics' and scope['method'] == 'GET':
+        await send_metrics(send)
+    elif scope['path'] == '/debug/traces' and scope['method'] == 'GET':
+        await send_traces(scope, send)
+    else:
+        await send_empty(send, 404)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('The async server needs an ASGI server: pip install uvicorn')
+
+    print("🚀 Starting async server on http://127.0.0.1:5000")
+    uvicorn.run(app, host='127.0.0.1', port=5000)
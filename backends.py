@@ -0,0 +1,436 @@
+"""
+Generation backends
+
+A backend turns a prompt into a stream of text fragments. The server only
+talks to the backend interface - `iter_output()` for the threaded Flask path
+and `aiter_output()` for the asyncio path - so the Claude CLI can be swapped
+for StubBackend, which produces deterministic output locally with
+configurable latency, size, cadence and failure rate. The stub is what the
+load tests in benchmarks/ run against.
+
+GENERATION_BACKEND selects the backend: `claude_cli` (default) or `stub`.
+With CLAUDE_POOL_SIZE set, `claude_cli` takes pre-started processes from a
+warm pool (WarmCLIBackend) instead of spawning one per generation.
+Callers may pass a `label` (the report format) with each call; plain
+backends ignore it and the resilience layer (resilience.py) keys its
+latency statistics on it.
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+
+from cli_pool import AsyncProcessPool, ProcessPool
+from jobs import JobCancelled
+from metrics import ACTIVE_SUBPROCESSES
+
+# Claude CLI invocation. stream-json with partial messages makes the CLI emit
+# one JSON object per line as tokens arrive instead of buffering the report.
+CLAUDE_CLI_COMMAND = [
+    'claude', '--print',
+    '--output-format', 'stream-json',
+    '--verbose',
+    '--include-partial-messages',
+]
+CLAUDE_TIMEOUT_SECONDS = 300
+
+
+def parse_stream_json_line(line, text_mode=False):
+    """
+    Parse one line of `claude --output-format stream-json` output.
+
+    Returns a (kind, payload) tuple:
+      ('text', fragment)  - a text delta to forward to the client
+      ('result', dict)    - the final result message
+      (None, None)        - anything else (system/init, tool events, blanks)
+
+    Lines that are not JSON objects are treated as plain text so the parser
+    also works with CLIs that only support the default text output. With
+    `text_mode` set every line is text, blank lines included, so paragraph
+    and list breaks survive.
+    """
+    # Keep the indentation of nested lists and code blocks
+    text = line.rstrip('\r\n') + '\n'
+    if text_mode:
+        return 'text', text
+    stripped = line.strip()
+    if not stripped:
+        return None, None
+    try:
+        message = json.loads(stripped)
+    except ValueError:
+        return 'text', text
+
+    if not isinstance(message, dict):
+        return 'text', text
+
+    message_type = message.get('type')
+    if message_type == 'stream_event':
+        event = message.get('event') or {}
+        delta = event.get('delta') or {}
+        if event.get('type') == 'content_block_delta' and delta.get('type') == 'text_delta':
+            return 'text', delta.get('text', '')
+    elif message_type == 'result':
+        return 'result', message
+
+    return None, None
+
+
+def _is_json_object(line):
+    try:
+        return isinstance(json.loads(line), dict)
+    except ValueError:
+        return False
+
+
+class StreamJsonParser:
+    """
+    Parses a CLI's output line by line. The first non-blank line decides the
+    mode: a JSON object means stream-json, anything else means the CLI writes
+    plain text and every line from then on is passed through as text.
+    """
+
+    def __init__(self):
+        self.text_mode = None
+
+    def feed(self, line):
+        """Parse one line; returns (kind, payload) as parse_stream_json_line does"""
+        if self.text_mode is None and line.strip():
+            self.text_mode = not _is_json_object(line)
+        return parse_stream_json_line(line, text_mode=bool(self.text_mode))
+
+
+class ClaudeCLIError(Exception):
+    """Raised when the Claude CLI exits with an error or produces no output"""
+
+
+# stream-json lines carry whole messages; allow well beyond asyncio's 64 KiB default
+STREAM_LINE_LIMIT = 16 * 1024 * 1024
+
+
+class ClaudeCLIBackend:
+    """Runs one Claude CLI process per generation"""
+
+    name = 'claude_cli'
+
+    def __init__(self, command=None):
+        self.command = command or CLAUDE_CLI_COMMAND
+
+    def spawn(self):
+        """Start a CLI process that waits for its prompt on stdin"""
+        return subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+
+    async def aspawn(self):
+        """Async version of spawn"""
+        return await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=STREAM_LINE_LIMIT
+        )
+
+    def prompt_input(self, prompt):
+        """What to write to the CLI's stdin for a prompt"""
+        return prompt
+
+    def iter_output(self, prompt, on_started=None, timeout=CLAUDE_TIMEOUT_SECONDS, job=None, label=None):
+        """
+        Run the Claude CLI on a prompt and yield text fragments as they arrive.
+
+        `on_started` is called once the process has been spawned. Raises
+        subprocess.TimeoutExpired if the CLI runs past `timeout`, ClaudeCLIError
+        if it fails and JobCancelled if `job` is cancelled. The process is killed
+        if the job is cancelled or the caller stops iterating early.
+        """
+        if job:
+            job.raise_if_cancelled()
+
+        process = self.spawn()
+        ACTIVE_SUBPROCESSES.inc()
+
+        # Kill the process if it runs past the timeout; reading stdout below
+        # then hits EOF and we report the timeout.
+        timed_out = threading.Event()
+
+        def on_timeout():
+            timed_out.set()
+            process.kill()
+
+        watchdog = threading.Timer(timeout, on_timeout)
+        watchdog.daemon = True
+        watchdog.start()
+
+        # Drain stderr in the background so a chatty CLI can't block on a full pipe
+        stderr_lines = []
+        stderr_thread = threading.Thread(
+            target=lambda: stderr_lines.extend(process.stderr),
+            daemon=True
+        )
+        stderr_thread.start()
+
+        unregister_cancel = job.add_cancel_callback(process.kill) if job else lambda: None
+        try:
+            if on_started:
+                on_started()
+
+            # Send the prompt and close stdin so the CLI starts generating
+            process.stdin.write(self.prompt_input(prompt))
+            process.stdin.close()
+
+            streamed_chars = 0
+            result = None
+            parser = StreamJsonParser()
+            for line in process.stdout:
+                kind, payload = parser.feed(line)
+                if kind == 'text' and payload:
+                    streamed_chars += len(payload)
+                    yield payload
+                elif kind == 'result':
+                    result = payload
+
+            process.wait()
+            stderr_thread.join(timeout=1)
+            stderr = ''.join(stderr_lines)
+
+            if job:
+                job.raise_if_cancelled()
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(self.command, timeout)
+
+            failed = result.get('is_error') if result else process.returncode != 0
+            if failed:
+                raise ClaudeCLIError((result or {}).get('result') or stderr or 'Process failed')
+
+            # The result message carries the full text; use it if the CLI did not
+            # send partial deltas (e.g. older versions without partial messages)
+            if streamed_chars == 0:
+                text = (result or {}).get('result') or ''
+                if not text:
+                    raise ClaudeCLIError(stderr or 'Process failed')
+                yield text
+        finally:
+            unregister_cancel()
+            watchdog.cancel()
+            if process.poll() is None:
+                process.kill()
+            # Reap the child so cancelled runs don't leave zombies behind
+            process.wait()
+            ACTIVE_SUBPROCESSES.dec()
+
+    async def aiter_output(self, prompt, timeout=CLAUDE_TIMEOUT_SECONDS, label=None):
+        """
+        Async version of iter_output: run the Claude CLI as an asyncio
+        subprocess and yield text fragments as they arrive. Raises
+        asyncio.TimeoutError past `timeout` and ClaudeCLIError on failure.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        process = await self.aspawn()
+        ACTIVE_SUBPROCESSES.inc()
+        stderr_task = asyncio.ensure_future(process.stderr.read())
+        try:
+            process.stdin.write(self.prompt_input(prompt).encode('utf-8'))
+            await process.stdin.drain()
+            process.stdin.close()
+
+            streamed_chars = 0
+            result = None
+            parser = StreamJsonParser()
+            while True:
+                line = await asyncio.wait_for(process.stdout.readline(), deadline - loop.time())
+                if not line:
+                    break
+                kind, payload = parser.feed(line.decode('utf-8', errors='replace'))
+                if kind == 'text' and payload:
+                    streamed_chars += len(payload)
+                    yield payload
+                elif kind == 'result':
+                    result = payload
+
+            await asyncio.wait_for(process.wait(), max(0, deadline - loop.time()))
+            stderr = (await stderr_task).decode('utf-8', errors='replace')
+
+            failed = result.get('is_error') if result else process.returncode != 0
+            if failed:
+                raise ClaudeCLIError((result or {}).get('result') or stderr or 'Process failed')
+
+            if streamed_chars == 0:
+                text = (result or {}).get('result') or ''
+                if not text:
+                    raise ClaudeCLIError(stderr or 'Process failed')
+                yield text
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            stderr_task.cancel()
+            ACTIVE_SUBPROCESSES.dec()
+
+
+class WarmCLIBackend(ClaudeCLIBackend):
+    """
+    Claude CLI backend that takes processes from a pool of pre-started ones
+    (see cli_pool.py). Pooled processes run with `--input-format stream-json`
+    so they sit waiting for a message; the prompt is sent as one user
+    message and stdin is closed, after which the CLI answers and exits.
+    """
+
+    name = 'claude_cli_warm'
+
+    def __init__(self, size=4, max_idle_seconds=300.0, health_interval=5.0, command=None):
+        super().__init__(command or CLAUDE_CLI_COMMAND + ['--input-format', 'stream-json'])
+        self.pool = ProcessPool(super().spawn, size, max_idle_seconds, health_interval)
+        self.async_pool = AsyncProcessPool(super().aspawn, size, max_idle_seconds, health_interval)
+
+    def spawn(self):
+        return self.pool.checkout()
+
+    async def aspawn(self):
+        return await self.async_pool.checkout()
+
+    def prompt_input(self, prompt):
+        message = {'type': 'user', 'message': {'role': 'user', 'content': prompt}}
+        return json.dumps(message) + '\n'
+
+
+class StubBackend:
+    """
+    Deterministic local backend for load tests and offline development.
+
+    Each generation waits a first-output latency drawn from a log-normal
+    distribution (median `latency`, spread `latency_sigma`), then streams
+    `output_chars` characters in `chunk_chars` pieces every `chunk_interval`
+    seconds. A `failure_rate` fraction of generations fail with
+    ClaudeCLIError. Everything is derived from the prompt and `seed`, so
+    repeated runs behave the same.
+    """
+
+    name = 'stub'
+
+    # Render-all prompts list the sections to write as marker lines
+    SECTION_PATTERN = re.compile(r'^=== SECTION: (\w+) ===$', re.M)
+
+    def __init__(self, latency=0.5, latency_sigma=0.25, output_chars=2000,
+                 chunk_chars=40, chunk_interval=0.02, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.output_chars = output_chars
+        self.chunk_chars = max(1, chunk_chars)
+        self.chunk_interval = chunk_interval
+        self.failure_rate = failure_rate
+        self.seed = seed
+
+    def plan(self, prompt):
+        """Return (first_output_latency, fails, text) for a prompt"""
+        rng = random.Random(f"{self.seed}:{prompt}")
+        latency = rng.lognormvariate(0, self.latency_sigma) * self.latency if self.latency > 0 else 0
+        fails = rng.random() < self.failure_rate
+
+        sections = self.SECTION_PATTERN.findall(prompt)
+        if sections:
+            size = max(1, self.output_chars // len(sections))
+            text = ''.join(
+                f"=== SECTION: {name} ===\n{self._filler(rng, size, title=name)}\n"
+                for name in sections
+            )
+        else:
+            text = self._filler(rng, self.output_chars)
+        return latency, fails, text
+
+    def iter_output(self, prompt, on_started=None, timeout=CLAUDE_TIMEOUT_SECONDS, job=None, label=None):
+        """Same contract as ClaudeCLIBackend.iter_output"""
+        if job:
+            job.raise_if_cancelled()
+        latency, fails, text = self.plan(prompt)
+        deadline = time.monotonic() + timeout
+        cancelled = threading.Event()
+        unregister_cancel = job.add_cancel_callback(cancelled.set) if job else lambda: None
+
+        def pause(seconds):
+            if cancelled.wait(seconds):
+                raise JobCancelled(job.cancel_reason)
+            if time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired([self.name], timeout)
+
+        try:
+            if on_started:
+                on_started()
+            pause(latency)
+            if fails:
+                raise ClaudeCLIError('Stub backend failure')
+            for start in range(0, len(text), self.chunk_chars):
+                if start:
+                    pause(self.chunk_interval)
+                yield text[start:start + self.chunk_chars]
+        finally:
+            unregister_cancel()
+
+    async def aiter_output(self, prompt, timeout=CLAUDE_TIMEOUT_SECONDS, label=None):
+        """Same contract as ClaudeCLIBackend.aiter_output"""
+        latency, fails, text = self.plan(prompt)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        async def pause(seconds):
+            await asyncio.sleep(seconds)
+            if loop.time() > deadline:
+                raise asyncio.TimeoutError
+
+        await pause(latency)
+        if fails:
+            raise ClaudeCLIError('Stub backend failure')
+        for start in range(0, len(text), self.chunk_chars):
+            if start:
+                await pause(self.chunk_interval)
+            yield text[start:start + self.chunk_chars]
+
+    @staticmethod
+    def _filler(rng, size, title='Stub Report'):
+        lines = [f"# {title.replace('_', ' ').title()}", '']
+        length = sum(len(line) + 1 for line in lines)
+        while length < size:
+            line = f"- [{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}] stub event {rng.getrandbits(32):08x}"
+            lines.append(line)
+            length += len(line) + 1
+        return '\n'.join(lines)[:size] + '\n'
+
+
+def backend_from_env():
+    """
+    Build the generation backend from GENERATION_BACKEND, CLAUDE_POOL_* and
+    STUB_* environment variables
+    """
+    name = os.environ.get('GENERATION_BACKEND', 'claude_cli')
+    if name == 'stub':
+        return StubBackend(
+            latency=float(os.environ.get('STUB_LATENCY_SECONDS', '0.5')),
+            latency_sigma=float(os.environ.get('STUB_LATENCY_SIGMA', '0.25')),
+            output_chars=int(os.environ.get('STUB_OUTPUT_CHARS', '2000')),
+            chunk_chars=int(os.environ.get('STUB_CHUNK_CHARS', '40')),
+            chunk_interval=float(os.environ.get('STUB_CHUNK_INTERVAL_SECONDS', '0.02')),
+            failure_rate=float(os.environ.get('STUB_FAILURE_RATE', '0')),
+            seed=int(os.environ.get('STUB_SEED', '0')),
+        )
+    if name != 'claude_cli':
+        raise ValueError(f"Unknown GENERATION_BACKEND '{name}' (expected claude_cli or stub)")
+    pool_size = int(os.environ.get('CLAUDE_POOL_SIZE', '0'))
+    if pool_size > 0:
+        return WarmCLIBackend(
+            size=pool_size,
+            max_idle_seconds=float(os.environ.get('CLAUDE_POOL_MAX_IDLE_SECONDS', '300')),
+            health_interval=float(os.environ.get('CLAUDE_POOL_HEALTH_INTERVAL_SECONDS', '5')),
+        )
+    return ClaudeCLIBackend()
@@ -0,0 +1,263 @@
+"""
+Batch report generation for backfilling post-mortems
+
+Runs every (incident, format) pair of a batch on a bounded thread pool and
+reports each result as one NDJSON line as soon as it finishes. Finished
+results are appended to a checkpoint file, so re-running an interrupted
+batch with the same checkpoint only generates what is still missing.
+
+Used by the POST /api/batch endpoint and as a command line tool:
+    python batch.py project_spec/example_incidents --formats executive_summary,action_items
+    python batch.py incidents.jsonl --workers 8 --output results.ndjson
+"""
+
+import argparse
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from jobs import JobCancelled
+
+INCIDENT_FILE_EXTENSIONS = ('.md', '.txt', '.log')
+
+
+def load_incidents_from_directory(path):
+    """One incident per .md/.txt/.log file, identified by its file name"""
+    incidents = []
+    for name in sorted(os.listdir(path)):
+        full_path = os.path.join(path, name)
+        if name.endswith(INCIDENT_FILE_EXTENSIONS) and os.path.isfile(full_path):
+            with open(full_path, encoding='utf-8') as f:
+                incidents.append({'id': os.path.splitext(name)[0], 'incident_notes': f.read()})
+    return incidents
+
+
+def parse_incidents_jsonl(lines, source='input'):
+    """
+    Parse JSONL incidents: one object per line with `incident_notes` and
+    optionally `id` and `formats`. Lines without an id are numbered.
+    """
+    incidents = []
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            incident = json.loads(line)
+        except ValueError:
+            raise ValueError(f"{source} line {number} is not valid JSON")
+        if not isinstance(incident, dict) or not str(incident.get('incident_notes', '')).strip():
+            raise ValueError(f"{source} line {number} has no incident_notes")
+        incident.setdefault('id', f"{source}:{number}")
+        incidents.append(incident)
+    return incidents
+
+
+def load_incidents(path):
+    """Load incidents from a directory of incident files or a JSONL file"""
+    if os.path.isdir(path):
+        return load_incidents_from_directory(path)
+    with open(path, encoding='utf-8') as f:
+        return parse_incidents_jsonl(f, source=os.path.basename(path))
+
+
+def batch_id_for(incidents, formats):
+    """Stable ID for a batch, so resubmitting the same batch resumes it"""
+    digest = hashlib.sha256()
+    for incident in incidents:
+        for part in (str(incident['id']), incident['incident_notes'],
+                     ','.join(incident.get('formats') or formats)):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+class BatchCheckpoint:
+    """
+    Append-only NDJSON record of finished batch items. Successful items are
+    skipped when the batch is run again; failed ones are retried.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._done = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        # A line cut short by the interruption
+                        continue
+                    if result.get('type') == 'result' and result.get('status') == 'ok':
+                        self._done[(result['incident_id'], result['format'])] = result
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def completed(self, incident_id, output_format):
+        return self._done.get((incident_id, output_format))
+
+    def record(self, result):
+        with self._lock:
+            self._file.write(json.dumps(result) + '\n')
+            self._file.flush()
+            if result['status'] == 'ok':
+                self._done[(result['incident_id'], result['format'])] = result
+
+    def close(self):
+        self._file.close()
+
+
+def run_batch(incidents, formats, generate, max_workers=4, checkpoint=None,
+              force_regenerate=False, job=None):
+    """
+    Generate every format of every incident on up to `max_workers` threads,
+    yielding NDJSON-ready dicts: a `batch_start` line, one `result` line per
+    item as it finishes (in completion order) and a `batch_complete` line.
+
+    `generate(incident_notes, output_format, force_regenerate, job)` returns
+    (content, generation_time, cached). Items already in `checkpoint` are
+    replayed with `resumed: true` instead of being generated again.
+    Cancelling `job` stops the batch; unfinished items are not checkpointed.
+    """
+    start_time = time.time()
+    items = [
+        (incident, output_format)
+        for incident in incidents
+        for output_format in (incident.get('formats') or formats)
+    ]
+    resumed = []
+    pending = []
+    for incident, output_format in items:
+        previous = checkpoint.completed(incident['id'], output_format) if checkpoint else None
+        if previous:
+            resumed.append(dict(previous, resumed=True))
+        else:
+            pending.append((incident, output_format))
+
+    yield {
+        'type': 'batch_start',
+        'total': len(items),
+        'resumed': len(resumed),
+        'pending': len(pending),
+        'max_workers': max_workers,
+        'timestamp': datetime.now().isoformat()
+    }
+
+    counts = {'ok': 0, 'error': 0}
+    completed = 0
+    for result in resumed:
+        completed += 1
+        counts['ok'] += 1
+        yield dict(result, completed=completed, total=len(items))
+
+    def run_item(incident, output_format):
+        item_start = time.time()
+        result = {'type': 'result', 'incident_id': incident['id'], 'format': output_format}
+        try:
+            if job:
+                job.raise_if_cancelled()
+            content, generation_time, cached = generate(
+                incident['incident_notes'], output_format, force_regenerate, job
+            )
+            result.update(status='ok', content=content, cached=cached,
+                          generation_time=f"{generation_time or 0:.1f}s")
+        except JobCancelled:
+            result.update(status='cancelled')
+        except subprocess.TimeoutExpired as e:
+            result.update(status='error', error=f'Claude CLI timed out after {e.timeout:.0f}s')
+        except Exception as e:
+            result.update(status='error', error=str(e).strip())
+        result['elapsed'] = f"{time.time() - item_start:.1f}s"
+        result['timestamp'] = datetime.now().isoformat()
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-worker')
+    try:
+        futures = [executor.submit(run_item, incident, output_format)
+                   for incident, output_format in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            if result['status'] == 'cancelled':
+                continue
+            if checkpoint:
+                checkpoint.record(result)
+            completed += 1
+            counts[result['status']] += 1
+            if result['status'] == 'error':
+                print(f"❌ Batch item {result['incident_id']}/{result['format']} failed: {result['error']}")
+            yield dict(result, completed=completed, total=len(items))
+    finally:
+        # Stops queued items straight away if the consumer goes away early
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    cancelled = job is not None and job.cancelled
+    total_time = time.time() - start_time
+    print(f"📦 Batch finished in {total_time:.1f}s: {counts['ok']} ok, {counts['error']} failed"
+          f"{' (cancelled)' if cancelled else ''}")
+    yield {
+        'type': 'batch_complete',
+        'success': counts['error'] == 0 and completed == len(items),
+        'succeeded': counts['ok'],
+        'failed': counts['error'],
+        'resumed': len(resumed),
+        'cancelled': cancelled,
+        'total': len(items),
+        'total_time': f"{total_time:.1f}s",
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def main(argv=None):
+    # Imported here so `app` can import this module for the batch endpoint
+    from app import PROMPT_TEMPLATES, generate_report
+
+    parser = argparse.ArgumentParser(description='Generate reports for many incidents at once')
+    parser.add_argument('source', help='Directory of incident files, or a JSONL file of incidents')
+    parser.add_argument('--formats', default='executive_summary',
+                        help=f"Comma-separated formats, or 'all' ({', '.join(PROMPT_TEMPLATES)})")
+    parser.add_argument('--workers', type=int, default=4, help='Reports generated in parallel')
+    parser.add_argument('--output', '-o',
+                        help='NDJSON results file, also used as the checkpoint (default: stdout only)')
+    parser.add_argument('--force-regenerate', action='store_true', help='Skip the report cache')
+    args = parser.parse_args(argv)
+
+    formats = list(PROMPT_TEMPLATES) if args.formats == 'all' else args.formats.split(',')
+    unknown = [name for name in formats if name not in PROMPT_TEMPLATES]
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(unknown)}")
+
+    incidents = load_incidents(args.source)
+    checkpoint = BatchCheckpoint(args.output) if args.output else None
+    # NDJSON goes to stdout; progress and log lines go to stderr
+    output = sys.stdout
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            # Through the generation pool, so GENERATION_MAX_CONCURRENT caps the CLI calls
+            generate = functools.partial(generate_report, priority='low', client='batch-cli')
+            for line in run_batch(incidents, formats, generate, max_workers=args.workers,
+                                  checkpoint=checkpoint, force_regenerate=args.force_regenerate):
+                if line['type'] == 'result':
+                    status = '♻️' if line.get('resumed') else ('✅' if line['status'] == 'ok' else '❌')
+                    print(f"{status} [{line['completed']}/{line['total']}] {line['incident_id']} {line['format']}")
+                output.write(json.dumps(line) + '\n')
+                output.flush()
+    finally:
+        if checkpoint:
+            checkpoint.close()
+    return 0 if line['success'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+Load test for /api/generate_report
+
+Starts the server with the stub generation backend (no Claude CLI or network
+needed), drives it with N concurrent clients posting the example incidents,
+and reports time-to-first-byte, time-to-complete, events/sec and the
+server's peak RSS and thread count. Every request uses unique notes so the
+report cache and request coalescing don't hide server overhead.
+
+    python benchmarks/load_test.py --clients 20 --requests 200
+    python benchmarks/load_test.py --server asgi --json results.json
+    python benchmarks/load_test.py --baseline results.json   # exit 1 on regression
+
+Use --url to test a server that is already running; process stats are then
+only reported if --pid is given.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_INCIDENTS = os.path.join(REPO_ROOT, 'project_spec', 'example_incidents')
+
+SERVER_COMMANDS = {
+    'flask': [sys.executable, '-c', 'import sys; from app import app, warm_up_in_background; '
+              'warm_up_in_background(); app.run(port=int(sys.argv[1]), threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--log-level', 'warning', '--port'],
+}
+
+# Lower is better for all of these except events_per_second
+REGRESSION_METRICS = ['ttfb_p95', 'complete_p95', 'events_per_second', 'peak_rss_mb']
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def load_incident_notes(path):
+    notes = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.md'):
+            with open(os.path.join(path, name), encoding='utf-8') as f:
+                notes.append(f.read())
+    return notes
+
+
+def read_process_stats(pid):
+    """Current RSS and peak RSS in MB and thread count from /proc (Linux only)"""
+    stats = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM'):
+                    stats[key] = int(value.split()[0]) / 1024
+                elif key == 'Threads':
+                    stats[key] = int(value)
+    except OSError:
+        pass
+    return stats
+
+
+class ProcessMonitor:
+    """Samples a process's memory and thread count in the background"""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = None
+        self.peak_threads = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        # VmHWM is the kernel's own high-water mark, so short spikes aren't missed
+        final = read_process_stats(self.pid)
+        if 'VmHWM' in final:
+            self.peak_rss = final['VmHWM']
+
+    def _run(self):
+        while not self._stop.is_set():
+            stats = read_process_stats(self.pid)
+            if 'VmRSS' in stats:
+                self.peak_rss = max(self.peak_rss or 0, stats['VmRSS'])
+                self.peak_threads = max(self.peak_threads or 0, stats['Threads'])
+            self._stop.wait(self.interval)
+
+
+def start_server(kind, port, env):
+    command = SERVER_COMMANDS[kind] + [str(port)]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{kind} server exited during startup (code {process.returncode})")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start listening on port {port}")
+
+
+def run_request(host, port, body, timeout):
+    """POST one generation and time its SSE events"""
+    result = {'status': None, 'events': 0, 'ttfb': None, 'first_content': None,
+              'complete': None, 'outcome': 'incomplete'}
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('POST', '/api/generate_report', body=json.dumps(body),
+                           headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        result['status'] = response.status
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if not line.startswith(b'data: '):
+                continue
+            now = time.perf_counter() - start
+            if result['ttfb'] is None:
+                result['ttfb'] = now
+            result['events'] += 1
+            event_type = json.loads(line[6:])['type']
+            if event_type == 'content' and result['first_content'] is None:
+                result['first_content'] = now
+            elif event_type in ('complete', 'error'):
+                result['complete'] = now
+                result['outcome'] = event_type
+                break
+    except (OSError, http.client.HTTPException) as e:
+        result['outcome'] = f'exception: {e}'
+    finally:
+        connection.close()
+    return result
+
+
+def summarise(results, wall_time, monitor):
+    completed = [r for r in results if r['outcome'] == 'complete']
+    ttfb = [r['ttfb'] for r in results if r['ttfb'] is not None]
+    first_content = [r['first_content'] for r in completed if r['first_content'] is not None]
+    complete = [r['complete'] for r in completed]
+    total_events = sum(r['events'] for r in results)
+
+    summary = {
+        'requests': len(results),
+        'completed': len(completed),
+        'errors': sum(1 for r in results if r['outcome'] == 'error'),
+        'rejected': sum(1 for r in results if r['status'] == 429),
+        'failed': sum(1 for r in results if r['outcome'] not in ('complete', 'error')),
+        'wall_time': wall_time,
+        'requests_per_second': len(completed) / wall_time if wall_time else None,
+        'events_per_second': total_events / wall_time if wall_time else None,
+        'peak_rss_mb': monitor.peak_rss if monitor else None,
+        'peak_threads': monitor.peak_threads if monitor else None,
+    }
+    for name, values in (('ttfb', ttfb), ('first_content', first_content), ('complete', complete)):
+        for pct in (50, 95, 99):
+            summary[f'{name}_p{pct}'] = percentile(values, pct)
+    return summary
+
+
+def print_summary(summary):
+    def fmt(value, unit=''):
+        if value is None:
+            return 'n/a'
+        return f"{value * 1000:.0f}ms" if unit == 'ms' else f"{value:.1f}{unit}"
+
+    print('=' * 60)
+    print(f"📊 {summary['completed']}/{summary['requests']} completed in {summary['wall_time']:.1f}s "
+          f"({summary['errors']} errors, {summary['rejected']} rejected, {summary['failed']} failed)")
+    print(f"{'':16}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, label in (('ttfb', 'First byte'), ('first_content', 'First content'), ('complete', 'Complete')):
+        print(f"{label:16}" + ''.join(f"{fmt(summary[f'{name}_p{pct}'], 'ms'):>10}" for pct in (50, 95, 99)))
+    print(f"Throughput:     {fmt(summary['requests_per_second'])} req/s, {fmt(summary['events_per_second'])} events/s")
+    print(f"Server:         peak RSS {fmt(summary['peak_rss_mb'], ' MB')}, peak threads {summary['peak_threads'] or 'n/a'}")
+    print('=' * 60)
+
+
+def find_regressions(summary, baseline, tolerance):
+    regressions = []
+    for metric in REGRESSION_METRICS:
+        current, previous = summary.get(metric), baseline.get(metric)
+        if current is None or not previous:
+            continue
+        if metric == 'events_per_second':
+            regressed = current < previous * (1 - tolerance)
+        else:
+            regressed = current > previous * (1 + tolerance)
+        if regressed:
+            regressions.append(f"{metric}: {current:.3f} vs baseline {previous:.3f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test /api/generate_report against the stub backend')
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='flask')
+    parser.add_argument('--url', help='Test an already running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='Server PID to sample with --url')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--clients', type=int, default=10, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=50, help='Total requests')
+    parser.add_argument('--format', default='executive_summary')
+    parser.add_argument('--incidents', default=DEFAULT_INCIDENTS)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--stub-latency', type=float, default=0.2, help='Median seconds to first output')
+    parser.add_argument('--stub-latency-sigma', type=float, default=0.25)
+    parser.add_argument('--stub-output-chars', type=int, default=2000)
+    parser.add_argument('--stub-chunk-chars', type=int, default=40)
+    parser.add_argument('--stub-chunk-interval', type=float, default=0.005)
+    parser.add_argument('--stub-failure-rate', type=float, default=0.0)
+    parser.add_argument('--json', help='Write the summary to this file')
+    parser.add_argument('--baseline', help='Summary JSON from a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative change before --baseline counts it as a regression')
+    args = parser.parse_args(argv)
+
+    notes = load_incident_notes(args.incidents)
+    server = None
+    pid = args.pid
+    if args.url:
+        parsed = urlparse(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        env = dict(
+            os.environ,
+            GENERATION_BACKEND='stub',
+            STUB_LATENCY_SECONDS=str(args.stub_latency),
+            STUB_LATENCY_SIGMA=str(args.stub_latency_sigma),
+            STUB_OUTPUT_CHARS=str(args.stub_output_chars),
+            STUB_CHUNK_CHARS=str(args.stub_chunk_chars),
+            STUB_CHUNK_INTERVAL_SECONDS=str(args.stub_chunk_interval),
+            STUB_FAILURE_RATE=str(args.stub_failure_rate),
+            REPORT_CACHE_PATH='',
+            # The benchmark measures the server, not admission control
+            GENERATION_MAX_CONCURRENT=os.environ.get('GENERATION_MAX_CONCURRENT', str(args.clients)),
+            GENERATION_MAX_QUEUE=os.environ.get('GENERATION_MAX_QUEUE', str(args.requests)),
+        )
+        host, port = '127.0.0.1', args.port
+        server = start_server(args.server, port, env)
+        pid = server.pid
+
+    monitor = ProcessMonitor(pid) if pid else None
+    if monitor:
+        monitor.start()
+
+    print(f"🚀 {args.requests} requests, {args.clients} concurrent clients, format={args.format}")
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            futures = [
+                executor.submit(run_request, host, port, {
+                    'incident_notes': f"{notes[i % len(notes)]}\n[load test request {i}]",
+                    'format': args.format,
+                    'force_regenerate': True,
+                }, args.timeout)
+                for i in range(args.requests)
+            ]
+            results = [future.result() for future in futures]
+        wall_time = time.perf_counter() - started
+        if monitor:
+            monitor.stop()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    summary = summarise(results, wall_time, monitor)
+    summary.update(server=args.url or args.server, clients=args.clients, format=args.format)
+    print_summary(summary)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            return 1
+        print("✅ No regressions against baseline")
+
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
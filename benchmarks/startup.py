@@ -0,0 +1,233 @@
+"""
+Cold start benchmark
+
+Measures what an autoscaled worker pays before serving its first report:
+the time to import the app, the time from spawning the server to its first
+completed /api/generate_report (against the stub backend), the server's RSS
+once it has served that request, and the modules loaded by the import. Each
+run is a fresh process starting from a copy of a report store and
+similarity index holding --incidents earlier incidents, as a long-running
+deployment's would; medians over the runs are reported. For the Flask
+server the first /apispec.json request is timed too, since the API docs
+are built on first use (see api_docs.py).
+
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --incidents 0   # start from an empty store and index
+    python benchmarks/startup.py --api-docs eager   # compare with docs built at startup
+    python benchmarks/startup.py --json startup.json
+    python benchmarks/startup.py --baseline startup.json   # exit 1 on regression
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from load_test import REPO_ROOT, SERVER_COMMANDS, read_process_stats
+
+APP_MODULES = {'flask': 'app', 'asgi': 'asgi_app'}
+
+IMPORT_SCRIPT = (
+    "import sys, time; started = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - started, len(sys.modules))"
+)
+
+# Fills a report store and similarity index (argv: data directory, incident count)
+POPULATE_SCRIPT = """
+import os, random, sys
+from report_store import ReportStore
+from similarity_index import SimilarityIndex
+data_dir, count = sys.argv[1], int(sys.argv[2])
+store = ReportStore(os.path.join(data_dir, 'reports.db'))
+index = SimilarityIndex(db_path=os.path.join(data_dir, 'similarity_index.db'))
+words = ['api', 'db', 'latency', 'errors', 'deploy', 'rollback', 'pager', 'queue', 'disk', 'dns', 'cache', 'pod']
+for n in range(count):
+    notes = '\\n'.join(f'[{10 + line}:00] incident {n}: ' + ' '.join(random.choices(words, k=12))
+                        for line in range(8))
+    store.save(notes, 'executive_summary', '', f'# Incident {n}\\n\\n{notes}')
+    index.add(notes, {'executive_summary': f'benchmark-{n}'})
+"""
+
+# Lower is better for all of these
+REGRESSION_METRICS = ['import_seconds', 'first_request_seconds', 'rss_mb']
+
+
+def measure_import(module, env):
+    """Seconds to import `module` in a fresh interpreter, and the modules it loaded"""
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module)], cwd=REPO_ROOT,
+                            env=env, capture_output=True, text=True, check=True).stdout
+    seconds, modules = output.strip().splitlines()[-1].split()
+    return float(seconds), int(modules)
+
+
+def populate(data_dir, incidents, env):
+    """Fill a report store and similarity index in `data_dir` with `incidents` earlier incidents"""
+    subprocess.run([sys.executable, '-c', POPULATE_SCRIPT, data_dir, str(incidents)], cwd=REPO_ROOT,
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def measure_server(kind, port, env, timeout=30):
+    """
+    Spawn the server and time how long it takes to listen and to finish its
+    first report; then read its RSS and, for Flask, time the first spec request
+    """
+    result = {}
+    started = time.perf_counter()
+    process = subprocess.Popen(SERVER_COMMANDS[kind] + [str(port)], cwd=REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{kind} server exited during startup (code {process.returncode})")
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"{kind} server did not start listening on port {port}")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.005)
+        result['listen_seconds'] = time.perf_counter() - started
+
+        generate_report(port, timeout)
+        result['first_request_seconds'] = time.perf_counter() - started
+        result['rss_mb'] = read_process_stats(process.pid).get('VmRSS')
+
+        if kind == 'flask':
+            docs_started = time.perf_counter()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+            connection.request('GET', '/apispec.json')
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status == 200:
+                result['docs_first_request_seconds'] = time.perf_counter() - docs_started
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def generate_report(port, timeout):
+    """POST one generation and read its stream to the final event"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        connection.request('POST', '/api/generate_report', headers={'Content-Type': 'application/json'},
+                           body=json.dumps({'incident_notes': f'[14:00] startup benchmark {time.time()}',
+                                            'format': 'executive_summary', 'force_regenerate': True}))
+        response = connection.getresponse()
+        for line in response:
+            if line.startswith(b'data: ') and json.loads(line[6:])['type'] in ('complete', 'error'):
+                return
+        raise RuntimeError(f"first request ended without a final event (HTTP {response.status})")
+    finally:
+        connection.close()
+
+
+def summarise(runs):
+    """Median of every metric over the runs"""
+    summary = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs if run.get(metric) is not None]
+        summary[metric] = statistics.median(values) if values else None
+    return summary
+
+
+def print_summary(summary, runs):
+    def ms(value):
+        return 'n/a' if value is None else f"{value * 1000:.0f}ms"
+
+    print('=' * 60)
+    print(f"📊 Median of {runs} cold starts")
+    print(f"Import:         {ms(summary['import_seconds'])} ({summary['modules']:.0f} modules)")
+    print(f"Listening:      {ms(summary['listen_seconds'])} after spawn")
+    print(f"First request:  {ms(summary['first_request_seconds'])} after spawn")
+    if summary.get('docs_first_request_seconds') is not None:
+        print(f"First API spec: {ms(summary['docs_first_request_seconds'])}")
+    rss = summary['rss_mb']
+    print(f"Baseline RSS:   {'n/a' if rss is None else f'{rss:.1f} MB'}")
+    print('=' * 60)
+
+
+def find_regressions(summary, baseline, tolerance):
+    regressions = []
+    for metric in REGRESSION_METRICS:
+        current, previous = summary.get(metric), baseline.get(metric)
+        if current is None or not previous:
+            continue
+        if current > previous * (1 + tolerance):
+            regressions.append(f"{metric}: {current:.3f} vs baseline {previous:.3f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure cold start: import time, time to first request and RSS')
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='flask')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts to take the median of')
+    parser.add_argument('--api-docs', choices=['lazy', 'eager', 'off'],
+                        help='API_DOCS for the server (default: inherited)')
+    parser.add_argument('--incidents', type=int, default=10000,
+                        help='Earlier incidents in the report store and similarity index each run starts with')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--json', help='Write the summary to this file')
+    parser.add_argument('--baseline', help='Summary JSON from a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative change before --baseline counts it as a regression')
+    args = parser.parse_args(argv)
+
+    env = dict(
+        os.environ,
+        GENERATION_BACKEND='stub',
+        STUB_LATENCY_SECONDS='0',
+        STUB_LATENCY_SIGMA='0',
+        STUB_OUTPUT_CHARS='200',
+        STUB_CHUNK_INTERVAL_SECONDS='0',
+        REPORT_CACHE_PATH='',
+    )
+    if args.api_docs:
+        env['API_DOCS'] = args.api_docs
+
+    print(f"🚀 {args.runs} cold starts of the {args.server} server ({args.incidents} earlier incidents)")
+    runs = []
+    with tempfile.TemporaryDirectory() as populated_dir:
+        populate(populated_dir, args.incidents, env)
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as data_dir:
+                # Every run starts from the same store and index
+                shutil.copytree(populated_dir, data_dir, dirs_exist_ok=True)
+                run_env = dict(env, REPORT_STORE_PATH=os.path.join(data_dir, 'reports.db'),
+                               SIMILARITY_INDEX_PATH=os.path.join(data_dir, 'similarity_index.db'))
+                import_seconds, modules = measure_import(APP_MODULES[args.server], run_env)
+                runs.append({'import_seconds': import_seconds, 'modules': modules,
+                             **measure_server(args.server, args.port, run_env, args.timeout)})
+
+    summary = summarise(runs)
+    summary.update(server=args.server, runs=args.runs, incidents=args.incidents,
+                   api_docs=env.get('API_DOCS', 'lazy'))
+    print_summary(summary, args.runs)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            return 1
+        print("✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Pools of pre-started Claude CLI processes
+
+Starting the CLI costs a Node runtime boot, config loading and an auth
+check before it reads a single byte of the prompt. A pool keeps `size`
+processes started and waiting on stdin, so a generation checks out one that
+is already warm instead of paying for the start itself. Each process serves
+one generation: a CLI session keeps its conversation, so a process that
+served one incident must not see the next. The pool replaces every process
+it hands out.
+
+A health check runs every `health_interval` seconds: processes that
+crashed while idle are dropped, processes idle for longer than
+`max_idle_seconds` are retired (so config and credential changes are picked
+up) and the pool is topped back up. When the pool is empty a checkout
+spawns a process on the spot.
+
+ProcessPool serves the threaded Flask server; AsyncProcessPool is the
+asyncio version for the ASGI server. Each starts filling on its first
+checkout or on `start()`.
+"""
+
+import asyncio
+import atexit
+import threading
+import time
+from collections import deque
+
+
+class _PoolStats:
+    """Counters shared by both pool flavours"""
+
+    def __init__(self, size, max_idle_seconds, health_interval):
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self.health_interval = health_interval
+        self.warm_checkouts = 0
+        self.cold_spawns = 0
+        self.crashed = 0
+        self.expired = 0
+        self.spawn_failures = 0
+        # (process, spawned_at), oldest first
+        self._ready = deque()
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'ready': len(self._ready),
+            'warm_checkouts': self.warm_checkouts,
+            'cold_spawns': self.cold_spawns,
+            'replaced': {'crashed': self.crashed, 'expired': self.expired},
+            'spawn_failures': self.spawn_failures,
+        }
+
+    def _take_ready(self, alive):
+        """Pop the newest healthy idle process, or None; counts the dead ones"""
+        while self._ready:
+            process, _ = self._ready.pop()
+            if alive(process):
+                self.warm_checkouts += 1
+                return process
+            self.crashed += 1
+        return None
+
+    def _sweep(self, alive, now):
+        """Drop crashed and expired idle processes; returns the expired ones to kill"""
+        expired = []
+        for entry in list(self._ready):
+            process, spawned_at = entry
+            if not alive(process):
+                self._ready.remove(entry)
+                self.crashed += 1
+                print("⚠️ Warm Claude CLI process exited while idle; replacing it")
+            elif now - spawned_at > self.max_idle_seconds:
+                self._ready.remove(entry)
+                self.expired += 1
+                expired.append(process)
+        return expired
+
+
+class ProcessPool(_PoolStats):
+    """
+    Keeps `size` processes from `spawn()` (subprocess.Popen objects) ready
+    for checkout. Thread-safe.
+    """
+
+    def __init__(self, spawn, size=4, max_idle_seconds=300.0, health_interval=5.0):
+        super().__init__(size, max_idle_seconds, health_interval)
+        self._spawn = spawn
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        """Start filling the pool in the background"""
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._maintain, name='cli-pool', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def checkout(self):
+        """A started process for one generation: a warm one if there is one, else a new one"""
+        self.start()
+        with self._lock:
+            process = self._take_ready(lambda p: p.poll() is None)
+            if process is None:
+                self.cold_spawns += 1
+        self._wake.set()
+        return process if process is not None else self._spawn()
+
+    def stats(self):
+        with self._lock:
+            return super().stats()
+
+    def close(self):
+        """Stop the health check and kill the idle processes"""
+        with self._lock:
+            self._closed = True
+            idle = [process for process, _ in self._ready]
+            self._ready.clear()
+        self._wake.set()
+        for process in idle:
+            _kill(process)
+
+    def _maintain(self):
+        while not self._closed:
+            with self._lock:
+                for process in self._sweep(lambda p: p.poll() is None, time.time()):
+                    threading.Thread(target=_kill, args=(process,), daemon=True).start()
+                missing = self.size - len(self._ready)
+            for _ in range(missing):
+                if not self._add_process():
+                    break
+            self._wake.wait(self.health_interval)
+            self._wake.clear()
+
+    def _add_process(self):
+        try:
+            process = self._spawn()
+        except OSError as e:
+            print(f"❌ Could not start a warm Claude CLI process: {e}")
+            with self._lock:
+                self.spawn_failures += 1
+            return False
+        with self._lock:
+            if self._closed:
+                _kill(process)
+                return False
+            self._ready.append((process, time.time()))
+        return True
+
+
+class AsyncProcessPool(_PoolStats):
+    """
+    Async version of ProcessPool for asyncio subprocesses from `spawn()`
+    (a coroutine function). Bound to the event loop that first uses it.
+    """
+
+    def __init__(self, spawn, size=4, max_idle_seconds=300.0, health_interval=5.0):
+        super().__init__(size, max_idle_seconds, health_interval)
+        self._spawn = spawn
+        self._wake = None
+        self._task = None
+
+    def start(self):
+        """Start filling the pool in the background; call from the event loop"""
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._maintain())
+
+    async def checkout(self):
+        """A started process for one generation: a warm one if there is one, else a new one"""
+        self.start()
+        process = self._take_ready(lambda p: p.returncode is None)
+        self._wake.set()
+        if process is None:
+            self.cold_spawns += 1
+            process = await self._spawn()
+        return process
+
+    async def close(self):
+        """Stop the health check and kill the idle processes"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        while self._ready:
+            process, _ = self._ready.popleft()
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+    async def _maintain(self):
+        while True:
+            for process in self._sweep(lambda p: p.returncode is None, time.time()):
+                process.kill()
+                await process.wait()
+            while len(self._ready) < self.size:
+                try:
+                    process = await self._spawn()
+                except OSError as e:
+                    print(f"❌ Could not start a warm Claude CLI process: {e}")
+                    self.spawn_failures += 1
+                    break
+                self._ready.append((process, time.time()))
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.health_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+def _kill(process):
+    if process.poll() is None:
+        process.kill()
+    process.wait()
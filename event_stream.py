@@ -0,0 +1,122 @@
+"""
+Wire formats for job event streams
+
+Events reach clients as Server-Sent Events by default. A client can ask
+for a leaner stream with query parameters on any streaming endpoint:
+
+- `stream=ndjson`: one JSON event per line, without SSE framing or event IDs
+- `compress=1`: gzip or brotli, whichever the client's Accept-Encoding
+  allows (brotli needs the optional `brotli` package). The compressor is
+  flushed after every frame, so nothing is held back.
+- `timestamps=1`: stamp events that carry no timestamp with their send time
+
+Every event sent carries the `request_id` of the request it is sent to (see
+tracing.py), so identical requests sharing one job can still be told apart.
+
+Whatever the format, content events published close together are sent as
+one frame (see jobs.Subscription.get_frame): a frame waits up to
+SSE_COALESCE_MS (default 50, 0 turns merging off) for more text and holds
+up to SSE_COALESCE_CHARS characters (default 4096).
+"""
+
+import json
+import os
+import zlib
+from datetime import datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COALESCE_SECONDS = float(os.environ.get('SSE_COALESCE_MS', '50')) / 1000
+COALESCE_CHARS = int(os.environ.get('SSE_COALESCE_CHARS', '4096'))
+
+_TRUE = ('1', 'true', 'yes')
+
+
+class StreamEncoder:
+    """Encodes one client's events in the wire format it asked for"""
+
+    def __init__(self, ndjson=False, timestamps=False, encoding=None, request_id=None):
+        self.ndjson = ndjson
+        self.timestamps = timestamps
+        self.encoding = encoding
+        self.request_id = request_id
+        # Spliced into each event's JSON rather than re-encoding the event
+        self._request_field = f'"request_id": {json.dumps(request_id)}, ' if request_id else ''
+        if encoding == 'br':
+            self._compressor = brotli.Compressor()
+        elif encoding == 'gzip':
+            self._compressor = zlib.compressobj(wbits=31)
+        else:
+            self._compressor = None
+
+    @property
+    def content_type(self):
+        return 'application/x-ndjson' if self.ndjson else 'text/event-stream'
+
+    @property
+    def headers(self):
+        return {'Content-Encoding': self.encoding} if self.encoding else {}
+
+    def frame(self, event, encoded=None, event_id=None):
+        """
+        Wire bytes for one event dict. Pass `encoded` when the event's JSON is
+        already at hand so it is not encoded again.
+        """
+        if self.timestamps and 'timestamp' not in event:
+            encoded = json.dumps(dict(event, timestamp=datetime.now().isoformat()))
+        elif encoded is None:
+            encoded = json.dumps(event)
+        if self._request_field and event:
+            encoded = '{' + self._request_field + encoded[1:]
+        if self.ndjson:
+            text = f"{encoded}\n"
+        elif event_id is not None:
+            text = f"id: {event_id}\ndata: {encoded}\n\n"
+        else:
+            text = f"data: {encoded}\n\n"
+        return self._compress(text.encode('utf-8'))
+
+    def close(self):
+        """Bytes that end the stream: the compressor's trailer, if any"""
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        if self.encoding == 'gzip':
+            return self._compressor.flush()
+        return b''
+
+    def _compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        if self.encoding == 'gzip':
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+
+def accepted_encodings(accept_encoding):
+    """Codings an Accept-Encoding header allows, ignoring q-values other than q=0"""
+    codings = set()
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            codings.add(coding.lower())
+    return codings
+
+
+def encoder_from_request(args, accept_encoding=None, request_id=None):
+    """Build a StreamEncoder from a request's query parameters, Accept-Encoding header and ID"""
+    encoding = None
+    if args.get('compress', '').lower() in _TRUE:
+        codings = accepted_encodings(accept_encoding)
+        if brotli is not None and 'br' in codings:
+            encoding = 'br'
+        elif 'gzip' in codings:
+            encoding = 'gzip'
+    return StreamEncoder(
+        ndjson=args.get('stream') == 'ndjson',
+        timestamps=args.get('timestamps', '').lower() in _TRUE,
+        encoding=encoding,
+        request_id=request_id,
+    )
@@ -0,0 +1,284 @@
+"""
+Post-mortem export bundles
+
+Writes the report sections of one incident as a single post-mortem, in the
+section order of project_spec/incident-summariser-example-output.md:
+
+- markdown: one document, each report under its own heading
+- html: the same document as a standalone page with inline styles
+- zip: one Markdown file per section
+
+Bundles are written section by section as the sections become available,
+so a large bundle is streamed to the client rather than built in memory.
+Used by the POST /api/export endpoint, which gathers the sections.
+"""
+
+import html
+import re
+import zipfile
+from datetime import datetime
+
+# Report formats in document order, with their headings
+SECTION_TITLES = {
+    'executive_summary': 'Executive Summary',
+    'root_cause_analysis': 'Root Cause Analysis',
+    'impact_assessment': 'Impact Assessment',
+    'resolution': 'Resolution',
+    'executive_communication': 'Executive Communication',
+    'visual_timeline': 'Incident Timeline',
+    'action_items': 'Action Item Tracker',
+}
+
+# Bundle formats: (content type, file extension)
+EXPORT_FORMATS = {
+    'markdown': ('text/markdown; charset=utf-8', 'md'),
+    'html': ('text/html; charset=utf-8', 'html'),
+    'zip': ('application/zip', 'zip'),
+}
+
+HTML_STYLE = """
+body { font: 15px/1.55 -apple-system, 'Segoe UI', Roboto, sans-serif; color: #1f2328; margin: 0; }
+main { max-width: 860px; margin: 0 auto; padding: 32px 24px 64px; }
+h1, h2 { border-bottom: 1px solid #d8dee4; padding-bottom: .3em; }
+section { margin-top: 40px; }
+pre { background: #f6f8fa; padding: 12px 16px; overflow-x: auto; border-radius: 6px; }
+code { font: 13px ui-monospace, SFMono-Regular, Menlo, monospace; }
+table { border-collapse: collapse; margin: 12px 0; }
+th, td { border: 1px solid #d8dee4; padding: 6px 12px; text-align: left; }
+blockquote { margin: 0; padding: 0 16px; color: #59636e; border-left: 4px solid #d8dee4; }
+li.task { list-style: none; margin-left: -1.3em; }
+.meta { color: #59636e; }
+.failed { color: #b42318; }
+"""
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+_RULE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+_LIST_ITEM = re.compile(r'^\s*([-*+]|\d+[.)])\s+(.*)$')
+_TASK = re.compile(r'^\[([ xX])\]\s+(.*)$')
+_TABLE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+_BOLD = re.compile(r'\*\*(.+?)\*\*|__(.+?)__')
+_ITALIC = re.compile(r'(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])|(?<!\w)_(?!\s)(.+?)(?<!\s)_(?!\w)')
+_LINK = re.compile(r'\[([^\]]+)\]\((https?://[^)\s]+)\)')
+
+
+def order_sections(names):
+    """Report formats in document order, without duplicates"""
+    return sorted(set(names), key=list(SECTION_TITLES).index)
+
+
+def slug(title):
+    """Heading anchor, as Markdown renderers make them"""
+    return re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-')
+
+
+def write_bundle(export_format, title, sections, toc=None):
+    """
+    Yield the bundle's bytes. `sections` yields dicts with `name`, `title`
+    and either `content` or, for a section that could not be produced,
+    `error`; each is written as soon as it arrives. Documents open with a
+    table of contents when `toc` lists the section titles.
+    """
+    writers = {'markdown': markdown_bundle, 'html': html_bundle, 'zip': zip_bundle}
+    return writers[export_format](title, sections, toc)
+
+
+def markdown_bundle(title, sections, toc=None):
+    """One Markdown document; `toc` lists the section titles to link to up front"""
+    yield f"# Post-Mortem: {title}\n\n_Exported {datetime.now().strftime('%Y-%m-%d %H:%M')}_\n\n".encode('utf-8')
+    if toc:
+        yield ('## Contents\n\n' + ''.join(f'- [{name}](#{slug(name)})\n' for name in toc) + '\n').encode('utf-8')
+    for section in sections:
+        body = section_markdown(section) if 'content' in section else '> ' + failed_note(section)
+        yield f"---\n\n## {section['title']}\n\n{body.strip()}\n\n".encode('utf-8')
+
+
+def html_bundle(title, sections, toc=None):
+    """A standalone HTML page, converted from Markdown section by section"""
+    yield (
+        '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+        f'<title>Post-Mortem: {html.escape(title)}</title>\n<style>{HTML_STYLE}</style>\n</head>\n<body>\n<main>\n'
+        f'<h1>Post-Mortem: {html.escape(title)}</h1>\n'
+        f"<p class=\"meta\">Exported {datetime.now().strftime('%Y-%m-%d %H:%M')}</p>\n"
+    ).encode('utf-8')
+    if toc:
+        links = ''.join(f'<li><a href="#{slug(name)}">{html.escape(name)}</a></li>' for name in toc)
+        yield f'<nav><h2>Contents</h2><ul>{links}</ul></nav>\n'.encode('utf-8')
+    for section in sections:
+        if 'content' in section:
+            body = markdown_to_html(section_markdown(section))
+        else:
+            body = f'<p class="failed">{inline_html(failed_note(section))}</p>'
+        yield (f'<section id="{slug(section["title"])}">\n<h2>{html.escape(section["title"])}</h2>\n'
+               f'{body}</section>\n').encode('utf-8')
+    yield b'</main>\n</body>\n</html>\n'
+
+
+def zip_bundle(title, sections, toc=None):
+    """A zip archive of per-section Markdown files, flushed after every section"""
+    output = _ChunkWriter()
+    archive = zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED)
+    for number, section in enumerate(sections, start=1):
+        body = section['content'] if 'content' in section else '> ' + failed_note(section)
+        info = zipfile.ZipInfo(f"{number:02d}-{slug(section['title'])}.md", datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, body.strip() + '\n')
+        yield output.drain()
+    archive.close()
+    yield output.drain()
+
+
+def failed_note(section):
+    return f"⚠️ This section could not be generated: {section.get('error') or 'unknown error'}"
+
+
+def section_markdown(section):
+    """A report nested under its section heading, without a first heading that repeats it"""
+    content = section['content'].strip()
+    first_line, _, rest = content.partition('\n')
+    match = _HEADING.match(first_line)
+    if match and slug(match.group(2)) == slug(section['title']):
+        content = rest.strip()
+    return demote_headings(content, 3)
+
+
+def demote_headings(markdown, top):
+    """Shift headings down so the highest one is level `top` (h6 at most), leaving code blocks alone"""
+    lines = markdown.split('\n')
+    headings = {}
+    in_code = False
+    for index, line in enumerate(lines):
+        if line.lstrip().startswith('```'):
+            in_code = not in_code
+        elif not in_code and _HEADING.match(line):
+            headings[index] = _HEADING.match(line).groups()
+    if not headings:
+        return markdown
+    shift = max(0, top - min(len(hashes) for hashes, _ in headings.values()))
+    for index, (hashes, text) in headings.items():
+        lines[index] = '#' * min(6, len(hashes) + shift) + ' ' + text
+    return '\n'.join(lines)
+
+
+def markdown_to_html(markdown):
+    """
+    HTML for the Markdown the report prompts ask for: headings, paragraphs,
+    lists and task lists, tables, block quotes, rules, code blocks and
+    inline emphasis, code and links. Anything else is kept as text.
+    """
+    out = []
+    lines = markdown.replace('\r\n', '\n').split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if not stripped:
+            i += 1
+        elif stripped.startswith('```'):
+            i += 1
+            code = []
+            while i < len(lines) and not lines[i].strip().startswith('```'):
+                code.append(lines[i])
+                i += 1
+            i += 1
+            out.append(f'<pre><code>{html.escape(chr(10).join(code))}</code></pre>')
+        elif _HEADING.match(stripped):
+            hashes, text = _HEADING.match(stripped).groups()
+            out.append(f'<h{len(hashes)}>{inline_html(text)}</h{len(hashes)}>')
+            i += 1
+        elif _RULE.match(stripped):
+            out.append('<hr>')
+            i += 1
+        elif stripped.startswith('|') and i + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[i + 1]):
+            header = _table_cells(stripped)
+            i += 2
+            rows = []
+            while i < len(lines) and lines[i].strip().startswith('|'):
+                rows.append(_table_cells(lines[i].strip()))
+                i += 1
+            head = ''.join(f'<th>{inline_html(cell)}</th>' for cell in header)
+            body = ''.join('<tr>' + ''.join(f'<td>{inline_html(cell)}</td>' for cell in row) + '</tr>'
+                           for row in rows)
+            out.append(f'<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>')
+        elif _LIST_ITEM.match(line):
+            ordered = _LIST_ITEM.match(line).group(1)[0].isdigit()
+            items = []
+            while i < len(lines) and _LIST_ITEM.match(lines[i]):
+                items.append(_list_item_html(_LIST_ITEM.match(lines[i]).group(2)))
+                i += 1
+            tag = 'ol' if ordered else 'ul'
+            out.append(f'<{tag}>{"".join(items)}</{tag}>')
+        elif stripped.startswith('>'):
+            quoted = []
+            while i < len(lines) and lines[i].strip().startswith('>'):
+                quoted.append(lines[i].strip()[1:].lstrip())
+                i += 1
+            out.append(f'<blockquote>{markdown_to_html(chr(10).join(quoted))}</blockquote>')
+        else:
+            paragraph = []
+            while i < len(lines) and lines[i].strip() and not _starts_block(lines, i):
+                paragraph.append(inline_html(lines[i].strip()))
+                i += 1
+            if not paragraph:
+                paragraph.append(inline_html(stripped))
+                i += 1
+            out.append(f'<p>{"<br>".join(paragraph)}</p>')
+    return '\n'.join(out) + '\n'
+
+
+def inline_html(text):
+    """Escape text and render `code`, **bold**, *italic* and [links](https://...)"""
+    parts = text.split('`')
+    # An unmatched backtick is kept as text
+    if len(parts) % 2 == 0:
+        parts[-2:] = [parts[-2] + '`' + parts[-1]]
+    rendered = []
+    for index, part in enumerate(parts):
+        if index % 2:
+            rendered.append(f'<code>{html.escape(part)}</code>')
+            continue
+        part = html.escape(part, quote=False)
+        part = _LINK.sub(lambda m: f'<a href="{html.escape(m.group(2))}">{m.group(1)}</a>', part)
+        part = _BOLD.sub(lambda m: f'<strong>{m.group(1) or m.group(2)}</strong>', part)
+        part = _ITALIC.sub(lambda m: f'<em>{m.group(1) or m.group(2)}</em>', part)
+        rendered.append(part)
+    return ''.join(rendered)
+
+
+def _list_item_html(text):
+    task = _TASK.match(text)
+    if task:
+        checked = ' checked' if task.group(1) != ' ' else ''
+        return f'<li class="task"><input type="checkbox" disabled{checked}> {inline_html(task.group(2))}</li>'
+    return f'<li>{inline_html(text)}</li>'
+
+
+def _table_cells(line):
+    return [cell.strip() for cell in line.strip('|').split('|')]
+
+
+def _starts_block(lines, i):
+    stripped = lines[i].strip()
+    return bool(
+        stripped.startswith(('```', '>', '#'))
+        or _RULE.match(stripped) or _LIST_ITEM.match(lines[i])
+        or (stripped.startswith('|') and i + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[i + 1]))
+    )
+
+
+class _ChunkWriter:
+    """Write-only file for zipfile that hands over what was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
@@ -1,4 +1,4 @@
-import { useState } from 'react'
+import { useRef, useState } from 'react'
 import './App.css'
 import ReportModal from './ReportModal'
 
@@ -87,35 +87,71 @@ function App() {
   const [isGenerating, setIsGenerating] = useState(false)
   const [showModal, setShowModal] = useState(false)
   const [generatingFormats, setGeneratingFormats] = useState([])
+  // Formats showing a locally rendered draft while the refined version streams
+  const [draftFormats, setDraftFormats] = useState([])
+  // Formats reused from a near-identical earlier incident, with its similarity
+  const [nearMatches, setNearMatches] = useState({})
+  // Abort controllers for in-flight streams; aborting lets the server cancel the CLI run
+  const activeRequests = useRef(new Set())
+
+  const startRequest = () => {
+    const controller = new AbortController()
+    activeRequests.current.add(controller)
+    return controller
+  }
+
+  const cancelAllRequests = () => {
+    activeRequests.current.forEach(controller => controller.abort())
+    activeRequests.current.clear()
+  }
 
   const loadExample = (type) => {
     setIncidentNotes(EXAMPLES[type] || '')
   }
 
-  const generateSingleReport = async (formatType) => {
+  const markNearMatch = (formatType, data) => {
+    setNearMatches(prev => {
+      const updated = { ...prev }
+      if (data.near_match) {
+        updated[formatType] = data.similarity
+      } else {
+        delete updated[formatType]
+      }
+      return updated
+    })
+  }
+
+  const generateSingleReport = async (formatType, forceRegenerate = false) => {
     return new Promise(async (resolve, reject) => {
+      const controller = startRequest()
       try {
         const response = await fetch('http://localhost:5000/api/generate_report', {
           method: 'POST',
+          signal: controller.signal,
           headers: {
             'Content-Type': 'application/json',
           },
           body: JSON.stringify({
             incident_notes: incidentNotes,
             format: formatType,
+            force_regenerate: forceRegenerate,
           }),
         })
 
         const reader = response.body.getReader()
         const decoder = new TextDecoder()
         let generatedContent = ''
+        let showingDraft = false
+        let buffer = ''
 
         while (true) {
           const { done, value } = await reader.read()
           if (done) break
 
-          const text = decoder.decode(value)
-          const lines = text.split('\n')
+          // Content arrives in merged frames that can span reads; keep any partial line
+          buffer += decoder.decode(value, { stream: true })
+          const lines = buffer.split('\n')
+          buffer = lines.pop()
 
           for (const line of lines) {
             if (line.startsWith('data: ')) {
@@ -123,19 +159,32 @@ function App() {
 
               if (data.type === 'status') {
                 setStatus(`[${formatType}] ${data.message}`)
-              } else if (data.type === 'content') {
-                generatedContent += data.chunk
+              } else if (data.type === 'draft') {
+                // Show the local draft until the refined report is complete
+                showingDraft = true
+                setDraftFormats(prev => [...prev, formatType])
                 setReports(prev => ({
                   ...prev,
-                  [formatType]: generatedContent
+                  [formatType]: data.content
                 }))
+              } else if (data.type === 'content') {
+                generatedContent += data.chunk
+                if (!showingDraft) {
+                  setReports(prev => ({
+                    ...prev,
+                    [formatType]: generatedContent
+                  }))
+                }
               } else if (data.type === 'complete') {
                 setReports(prev => ({
                   ...prev,
                   [formatType]: generatedContent
                 }))
+                setDraftFormats(prev => prev.filter(f => f !== formatType))
+                markNearMatch(formatType, data)
                 resolve(generatedContent)
               } else if (data.type === 'error') {
+                setDraftFormats(prev => prev.filter(f => f !== formatType))
                 reject(new Error(data.error))
               }
             }
@@ -143,10 +192,91 @@ function App() {
         }
       } catch (error) {
         reject(error)
+      } finally {
+        activeRequests.current.delete(controller)
       }
     })
   }
 
+  // Generate every format over one stream; the server extracts the incident
+  // once and tags each content event with the format it belongs to
+  const generateAllReports = async (onSectionComplete) => {
+    const controller = startRequest()
+    try {
+      return await readAllReports(controller, onSectionComplete)
+    } finally {
+      activeRequests.current.delete(controller)
+    }
+  }
+
+  const readAllReports = async (controller, onSectionComplete) => {
+    const response = await fetch('http://localhost:5000/api/generate_report', {
+      method: 'POST',
+      signal: controller.signal,
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        incident_notes: incidentNotes,
+        format: 'all',
+      }),
+    })
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    const contents = {}
+    const drafts = new Set()
+    let buffer = ''
+
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+
+      buffer += decoder.decode(value, { stream: true })
+      const lines = buffer.split('\n')
+      buffer = lines.pop()
+
+      for (const line of lines) {
+        if (!line.startsWith('data: ')) continue
+        const data = JSON.parse(line.substring(6))
+
+        if (data.type === 'status') {
+          setStatus(data.message)
+        } else if (data.type === 'draft') {
+          // Locally rendered sections show their draft until the refined one completes
+          drafts.add(data.section)
+          setDraftFormats(prev => [...prev, data.section])
+          setReports(prev => ({
+            ...prev,
+            [data.section]: data.content
+          }))
+        } else if (data.type === 'content') {
+          contents[data.section] = (contents[data.section] || '') + data.chunk
+          if (!drafts.has(data.section)) {
+            setReports(prev => ({
+              ...prev,
+              [data.section]: contents[data.section]
+            }))
+          }
+        } else if (data.type === 'section_complete') {
+          if (drafts.has(data.section)) {
+            setReports(prev => ({
+              ...prev,
+              [data.section]: contents[data.section]
+            }))
+            setDraftFormats(prev => prev.filter(f => f !== data.section))
+          }
+          markNearMatch(data.section, data)
+          onSectionComplete(data.section)
+        } else if (data.type === 'complete') {
+          return data
+        } else if (data.type === 'error') {
+          throw new Error(data.error)
+        }
+      }
+    }
+  }
+
   const generateReport = async () => {
     if (!incidentNotes.trim()) {
       alert('Please enter incident notes first!')
@@ -154,7 +284,8 @@ function App() {
     }
 
     setReports({})
-    setStatus('🔌 Starting generation of all report formats in parallel...')
+    setNearMatches({})
+    setStatus('🔌 Starting generation of all report formats...')
     setIsGenerating(true)
     setShowModal(true)
 
@@ -163,25 +294,27 @@ function App() {
     // Mark all formats as generating
     setGeneratingFormats([...allFormats])
 
-    // Generate all reports in parallel for much faster completion
-    const generatePromises = allFormats.map(async (formatType) => {
-      try {
-        await generateSingleReport(formatType)
+    // Generate all reports from one shared analysis of the notes
+    try {
+      const result = await generateAllReports((formatType) => {
         setStatus(`✅ Completed ${FORMATS.find(f => f.value === formatType)?.label}`)
-        // Remove from generating array when done
         setGeneratingFormats(prev => prev.filter(f => f !== formatType))
-        return { formatType, success: true }
-      } catch (error) {
-        setStatus(`❌ Error generating ${formatType}: ${error.message}`)
-        setGeneratingFormats(prev => prev.filter(f => f !== formatType))
-        return { formatType, success: false, error }
+      })
+      if (result?.missing_sections?.length) {
+        setStatus(`⚠️ Missing reports: ${result.missing_sections.join(', ')}`)
       }
-    })
-
-    // Wait for all to complete
-    await Promise.all(generatePromises)
+    } catch (error) {
+      setStatus(error.name === 'AbortError'
+        ? '🛑 Generation cancelled'
+        : `❌ Error generating reports: ${error.message}`)
+      setGeneratingFormats([])
+      setDraftFormats([])
+      setIsGenerating(false)
+      return
+    }
 
     setGeneratingFormats([])
+    setDraftFormats([])
     setIsGenerating(false)
     setStatus('✅ All reports generated!')
   }
@@ -238,6 +371,8 @@ function App() {
           reports={reports}
           formats={FORMATS}
           generatingFormats={generatingFormats}
+          draftFormats={draftFormats}
+          nearMatches={nearMatches}
           incidentNotes={incidentNotes}
           onRegenerate={(formatType) => {
             setReports(prev => {
@@ -247,7 +382,7 @@ function App() {
             })
             setGeneratingFormats(prev => [...prev, formatType])
             setStatus(`📝 Regenerating ${FORMATS.find(f => f.value === formatType)?.label}...`)
-            generateSingleReport(formatType).then(() => {
+            generateSingleReport(formatType, true).then(() => {
               setGeneratingFormats(prev => prev.filter(f => f !== formatType))
               setStatus(`✅ Regenerated ${FORMATS.find(f => f.value === formatType)?.label}`)
             }).catch(error => {
@@ -255,7 +390,13 @@ function App() {
               setStatus(`❌ Error regenerating ${formatType}: ${error.message}`)
             })
           }}
-          onClose={() => setShowModal(false)}
+          onClose={() => {
+            cancelAllRequests()
+            setGeneratingFormats([])
+            setDraftFormats([])
+            setIsGenerating(false)
+            setShowModal(false)
+          }}
         />
       )}
     </div>
@@ -3,18 +3,21 @@ import ReactMarkdown from 'react-markdown'
 import { jsPDF } from 'jspdf'
 import './ReportModal.css'
 
-function ReportModal({ reports, formats, generatingFormats, incidentNotes, onRegenerate, onClose }) {
+function ReportModal({ reports, formats, generatingFormats, draftFormats = [], nearMatches = {}, incidentNotes, onRegenerate, onClose }) {
   const [isFullscreen, setIsFullscreen] = useState(false)
   const [activeTab, setActiveTab] = useState('executive_summary')
   const [createdTickets, setCreatedTickets] = useState(new Set())
   const currentReport = reports[activeTab] || ''
   const currentFormatLabel = formats.find(f => f.value === activeTab)?.label || activeTab
   const isRegenerating = generatingFormats.includes(activeTab)
+  const isDraft = draftFormats.includes(activeTab)
+  const nearMatch = nearMatches[activeTab]
 
   // Check if all reports are completed
   const allReportsCompleted = formats.every(f => reports[f.value])
 
   const getTabStatus = (formatValue) => {
+    if (draftFormats.includes(formatValue)) return 'draft'
     if (reports[formatValue]) return 'completed'
     if (generatingFormats.includes(formatValue)) return 'generating'
     return 'pending'
@@ -33,6 +36,33 @@ function ReportModal({ reports, formats, generatingFormats, incidentNotes, onReg
     URL.revokeObjectURL(url)
   }
 
+  // The server assembles the post-mortem from the cached reports, generating only missing sections
+  const exportPostMortem = async () => {
+    try {
+      const response = await fetch('http://localhost:5000/api/export', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ incident_notes: incidentNotes, export_format: 'html' })
+      })
+      if (!response.ok) {
+        const error = await response.json().catch(() => ({}))
+        alert('Export failed: ' + (error.error || response.statusText))
+        return
+      }
+      const blob = await response.blob()
+      const url = URL.createObjectURL(blob)
+      const a = document.createElement('a')
+      a.href = url
+      a.download = `post-mortem-${new Date().toISOString().split('T')[0]}.html`
+      document.body.appendChild(a)
+      a.click()
+      document.body.removeChild(a)
+      URL.revokeObjectURL(url)
+    } catch (err) {
+      alert('Export failed: ' + err)
+    }
+  }
+
   const printReport = () => {
     window.print()
   }
@@ -297,6 +327,9 @@ function ReportModal({ reports, formats, generatingFormats, incidentNotes, onReg
             >
               📄 Export PDF
             </button>
+            <button onClick={exportPostMortem} className="action-btn export-btn" title="Download the complete post-mortem as HTML" disabled={!incidentNotes}>
+              📦 Post-Mortem
+            </button>
             <button onClick={copyToClipboard} className="action-btn copy-btn" title="Copy to clipboard" disabled={!currentReport}>
               📋 Copy
             </button>
@@ -323,6 +356,7 @@ function ReportModal({ reports, formats, generatingFormats, incidentNotes, onReg
               >
                 {format.label}
                 {status === 'completed' && <span className="tab-indicator completed">✓</span>}
+                {status === 'draft' && <span className="tab-indicator draft">✎</span>}
                 {status === 'generating' && <span className="tab-indicator generating">⟳</span>}
                 {status === 'pending' && <span className="tab-indicator pending">⏱</span>}
               </button>
@@ -332,6 +366,15 @@ function ReportModal({ reports, formats, generatingFormats, incidentNotes, onReg
 
         <div className="modal-content">
           <div className="report-view">
+            {isDraft && (
+              <div className="draft-banner">⚡ Quick draft from the incident notes - refining with Claude...</div>
+            )}
+            {nearMatch && !isRegenerating && (
+              <div className="near-match-banner">
+                ≈ Reused the report of a {Math.round(nearMatch * 100)}% similar incident.
+                <button onClick={() => onRegenerate(activeTab)} className="near-match-regenerate">Regenerate for these notes</button>
+              </div>
+            )}
             {currentReport ? (
               <ReactMarkdown components={customComponents}>{currentReport}</ReactMarkdown>
             ) : (
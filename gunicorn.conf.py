@@ -0,0 +1,43 @@
+"""
+Production server: gunicorn -c gunicorn.conf.py app:app
+
+Pre-forks WEB_CONCURRENCY worker processes (default: one per CPU), each a
+threaded worker so long-lived SSE streams do not tie up a process. Workers
+load the app after forking, so each opens its own SQLite connections and
+starts its own background threads, and coordinate through the shared state
+file (see shared_state.py): one host-wide limit on Claude CLI calls, one
+result cache and one registry of in-flight jobs.
+"""
+
+import multiprocessing
+import os
+
+# Every worker (and the app they load) inherits these from the master
+os.environ.setdefault('SHARED_STATE_PATH', 'shared_state.db')
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+# Each open event stream holds a thread for as long as it is open
+threads = int(os.environ.get('GUNICORN_THREADS', '64'))
+preload_app = False
+# gthread workers heartbeat from their main loop, so this does not cut off
+# long streams; it only replaces workers that hang
+timeout = 60
+graceful_timeout = 30
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    """
+    Prefix log lines with request IDs, open the report store and similarity
+    index in the background, and start filling the warm CLI pool, if there
+    is one, before the first request
+    """
+    from app import CLI_BACKEND, warm_up_in_background
+    from backends import WarmCLIBackend
+    from tracing import install_log_prefix
+    install_log_prefix()
+    warm_up_in_background()
+    if isinstance(CLI_BACKEND, WarmCLIBackend):
+        CLI_BACKEND.pool.start()
@@ -0,0 +1,470 @@
+"""
+Generation jobs, event broadcast and cooperative cancellation
+
+Every generation request gets a Job. Its events go into an append-only
+EventBroadcast that any number of clients can follow from the start, so
+identical requests attach to the job already in flight instead of starting
+another CLI run (single-flight). Finished jobs stay findable for a short
+retention window so late joiners get the full replay.
+
+Each job's event log is bounded (JOB_EVENT_LOG_MAX events); events keep
+their absolute position as an ID, so a reconnecting client can resume from
+the last event it saw. Jobs started through POST /api/jobs are detached:
+they keep running with nobody listening and their result can be fetched
+once they finish.
+
+Whatever a job is currently holding (a place in the worker pool queue, a
+running Claude CLI process, an asyncio task) registers a cancel callback, so
+cancelling the job - because its last client went away or someone called
+DELETE /api/jobs/<id> - releases all of it.
+"""
+
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+# Most events kept per job; older ones are dropped from the front
+DEFAULT_MAX_EVENTS = int(os.environ.get('JOB_EVENT_LOG_MAX', '10000'))
+
+
+class JobCancelled(Exception):
+    """Raised inside a generation when its job has been cancelled"""
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class EventEntry:
+    """
+    One published event. Publishers hand over either the event dict (the
+    async server) or its JSON (the Flask workers); the other form is worked
+    out once, on first use, and shared by every reader.
+    """
+
+    __slots__ = ('message', '_event', '_encoded')
+
+    def __init__(self, message, event=None):
+        self.message = message
+        self._event = message if isinstance(message, dict) else event
+        self._encoded = message if isinstance(message, str) else None
+
+    @property
+    def event(self):
+        if self._event is None:
+            self._event = json.loads(self._encoded)
+        return self._event
+
+    @property
+    def encoded(self):
+        if self._encoded is None:
+            self._encoded = json.dumps(self._event)
+        return self._encoded
+
+
+def merge_content(entries):
+    """One content entry holding the text of consecutive content entries for the same section"""
+    if len(entries) == 1:
+        return entries[0]
+    first = entries[0].event
+    return EventEntry(dict(first, chunk=''.join(entry.event['chunk'] for entry in entries)))
+
+
+def _mergeable(first, entry, size, max_chars):
+    event = entry.event
+    return (size < max_chars and event.get('type') == 'content'
+            and event.get('section') == first.event.get('section'))
+
+
+class EventBroadcast:
+    """
+    Append-only event history that any number of readers can follow, each
+    at its own position. Readers may be threads (`get`) or coroutines
+    (`aget`); writers may be either.
+
+    Only the last `max_events` events are kept. Positions are absolute, so
+    an event's index is a stable ID even after earlier ones are dropped.
+    """
+
+    def __init__(self, max_events=None):
+        self._events = deque(maxlen=max_events or DEFAULT_MAX_EVENTS)
+        self._count = 0
+        self._cond = threading.Condition()
+        self._async_waiters = []
+        # Called with (position, EventEntry) after every put, e.g. to share
+        # the event with other worker processes (see shared_state.py)
+        self.on_put = None
+
+    def put(self, message, event=None):
+        """Publish an event dict or its JSON; pass the decoded `event` too if the caller has it"""
+        entry = EventEntry(message, event)
+        with self._cond:
+            self._events.append(entry)
+            position = self._count
+            self._count += 1
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        if self.on_put:
+            self.on_put(position, entry)
+
+    def get(self, index, timeout=None):
+        """
+        Return (index, EventEntry) for event `index`, waiting for it; raises
+        queue.Empty on timeout. If that event has been dropped, the oldest
+        event still kept is returned instead.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._count > index, timeout):
+                raise queue.Empty
+            return self._read(index)
+
+    async def aget(self, index):
+        """Async version of get(); wrap in asyncio.wait_for to time out"""
+        while True:
+            with self._cond:
+                if self._count > index:
+                    return self._read(index)
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+    def last(self):
+        with self._cond:
+            return self._events[-1].message if self._events else None
+
+    def ready(self, index):
+        """Whether event `index` has been published"""
+        with self._cond:
+            return self._count > index
+
+    def __len__(self):
+        """Number of events ever published, including dropped ones"""
+        with self._cond:
+            return self._count
+
+    def _read(self, index):
+        first = self._count - len(self._events)
+        index = max(index, first)
+        return index, self._events[index - first]
+
+
+class Subscription:
+    """
+    One client's read position in a job's event broadcast. `last_id` is the
+    ID of the event most recently read; `skipped` counts events this client
+    missed because they had already been dropped from the bounded log.
+    """
+
+    def __init__(self, job, start=0):
+        self.job = job
+        self.index = start
+        self.last_id = None
+        self.skipped = 0
+        # Set once this client has received the final event
+        self.finished = False
+        self.timed_out = False
+        self._entry = None
+
+    @property
+    def event(self):
+        """The event most recently read, decoded"""
+        return self._entry.event
+
+    @property
+    def encoded(self):
+        """The event most recently read, as JSON"""
+        return self._entry.encoded
+
+    def get(self, timeout=None):
+        """The next event as it was published"""
+        return self._advance(*self.job.events.get(self.index, timeout)).message
+
+    async def aget(self):
+        return self._advance(*await self.job.events.aget(self.index)).message
+
+    def get_frame(self, timeout=None, window=0.0, max_chars=4096):
+        """
+        Like get(), but content events for the same section published within
+        `window` seconds of the first are merged into it (up to `max_chars`
+        of text), so a client is sent one frame instead of dozens.
+        `last_id` is the ID of the last event merged. The frame is then in
+        `event` and `encoded`.
+        """
+        first = self._advance(*self.job.events.get(self.index, timeout))
+        if window <= 0 or first.event.get('type') != 'content':
+            return first
+        entries, size = [first], len(first.event['chunk'])
+        deadline = time.monotonic() + window
+        while True:
+            try:
+                index, entry = self.job.events.get(self.index, max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if index != self.index or not _mergeable(first, entry, size, max_chars):
+                break
+            entries.append(self._advance(index, entry))
+            size += len(entry.event['chunk'])
+        self._entry = merge_content(entries)
+        return self._entry
+
+    async def aget_frame(self, window=0.0, max_chars=4096):
+        """Async version of get_frame(); wrap in asyncio.wait_for to time out"""
+        first = self._advance(*await self.job.events.aget(self.index))
+        if window <= 0 or first.event.get('type') != 'content':
+            return first
+        entries, size = [first], len(first.event['chunk'])
+        deadline = time.monotonic() + window
+        while True:
+            if self.job.events.ready(self.index):
+                index, entry = self.job.events.get(self.index, 0)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    index, entry = await asyncio.wait_for(self.job.events.aget(self.index), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if index != self.index or not _mergeable(first, entry, size, max_chars):
+                break
+            entries.append(self._advance(index, entry))
+            size += len(entry.event['chunk'])
+        self._entry = merge_content(entries)
+        return self._entry
+
+    def _advance(self, index, entry):
+        self.skipped += index - self.index
+        self.last_id = index
+        self.index = index + 1
+        self._entry = entry
+        return entry
+
+
+class Job:
+    """A single generation that clients can follow and anyone can cancel"""
+
+    def __init__(self, description='', key=None, max_events=None):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.key = key
+        self.events = EventBroadcast(max_events)
+        self.created_at = time.time()
+        self.done_at = None
+        self.succeeded = False
+        self.cancel_reason = None
+        self.cancelled_at = None
+        # Detached jobs keep running when their last client leaves
+        self.detached = False
+        # Report text by section ('report' for single formats), locally
+        # rendered drafts by section, and the final event
+        self.result = {}
+        self.drafts = {}
+        self.final_event = None
+        # The tracing.Trace of the request that started the job, if any
+        self.trace = None
+        self._subscribers = 0
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return self.done_at is not None
+
+    @property
+    def status(self):
+        if self.cancelled:
+            return 'cancelled'
+        if self.done:
+            return 'succeeded' if self.succeeded else 'failed'
+        return 'running'
+
+    def record_event(self, event):
+        """Keep the report text, drafts and final event from an event dict"""
+        if event.get('type') == 'content':
+            self.result.setdefault(event.get('section') or 'report', []).append(event['chunk'])
+        elif event.get('type') == 'draft':
+            self.drafts[event.get('section') or 'report'] = event['content']
+        elif event.get('type') in ('complete', 'error'):
+            self.final_event = event
+
+    def result_text(self):
+        return {section: ''.join(chunks) for section, chunks in self.result.items()}
+
+    def subscribe(self, start=0):
+        with self._lock:
+            self._subscribers += 1
+        return Subscription(self, start)
+
+    def unsubscribe(self):
+        """Drop a subscriber; returns how many remain"""
+        with self._lock:
+            self._subscribers -= 1
+            return self._subscribers
+
+    def add_cancel_callback(self, callback):
+        """
+        Call `callback()` when the job is cancelled, or straight away if it
+        already was. Returns a function that unregisters the callback.
+        """
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._discard_callback(callback)
+        callback()
+        return lambda: None
+
+    def cancel(self, reason='cancelled'):
+        """Cancel the job; returns False if it was already cancelled"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancel_reason = reason
+            self.cancelled_at = time.time()
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"❌ Cancel callback failed for job {self.id}: {str(e)}")
+        return True
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.cancel_reason)
+
+    def _discard_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class JobRegistry:
+    """
+    Jobs by ID, and by request key for single-flight deduplication.
+    Finished jobs are kept for `retention_seconds` so identical requests
+    arriving just after completion still get the replay.
+    """
+
+    def __init__(self, retention_seconds=900):
+        self.retention_seconds = retention_seconds
+        self.cancelled = 0
+        self.coalesced = 0
+        self._jobs = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge()
+            return self._jobs.get(job_id)
+
+    def claim(self, job, include_finished=True, detached=False):
+        """
+        Subscribe to the live job with the same key as `job`, or register
+        `job` if there is none. Returns (subscription, created). Finished jobs
+        only match when they succeeded and `include_finished` is set.
+        `detached` marks whichever job is returned as detached.
+        """
+        with self._lock:
+            self._purge()
+            existing = self._by_key.get(job.key) if job.key else None
+            if existing and not existing.cancelled and (
+                    not existing.done or (include_finished and existing.succeeded)):
+                self.coalesced += 1
+                existing.detached = existing.detached or detached
+                return existing.subscribe(), False
+
+            job.detached = detached
+            self._jobs[job.id] = job
+            if job.key:
+                self._by_key[job.key] = job
+            return job.subscribe(), True
+
+    def subscribe(self, job_id, start=0):
+        """Follow an existing job from event `start`; None if it is unknown"""
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            return job.subscribe(start) if job else None
+
+    def release(self, subscription):
+        """
+        Called when a client stops reading. If it was the last client and the
+        job had not finished, the job is cancelled unless it is detached.
+        """
+        job = subscription.job
+        with self._lock:
+            remaining = job.unsubscribe()
+            abandoned = (remaining == 0 and not subscription.finished
+                         and not job.done and not job.detached)
+            if abandoned:
+                # Stop new clients joining a job that is about to be cancelled
+                self._forget_key(job)
+        if abandoned:
+            self.cancel(job, 'timed out' if subscription.timed_out else 'client disconnected')
+
+    def finish(self, job, succeeded):
+        """Record that the job's worker has produced its last event"""
+        with self._lock:
+            job.succeeded = succeeded and not job.cancelled
+            job.done_at = time.time()
+            if not job.succeeded:
+                self._forget_key(job)
+
+    def cancel(self, job, reason):
+        """Cancel a job and count it; returns False if it was already cancelled"""
+        if not job.cancel(reason):
+            return False
+        with self._lock:
+            self.cancelled += 1
+            self._forget_key(job)
+        print(f"🛑 Cancelled job {job.id} ({job.description}): {reason}")
+        return True
+
+    def stats(self):
+        with self._lock:
+            self._purge()
+            running = sum(1 for job in self._jobs.values() if not job.done and not job.cancelled)
+            return {
+                'active': running,
+                'retained': len(self._jobs) - running,
+                'cancelled': self.cancelled,
+                'coalesced': self.coalesced,
+            }
+
+    def _forget_key(self, job):
+        if job.key and self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _purge(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job for job in self._jobs.values()
+            if (job.done_at or job.cancelled_at or float('inf')) < cutoff
+        ]
+        for job in expired:
+            del self._jobs[job.id]
+            self._forget_key(job)
+
+
+def registry_from_env():
+    """Build the job registry from JOB_* environment variables"""
+    return JobRegistry(
+        retention_seconds=int(os.environ.get('JOB_RETENTION_SECONDS', '900')),
+    )
@@ -0,0 +1,437 @@
+"""
+Live incident sessions
+
+During an active incident the notes keep growing. A live session holds the
+notes so far, the parsed timeline and the last version of every report;
+clients only send the lines that are new. Appends are debounced and
+batched. Each batch is parsed on its own, so the timeline and action items
+are extended rather than rebuilt. Only the formats written by the Claude
+CLI that the new events touch are updated, and they are updated from their
+previous version plus the new lines instead of from the whole transcript.
+Subscribers follow one long-lived event stream per session.
+"""
+
+import functools
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from jobs import Job, JobCancelled
+from local_renderers import (
+    LOCAL_RENDERERS,
+    TimelineParser,
+    extract_action_items,
+    format_action_items,
+    format_visual_timeline,
+    merge_action_items,
+    phase_durations,
+    timeline_lines,
+)
+from metrics import GENERATION_SECONDS, GENERATIONS
+from scheduling import request_priority
+from worker_pool import PoolFullError
+
+UPDATE_PROMPT = """
+IMPORTANT: You are acting as an incident report generator, NOT as a coding assistant. Your ONLY task is to generate the requested report content directly. Do not respond as "Claude Code" or offer to help with coding tasks. Do NOT include any preamble, introduction, or meta-commentary. Start directly with the requested content.
+
+You are an expert SRE technical writer keeping a report up to date during a live incident. The CURRENT REPORT was written from the incident notes so far; the NEW INCIDENT NOTES have been added to the channel since.
+
+CURRENT REPORT:
+{report}
+
+NEW INCIDENT NOTES:
+{new_notes}
+
+Rewrite the report so it reflects the new notes. Keep everything that is still accurate, add new events, findings and actions in the right places, and correct anything the new notes contradict. The report must still follow its original instructions:
+
+{instructions}
+
+Output the complete updated report.
+"""
+
+# Formats written by the CLI that new events of each kind can change. Other
+# kinds (investigation, questions, untimestamped lines) only extend the
+# local timeline; a CLI format sees those lines at its next update, or once
+# it has fallen `max_lines_behind` lines behind.
+AFFECTED_FORMATS = {
+    'alert': ['executive_summary', 'impact_assessment'],
+    'issue': ['executive_summary', 'impact_assessment'],
+    'metrics': ['impact_assessment'],
+    'root_cause': ['executive_summary', 'root_cause_analysis', 'executive_communication'],
+    'mitigation': ['executive_summary', 'resolution'],
+    'deploy': ['resolution'],
+    'recovery': ['impact_assessment', 'resolution'],
+    'resolved': ['executive_summary', 'impact_assessment', 'resolution', 'executive_communication'],
+    'follow_up': ['root_cause_analysis', 'resolution'],
+}
+
+
+class SessionClosed(Exception):
+    """Raised when appending to a session that has been closed"""
+
+
+class TooManySessions(Exception):
+    """Raised when LIVE_SESSION_MAX sessions are already open"""
+
+
+class LiveSession:
+    """
+    One incident's growing notes and reports. visual_timeline and
+    action_items are kept up to date locally on every batch; the other
+    formats are queued on the generation pool when their events change,
+    each format as its own job. A failed update is retried after
+    `retry_seconds`, doubling up to `max_retry_seconds` while it keeps
+    failing.
+
+    `full_prompt(notes, format)` builds the prompt for a format's first
+    version and `instructions(format)` a format's instructions for the
+    update prompt. `submit(fn, output_queue, job, priority, client)` runs a
+    CLI update on the generation pool, queued as `client`.
+    """
+
+    def __init__(self, formats, backend, submit, full_prompt, instructions,
+                 debounce_seconds=2.0, max_delay_seconds=10.0, max_lines_behind=20,
+                 retry_seconds=5.0, max_retry_seconds=300.0, client=None):
+        self.id = uuid.uuid4().hex
+        self.client = client
+        self.formats = formats
+        self.backend = backend
+        self.submit = submit
+        self.full_prompt = full_prompt
+        self.instructions = instructions
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.max_lines_behind = max_lines_behind
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.created_at = self.updated_at = time.time()
+        self.closed = False
+
+        # The session's event log and cancellation (see jobs.py)
+        self.job = Job(f'session {self.id}')
+        self.lines = []
+        self.version = 0
+        self.timeline = TimelineParser()
+        self.timeline_body = []
+        self.action_items = []
+        # CLI-written reports, how many lines each was written from, and the
+        # formats whose events have changed since
+        self.reports = {}
+        self.covered = {}
+        self.dirty = set()
+
+        self._pending = []
+        self._first_pending_at = None
+        self._timer = None
+        # Formats with an update queued or running, and failed formats
+        # waiting to be retried: format -> (failures in a row, retry timer)
+        self._updating = set()
+        self._failures = {}
+        self._lock = threading.RLock()
+
+    @property
+    def cli_formats(self):
+        return [name for name in self.formats if name not in LOCAL_RENDERERS]
+
+    def append(self, text):
+        """
+        Queue new note lines. They are applied once appends pause for
+        `debounce_seconds`, or `max_delay_seconds` after the first queued
+        line at the latest. Returns the number of lines waiting.
+        """
+        lines = text.replace('\r\n', '\n').replace('\r', '\n').strip('\n').split('\n')
+        with self._lock:
+            if self.closed:
+                raise SessionClosed(self.job.cancel_reason)
+            now = time.time()
+            self._pending.extend(lines)
+            self.updated_at = now
+            if self._first_pending_at is None:
+                self._first_pending_at = now
+            if self._timer:
+                self._timer.cancel()
+            delay = min(self.debounce_seconds, self._first_pending_at + self.max_delay_seconds - now)
+            self._timer = threading.Timer(max(0.0, delay), self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+            return len(self._pending)
+
+    def flush(self):
+        """Apply the queued lines as one batch"""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if self.closed or not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self._first_pending_at = None
+            start_time = time.perf_counter()
+
+            self.lines.extend(batch)
+            self.version += 1
+            new_events = self.timeline.feed('\n'.join(batch))
+            earlier = self.timeline.events[:-len(new_events)] if new_events else self.timeline.events
+            new_body = timeline_lines(new_events, earlier[-1]['minute'] if earlier else None)
+            self.timeline_body.extend(new_body)
+            added_items = merge_action_items(self.action_items, extract_action_items(new_events))
+
+            affected = {name for event in new_events for name in AFFECTED_FORMATS.get(event['kind'], ())}
+            # Formats not written yet are written in full from the first batch,
+            # and lines of any kind reach a format once enough have piled up
+            affected.update(name for name in self.cli_formats if name not in self.reports)
+            affected.update(name for name in self.cli_formats
+                            if len(self.lines) - self.covered.get(name, 0) >= self.max_lines_behind)
+            # A failing format waits for its retry
+            self.dirty.update(name for name in self.cli_formats
+                              if name in affected and not self._retry_pending(name))
+
+            render_time = (time.perf_counter() - start_time) * 1000
+            print(f"📡 Session {self.id[:8]} v{self.version}: {len(batch)} lines, {len(new_events)} events "
+                  f"({render_time:.1f}ms), updating {sorted(self.dirty) or 'nothing'}")
+            self._publish(
+                'session_update',
+                version=self.version,
+                new_lines=len(batch),
+                total_lines=len(self.lines),
+                events=new_events,
+                timeline_lines=new_body,
+                action_items=added_items,
+                phases=phase_durations(self.timeline.events),
+                pending_formats=sorted(self.dirty),
+                render_time=f"{render_time:.1f}ms",
+            )
+            for name, content in self.local_reports().items():
+                self._publish('report', section=name, content=content, renderer='local', version=self.version)
+            self._start_update()
+
+    def local_reports(self):
+        """The locally kept formats, rendered from the timeline so far"""
+        with self._lock:
+            title, events = self.timeline.title, self.timeline.events
+            renderers = {
+                'visual_timeline': lambda: format_visual_timeline(title, events, self.timeline_body),
+                'action_items': lambda: format_action_items(title, events, self.action_items),
+            }
+            return {name: renderers[name]() for name in self.formats if name in renderers}
+
+    def close(self, reason='closed'):
+        """Close the session, cancelling any CLI update in progress"""
+        with self._lock:
+            if self.closed:
+                return False
+            if self._timer:
+                self._timer.cancel()
+            for _, retry in self._failures.values():
+                if retry:
+                    retry.cancel()
+            self._publish('session_closed', reason=reason, version=self.version)
+            self.closed = True
+        self.job.cancel(reason)
+        return True
+
+    def status(self):
+        with self._lock:
+            return {
+                'session_id': self.id,
+                'formats': self.formats,
+                'version': self.version,
+                'total_lines': len(self.lines),
+                'pending_lines': len(self._pending),
+                'events': len(self.timeline.events),
+                'pending_formats': sorted(self.dirty),
+                'reports': {**self.reports, **self.local_reports()},
+                # Lines each CLI-written report has not seen yet
+                'lines_behind': {name: len(self.lines) - self.covered.get(name, 0) for name in self.cli_formats},
+                'created_at': datetime.fromtimestamp(self.created_at).isoformat(),
+                'updated_at': datetime.fromtimestamp(self.updated_at).isoformat(),
+                'closed': self.closed,
+            }
+
+    def _publish(self, event_type, **fields):
+        if not self.closed:
+            event = {'type': event_type, **fields}
+            if event_type != 'content':
+                # Streamed content goes without; clients can ask for send times (see event_stream.py)
+                event['timestamp'] = datetime.now().isoformat()
+            self.job.events.put(event)
+
+    def _start_update(self):
+        """Queue a CLI update on the generation pool for every changed format not already queued"""
+        with self._lock:
+            if self.closed:
+                return
+            names = sorted(self.dirty - self._updating, key=self._staleness)
+            self._updating.update(names)
+            notes = '\n'.join(self.lines)
+        for position, name in enumerate(names):
+            try:
+                # Queued at the priority of the format it updates
+                self.submit(functools.partial(self._run_update, name), self.job.events, self.job,
+                            priority=request_priority(notes, name), client=self.client)
+            except PoolFullError as e:
+                retry_after = max(1, int(e.retry_after))
+                print(f"🚦 Session {self.id[:8]} update deferred, queue full (retry after {retry_after}s)")
+                self._publish('status', message=f'⏳ Server is busy, updating reports in {retry_after}s',
+                              retry_after=retry_after)
+                with self._lock:
+                    self._updating.difference_update(names[position:])
+                retry = threading.Timer(retry_after, self._start_update)
+                retry.daemon = True
+                retry.start()
+                return
+
+    def _run_update(self, name):
+        try:
+            with self._lock:
+                if self.closed or name not in self.dirty:
+                    return
+                self.dirty.discard(name)
+                upto = len(self.lines)
+                previous = self.reports.get(name)
+                new_lines = self.lines[self.covered.get(name, 0):upto]
+                all_lines = self.lines[:upto]
+                if previous is not None and not new_lines:
+                    # An earlier update already covered these lines
+                    return
+            self._update_report(name, previous, all_lines, new_lines, upto)
+        finally:
+            with self._lock:
+                self._updating.discard(name)
+            # Lines that arrived during the update are picked up now
+            self._start_update()
+
+    def _staleness(self, name):
+        """Sort key putting the format written from the fewest lines first"""
+        return self.covered.get(name, 0), self.formats.index(name)
+
+    def _retry_pending(self, name):
+        return self._failures.get(name, (0, None))[1] is not None
+
+    def _retry_later(self, name):
+        """Put a failed format back in `dirty` after a backoff; returns the delay"""
+        with self._lock:
+            failures = self._failures.get(name, (0, None))[0] + 1
+            delay = min(self.max_retry_seconds, self.retry_seconds * 2 ** (failures - 1))
+            retry = threading.Timer(delay, self._retry, args=(name,))
+            retry.daemon = True
+            self._failures[name] = (failures, retry)
+            retry.start()
+        return delay
+
+    def _retry(self, name):
+        with self._lock:
+            failures, _ = self._failures.get(name, (0, None))
+            self._failures[name] = (failures, None)
+            if self.closed:
+                return
+            self.dirty.add(name)
+        self._start_update()
+
+    def _update_report(self, name, previous, all_lines, new_lines, upto):
+        if previous is None:
+            mode = 'full'
+            prompt = self.full_prompt('\n'.join(all_lines), name)
+            self._publish('status', section=name, message=f'📝 Writing {name} from {len(all_lines)} lines...')
+        else:
+            mode = 'incremental'
+            prompt = UPDATE_PROMPT.format(report=previous, new_notes='\n'.join(new_lines),
+                                          instructions=self.instructions(name))
+            self._publish('status', section=name, message=f'✏️ Updating {name} with {len(new_lines)} new lines...')
+
+        start_time = time.time()
+        chunks = []
+        try:
+            for chunk in self.backend.iter_output(prompt, job=self.job, label=f'{name}:{mode}'):
+                chunks.append(chunk)
+                self._publish('content', section=name, chunk=chunk)
+        except JobCancelled:
+            GENERATIONS.inc(format=name, outcome='cancelled')
+            return
+        except Exception as e:
+            # The lines stay unseen and the format is retried after a backoff
+            GENERATIONS.inc(format=name, outcome='error')
+            retry_after = self._retry_later(name)
+            print(f"❌ Session {self.id[:8]} {name} update failed, retrying in {retry_after:.0f}s: {str(e)}")
+            self._publish('section_error', section=name, error=str(e), retry_after=retry_after)
+            return
+
+        elapsed = time.time() - start_time
+        GENERATION_SECONDS.observe(elapsed, format=name)
+        GENERATIONS.inc(format=name, outcome='success')
+        with self._lock:
+            self.reports[name] = ''.join(chunks)
+            self.covered[name] = upto
+            self._failures.pop(name, None)
+        print(f"✅ Session {self.id[:8]} {name} {mode} update in {elapsed:.1f}s ({len(prompt)} prompt chars)")
+        self._publish('section_complete', section=name, mode=mode, version=self.version,
+                      new_lines=len(new_lines), prompt_chars=len(prompt), generation_time=f"{elapsed:.1f}s")
+
+
+class SessionRegistry:
+    """
+    Open live sessions by ID. Sessions with no appends for `idle_seconds`
+    are closed; at most `max_sessions` may be open at once.
+    """
+
+    def __init__(self, idle_seconds=3600, max_sessions=50, **session_options):
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.session_options = session_options
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, formats, incident_notes='', client=None):
+        """Open a session for `client`; initial notes are applied straight away"""
+        with self._lock:
+            self._purge()
+            if len(self._sessions) >= self.max_sessions:
+                raise TooManySessions(f'{self.max_sessions} live sessions are already open')
+            session = LiveSession(formats, client=client, **self.session_options)
+            self._sessions[session.id] = session
+        print(f"📡 Opened live session {session.id} ({', '.join(formats)})")
+        if incident_notes:
+            session.append(incident_notes)
+            session.flush()
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            self._purge()
+            return self._sessions.get(session_id)
+
+    def close(self, session_id, reason='closed by request'):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session:
+            session.close(reason)
+            print(f"📡 Closed live session {session_id}: {reason}")
+        return session
+
+    def stats(self):
+        with self._lock:
+            self._purge()
+            return {'open': len(self._sessions)}
+
+    def _purge(self):
+        cutoff = time.time() - self.idle_seconds
+        for session in [s for s in self._sessions.values() if s.updated_at < cutoff]:
+            del self._sessions[session.id]
+            session.close('idle')
+            print(f"📡 Closed idle live session {session.id}")
+
+
+def sessions_from_env(**session_options):
+    """Build the session registry from LIVE_* environment variables"""
+    return SessionRegistry(
+        idle_seconds=int(os.environ.get('LIVE_SESSION_IDLE_SECONDS', '3600')),
+        max_sessions=int(os.environ.get('LIVE_SESSION_MAX', '50')),
+        debounce_seconds=float(os.environ.get('LIVE_DEBOUNCE_SECONDS', '2')),
+        max_delay_seconds=float(os.environ.get('LIVE_MAX_BATCH_DELAY_SECONDS', '10')),
+        max_lines_behind=int(os.environ.get('LIVE_MAX_LINES_BEHIND', '20')),
+        retry_seconds=float(os.environ.get('LIVE_RETRY_SECONDS', '5')),
+        max_retry_seconds=float(os.environ.get('LIVE_MAX_RETRY_SECONDS', '300')),
+        **session_options,
+    )
@@ -0,0 +1,306 @@
+"""
+Local renderers for the visual_timeline and action_items formats
+
+Both formats are mostly a mechanical rearrangement of `[HH:MM] @user:
+message` lines, so they can be drafted without the CLI. parse_events()
+turns the notes into timestamped events classified by keyword rules, and
+the renderers lay those out in the same shape the prompts ask for. A draft
+takes milliseconds and is sent before the CLI's refined version.
+"""
+
+import re
+from datetime import datetime, timedelta
+
+# Checked in order; the first matching kind wins
+EVENT_KINDS = [
+    ('resolved', '✅', r'\b(resolved|all clear|fully recovered|back to normal|flowing normally|all passing|'
+                      r'closing (the )?incident|incident (is )?(over|contained)|stabili[sz]ed|'
+                      r'all regions (green|healthy)|confirmed fixed)\b'),
+    ('follow_up', '📝', r'\b(post-?mortem|follow[- ]?up|action items?|ticket|pr up|will (write|add|create|file)|'
+                       r'we should|should (add|have)|need to (add|review|update)|adding .*\b(to|in) (our )?'
+                       r'(ci|monitoring|runbook|alerts?)|todo|going forward)\b'),
+    ('root_cause', '💡', r'\b(root cause|found it|found the|the (issue|problem|cause) (is|was)|caused by|'
+                        r'because|turns out|culprit|typo|misconfigur\w*|\w+ not \w+)\b'),
+    ('alert', '🚨', r'\b(alert\w*|paged?|pagerduty|opsgenie|firing|fired|alarm|on-?call)\b'),
+    ('recovery', '📈', r'\b(recover\w*|coming (back|up)|improv\w*|dropping|decreas\w*|\d+/\d+ ready|'
+                       r'healthy|green|normali[sz]\w*|back up|catching up|stable|starting to pass)\b'),
+    ('question', '🔍', r'\?\s*$'),
+    ('issue', '🔴', r'\b(error\w*|fail\w*|down|outage|crash\w*|5xx|50[0-4]s|http 5\d\d|timeouts?|'
+                    r'tim(es|ing) out|latency|spik\w*|broken|oh no|seeing|showing|degraded|unavailable|'
+                    r'crashloop\w*|oom\w*|leak\w*|lag\w*|expired?|exhaust\w*|refused|not working|slow|'
+                    r'maxed|overwhelm\w*|critical)\b'),
+    ('mitigation', '🛠️ ', r'\b(roll(ed|ing)? ?back|revert\w*|restart\w*|failover|failed over|fail over|'
+                          r'scal(e|ed|ing) (up|out)|fix(ing)? forward|hotfix|patch\w*|updat(ed|ing)|'
+                          r'apply\w*|applied|disabl\w*|drain\w*|block\w*|rotat\w*|kill\w*|'
+                          r'terminat\w*|bump\w*|flush\w*|clear(ed|ing))\b'),
+    ('deploy', '⚙️ ', r'(?<![\w-])(deploy(ed|ing|s)?|released?|rolled out|merged|shipped|config change|upgrad\w*|migrat\w*)\b'),
+    ('investigation', '🔍', r'\b(check\w*|look\w* (at|into)|investigat\w*|logs?|kubectl|query|querying|'
+                            r'digging|trac\w*|debug\w*|let me|anyone|what changed|dashboard)\b'),
+    ('metrics', '📊', r'\b(metrics?|graphs?|grafana|datadog|cpu|memory|p\d\d|\d+(\.\d+)?%|rps|qps)\b'),
+]
+EVENT_KINDS = [(kind, emoji, re.compile(pattern, re.I)) for kind, emoji, pattern in EVENT_KINDS]
+EMOJI = {kind: emoji for kind, emoji, _ in EVENT_KINDS}
+EMOJI['note'] = '•'
+
+# [10:15], [2025-10-09 10:15:02], [10-09 10:15] (see notes_preprocessor)
+EVENT_LINE = re.compile(
+    r'^\s*\[(?:(?P<date>\d{4}-\d{2}-\d{2}|\d{2}-\d{2}) )?(?P<h>\d{1,2}):(?P<m>\d{2})(?::\d{2})?\]\s*'
+    r'(?:(?P<actor>@[\w.\-]+):?\s*)?(?P<text>.*)$'
+)
+TITLE_LINE = re.compile(r'^#+\s*(?:incident:?\s*)?(?P<title>.+?)\s*$', re.I)
+MENTION = re.compile(r'@[\w.\-]+')
+
+# Timeline lines longer than this are cut with an ellipsis
+MAX_EVENT_CHARS = 90
+# Gaps at least this long get a time passage note on the timeline
+GAP_NOTE_MINUTES = 15
+
+
+def classify(text):
+    for kind, _, pattern in EVENT_KINDS:
+        if pattern.search(text):
+            return kind
+    return 'note'
+
+
+class TimelineParser:
+    """
+    Parses timestamped lines into events as they arrive. feed() can be
+    called again with lines appended later; minutes stay relative to the
+    first event ever seen.
+    """
+
+    def __init__(self):
+        self.title = None
+        self.events = []
+        self._first = None
+        self._previous = None
+
+    def feed(self, text):
+        """Parse more lines; returns the events they held"""
+        new_events = []
+        for line in text.split('\n'):
+            if self.title is None and not self.events and TITLE_LINE.match(line):
+                self.title = TITLE_LINE.match(line).group('title')
+                continue
+            match = EVENT_LINE.match(line)
+            if not match or not match.group('text').strip():
+                continue
+
+            minute = int(match.group('h')) * 60 + int(match.group('m'))
+            if match.group('date'):
+                date = match.group('date')
+                day = datetime.strptime(date if len(date) == 10 else f'2000-{date}', '%Y-%m-%d')
+                absolute = day.toordinal() * 1440 + minute
+            else:
+                absolute = minute
+                # Times going backwards by more than 12 hours have crossed midnight
+                while self._previous is not None and absolute < self._previous - 720:
+                    absolute += 1440
+            if self._first is None:
+                self._first = absolute
+            self._previous = absolute
+
+            text = match.group('text').strip()
+            new_events.append({
+                'minute': absolute - self._first,
+                'clock': f"{int(match.group('h')):02d}:{match.group('m')}",
+                'actor': match.group('actor'),
+                'text': text,
+                'kind': classify(text),
+            })
+        self.events.extend(new_events)
+        return new_events
+
+
+def parse_events(incident_notes):
+    """
+    Parse timestamped lines into events: dicts with `minute` (minutes since
+    the first event, increasing across midnight), `clock`, `actor`, `text`
+    and `kind`. Returns (title, events).
+    """
+    parser = TimelineParser()
+    parser.feed(incident_notes)
+    return parser.title, parser.events
+
+
+def phase_durations(events):
+    """
+    Minutes spent detecting, diagnosing and mitigating, from the first
+    issue/alert, root cause and resolution events. Missing phases are None.
+    """
+    def first(*kinds, after=0):
+        return next((e['minute'] for e in events if e['kind'] in kinds and e['minute'] >= after), None)
+
+    if not events:
+        return {'detection': None, 'diagnosis': None, 'mitigation': None, 'total': None}
+    detected = first('issue', 'alert')
+    diagnosed = first('root_cause', after=detected or 0)
+    if diagnosed is None:
+        diagnosed = first('mitigation', after=detected or 0)
+    resolved = first('resolved', after=diagnosed or detected or 0)
+    if resolved is None:
+        resolved = max((e['minute'] for e in events if e['kind'] in ('recovery', 'mitigation')), default=None)
+
+    def span(start, end):
+        return end - start if start is not None and end is not None and end >= start else None
+
+    return {
+        'detection': span(0, detected),
+        'diagnosis': span(detected, diagnosed),
+        'mitigation': span(diagnosed, resolved),
+        'total': resolved if resolved is not None else events[-1]['minute'],
+    }
+
+
+def _shorten(text, limit=MAX_EVENT_CHARS):
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+
+def _minutes(value):
+    return 'n/a' if value is None else f"{value} min"
+
+
+def timeline_lines(events, previous_minute=None):
+    """
+    Timeline body lines for `events`, with time passage notes for long
+    gaps. `previous_minute` is the minute of the event drawn just before
+    them, when appending to an existing timeline.
+    """
+    lines = []
+    previous = previous_minute
+    for event in events:
+        if previous is not None and event['minute'] - previous >= GAP_NOTE_MINUTES:
+            lines += ['       │', f"       │ ⏱  {event['minute'] - previous} min later", '       │']
+        actor = f"{event['actor']}: " if event['actor'] else ''
+        lines.append(f"{event['clock']:>6} │ {EMOJI[event['kind']]} {_shorten(actor + event['text'])}")
+        previous = event['minute']
+    return lines
+
+
+def format_visual_timeline(title, events, body=None):
+    """The visual_timeline report from parsed events; `body` reuses already drawn timeline_lines()"""
+    rule = '━' * 55
+    lines = ['```', f"Incident Timeline - {title or 'Incident'}", rule, '']
+    lines += timeline_lines(events) if body is None else body
+    if not events:
+        lines.append('       │ No timestamped events found in the notes')
+    lines += ['       │', '       └' + '─' * 45, '']
+
+    phases = phase_durations(events)
+    lines += [
+        f"🔴 Detection: {_minutes(phases['detection'])}",
+        f"🔍 Diagnosis: {_minutes(phases['diagnosis'])}",
+        f"🛠️  Mitigation: {_minutes(phases['mitigation'])}",
+        '━' * 17,
+        f"Total: {'n/a' if phases['total'] is None else phases['total']} minutes",
+        '```',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def render_visual_timeline(incident_notes):
+    """ASCII timeline with the emoji legend and phase totals of the visual_timeline prompt"""
+    title, events = parse_events(incident_notes)
+    return format_visual_timeline(title, events)
+
+
+def _owner(event):
+    mentions = [mention for mention in MENTION.findall(event['text']) if mention != event['actor']]
+    return mentions[0] if mentions else (event['actor'] or '@owner')
+
+
+def _action_text(text):
+    """Message text as an action: mentions and filler stripped, capitalised"""
+    text = MENTION.sub('', text)
+    text = re.sub(r'^\s*\[[^\]]*\]\s*', '', text)
+    text = re.sub(r'^(ok(ay)?|so|alright|right|i\'?m|i am|we\'?re|we are|i\'?ll|we\'?ll|let\'?s|'
+                  r'now|just|also)[,\s]+', '', text.strip(), flags=re.I)
+    text = text.strip(' .,:;-')
+    return text[:1].upper() + text[1:] if text else text
+
+
+def extract_action_items(events):
+    """
+    Action items implied by events: dicts with `section` (`immediate` for
+    what was done, `short_term` for follow-ups, `medium_term` for root
+    causes to prevent), `text`, `owner` and `clock`
+    """
+    items = []
+    for event in events:
+        if event['kind'] in ('mitigation', 'deploy') and event['minute'] > 0:
+            # Fixes and deploys after the start of the incident are what was done
+            items.append({'section': 'immediate', 'text': _action_text(event['text']),
+                          'owner': event['actor'] or '@owner', 'clock': event['clock']})
+        elif event['kind'] == 'follow_up':
+            items.append({'section': 'short_term', 'text': _action_text(event['text']),
+                          'owner': _owner(event), 'clock': event['clock']})
+        elif event['kind'] == 'root_cause':
+            items.append({'section': 'medium_term', 'text': f"Prevent recurrence: {_action_text(event['text'])}",
+                          'owner': _owner(event), 'clock': event['clock']})
+    return items
+
+
+def action_item_key(item):
+    """Items with the same key are the same action, mentioned again"""
+    return item['section'], ' '.join(re.sub(r'[^\w\s]', ' ', item['text'].lower()).split())
+
+
+def merge_action_items(items, new_items):
+    """Append the new items that are not already in `items`; returns the ones added"""
+    seen = {action_item_key(item) for item in items}
+    added = []
+    for item in new_items:
+        key = action_item_key(item)
+        if key not in seen:
+            seen.add(key)
+            added.append(item)
+    items.extend(added)
+    return added
+
+
+def format_action_items(title, events, items, today=None):
+    """The action_items report from parsed events and their extract_action_items()"""
+    today = today or datetime.now()
+    due = lambda days: (today + timedelta(days=days)).strftime('%Y-%m-%d')
+    phases = phase_durations(events)
+    lead = next((e['actor'] for e in reversed(events) if e['actor']), '@incident-lead')
+    by_section = {section: [item for item in items if item['section'] == section]
+                  for section in ('immediate', 'short_term', 'medium_term')}
+
+    lines = ['## Action Item Tracker' + (f" - {title}" if title else ''), '', '### Immediate Actions (Complete)']
+    lines += [f"- [x] {item['text']} - {item['owner']} - {item['clock']}" for item in by_section['immediate']] or \
+        ['- [x] Incident mitigated - @owner']
+
+    lines += ['', '### Short-term (< 1 week)']
+    lines += [f"- [ ] {item['text']} - {item['owner']} - Due: {due(7)}" for item in by_section['short_term']]
+    lines.append(f"- [ ] Write and share the post-mortem - {lead} - Due: {due(5)}")
+
+    lines += ['', '### Medium-term (1-4 weeks)']
+    for item in by_section['medium_term'][:3]:
+        lines.append(f"- [ ] {item['text']} - {item['owner']} - Due: {due(21)}")
+    if phases['detection'] is not None and phases['detection'] >= 5:
+        lines.append(f"- [ ] Add alerting to catch this earlier (detection took {phases['detection']} min)"
+                     f" - {lead} - Due: {due(14)}")
+    if phases['diagnosis'] is not None and phases['diagnosis'] >= 15:
+        lines.append(f"- [ ] Add runbook steps and dashboards to speed up diagnosis"
+                     f" (took {phases['diagnosis']} min) - {lead} - Due: {due(21)}")
+    if lines[-1] == '### Medium-term (1-4 weeks)':
+        lines.append(f"- [ ] Review monitoring coverage for the affected service - {lead} - Due: {due(28)}")
+
+    lines += ['', '### Long-term (Future)',
+              '- [ ] Review similar services for the same failure mode',
+              '- [ ] Add a game day exercise for this scenario']
+    return '\n'.join(lines) + '\n'
+
+
+def render_action_items(incident_notes, today=None):
+    """Checkbox action tracker in the sections of the action_items prompt"""
+    title, events = parse_events(incident_notes)
+    return format_action_items(title, events, extract_action_items(events), today)
+
+
+LOCAL_RENDERERS = {
+    'visual_timeline': render_visual_timeline,
+    'action_items': render_action_items,
+}
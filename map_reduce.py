@@ -0,0 +1,173 @@
+"""
+Map-reduce summarisation for very large incident notes
+
+Notes too long for one prompt are split into time-ordered windows. Each
+window is condensed into a chronological digest, with up to `max_parallel`
+CLI calls running at once; callers size that from the idle slots they can
+borrow from the generation pool. The digests, in window order, then take the
+place of the notes in the chosen report prompt (the reduce pass). Digests
+are cached per window, so a retried or regenerated report only summarises
+windows it hasn't seen before.
+"""
+
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from report_cache import make_cache_key
+
+WINDOW_PROMPT = """You are condensing part of a very long incident log so that a post-mortem can be written from the condensed parts.
+
+This is window {index} of {total}, covering {period}.
+
+Write a chronological digest of this window:
+- One line per significant event: [timestamp] who - what happened, what was tried, what was decided
+- Keep exact timestamps, error messages, metrics, hostnames, versions, commands and names
+- Keep customer impact, hypotheses that were ruled out, and any root cause findings
+- Drop chatter, greetings and repeated status updates
+
+Output only the digest lines, with no preamble.
+
+LOG WINDOW:
+{window}
+"""
+
+_LEADING_TIMESTAMP = re.compile(r'^\[([^\]]+)\]')
+
+
+def split_windows(incident_notes, window_chars):
+    """
+    Split notes into consecutive windows of at most `window_chars`, breaking
+    before timestamped lines where possible so messages and stack traces
+    stay whole. Returns a list of dicts with `index`, `text`, `start` and
+    `end` (first and last timestamps seen, or None).
+    """
+    windows = []
+    # `cut` is where the last timestamped line in `current` starts
+    current, size, cut = [], 0, 0
+
+    def close(lines):
+        stamps = [match.group(1) for match in map(_LEADING_TIMESTAMP.match, lines) if match]
+        windows.append({
+            'index': len(windows) + 1,
+            'text': '\n'.join(lines),
+            'start': stamps[0] if stamps else None,
+            'end': stamps[-1] if stamps else None,
+        })
+
+    for line in incident_notes.split('\n'):
+        # A single line longer than a window is cut into window-sized pieces
+        pieces = [line[i:i + window_chars] for i in range(0, len(line), window_chars)] or ['']
+        for piece in pieces:
+            if current and size + len(piece) + 1 > window_chars:
+                # Break at the last timestamped line unless that leaves too little behind
+                if cut > len(current) // 2:
+                    close(current[:cut])
+                    current = current[cut:]
+                else:
+                    close(current)
+                    current = []
+                cut = 0
+                size = sum(len(kept) + 1 for kept in current)
+            if _LEADING_TIMESTAMP.match(piece):
+                cut = len(current)
+            current.append(piece)
+            size += len(piece) + 1
+    if any(line.strip() for line in current):
+        close(current)
+    return windows
+
+
+def window_prompt(window, total):
+    if window['start'] and window['end'] and window['start'] != window['end']:
+        period = f"{window['start']} to {window['end']}"
+    else:
+        period = window['start'] or 'an unknown period'
+    return WINDOW_PROMPT.format(index=window['index'], total=total, period=period, window=window['text'])
+
+
+def combine_digests(windows, digests):
+    """
+    The reduce pass input: every window's digest under a heading, in window
+    order. `digests` maps window index to digest.
+    """
+    parts = []
+    for window in windows:
+        digest = digests[window['index']]
+        period = f" ({window['start']} – {window['end']})" if window['start'] else ''
+        parts.append(f"## Window {window['index']}/{len(windows)}{period}\n{digest.strip()}")
+    return '\n\n'.join(parts)
+
+
+def iter_window_digests(windows, backend, cache, max_parallel=4, job=None, force_regenerate=False):
+    """
+    Condense every window on up to `max_parallel` threads, yielding
+    (window, digest, cached) in completion order. The first failure is
+    raised.
+    """
+    def run(window):
+        key = make_cache_key(window['text'], 'window_digest', WINDOW_PROMPT)
+        entry = None if force_regenerate else cache.get(key)
+        if entry:
+            return window, entry['content'], True
+        if job:
+            job.raise_if_cancelled()
+        start_time = time.time()
+        digest = ''.join(backend.iter_output(window_prompt(window, len(windows)), job=job, label='window'))
+        cache.put(key, digest, generation_time=time.time() - start_time)
+        return window, digest, False
+
+    executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='map-window')
+    try:
+        futures = [executor.submit(run, window) for window in windows]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # After a failure, queued windows are dropped; running ones still
+        # finish and are cached for the retry
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_window_digests(windows, backend, cache, max_parallel=4, force_regenerate=False):
+    """
+    Async counterpart of iter_window_digests using backend.aiter_output; the
+    cache's SQLite reads and writes run on threads
+    """
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def run(window):
+        key = make_cache_key(window['text'], 'window_digest', WINDOW_PROMPT)
+        entry = None if force_regenerate else await asyncio.to_thread(cache.get, key)
+        if entry:
+            return window, entry['content'], True
+        async with semaphore:
+            start_time = time.time()
+            digest = ''.join([
+                chunk async for chunk in backend.aiter_output(window_prompt(window, len(windows)), label='window')
+            ])
+        await asyncio.to_thread(cache.put, key, digest, generation_time=time.time() - start_time)
+        return window, digest, False
+
+    tasks = [asyncio.ensure_future(run(window)) for window in windows]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Cancelling the job, or a failed window, stops the others
+        for task in tasks:
+            task.cancel()
+
+
+def settings_from_env():
+    """
+    Map-reduce settings. Notes longer than MAP_REDUCE_THRESHOLD_CHARS (0
+    disables map-reduce) are split into windows of MAP_REDUCE_WINDOW_CHARS,
+    summarised up to MAP_REDUCE_MAX_PARALLEL at a time.
+    """
+    return {
+        'threshold_chars': int(os.environ.get('MAP_REDUCE_THRESHOLD_CHARS', '60000')),
+        'window_chars': int(os.environ.get('MAP_REDUCE_WINDOW_CHARS', '30000')),
+        'max_parallel': int(os.environ.get('MAP_REDUCE_MAX_PARALLEL', '4')),
+    }
@@ -0,0 +1,199 @@
+"""
+Prometheus metrics without extra dependencies
+
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text exposition format by GET /metrics. Recording a value is a dict update
+under a lock, so instrumenting the streaming hot path costs next to
+nothing. Values that other components already track (cache hits, queue
+depth, cancellations) are read at scrape time through collectors instead of
+being counted twice.
+"""
+
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; spans sub-millisecond SSE overhead up to the 5 minute CLI timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if not self.labelnames and self.kind != 'histogram':
+            # Unlabelled series are exported as 0 before anything is recorded
+            self._values[()] = 0
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """A set of metrics plus scrape-time collectors, rendered together"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def set_collector(self, name, collect):
+        """
+        Register `collect()`, called on every scrape, replacing any collector
+        already registered under `name`. It returns a list of
+        (name, kind, documentation, value) for unlabelled values read from
+        elsewhere.
+        """
+        self._collectors[name] = collect
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in list(self._collectors.values()):
+            try:
+                samples = collect()
+            except Exception as e:
+                print(f"❌ Metrics collector failed: {str(e)}")
+                continue
+            for name, kind, documentation, value in samples:
+                name = self.prefix + name
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+METRICS = MetricsRegistry(prefix='incident_summariser_')
+
+SPAWN_SECONDS = METRICS.histogram(
+    'subprocess_spawn_seconds', 'Time to start the generation backend process', ['format'])
+FIRST_OUTPUT_SECONDS = METRICS.histogram(
+    'first_output_seconds', 'Time from backend start to the first streamed fragment', ['format'])
+GENERATION_SECONDS = METRICS.histogram(
+    'generation_seconds', 'Time from backend start to the complete report', ['format'])
+SSE_STREAM_SECONDS = METRICS.histogram(
+    'sse_stream_seconds', 'How long each client SSE stream stayed open', ['format'])
+QUEUE_WAIT_SECONDS = METRICS.histogram(
+    'queue_wait_seconds', 'Time generations waited for a worker, by priority class', ['priority'])
+
+GENERATIONS = METRICS.counter(
+    'generations_total', 'Generations that ran the backend, by outcome', ['format', 'outcome'])
+CACHED_RESPONSES = METRICS.counter(
+    'cached_responses_total', 'Reports served straight from the report cache', ['format'])
+NEAR_MATCH_RESPONSES = METRICS.counter(
+    'near_match_responses_total', 'Reports reused from a near-identical earlier incident', ['format'])
+CLI_RETRIES = METRICS.counter(
+    'cli_retries_total', 'Backend calls retried after failing before any output', ['format'])
+CLI_HEDGES = METRICS.counter(
+    'cli_hedges_total', 'Hedged backend calls, by which attempt streamed first', ['format', 'winner'])
+
+ACTIVE_SUBPROCESSES = METRICS.gauge(
+    'active_subprocesses', 'Generation backend processes currently running')
+OPEN_SSE_CONNECTIONS = METRICS.gauge(
+    'open_sse_connections', 'Client SSE streams currently open')
@@ -0,0 +1,268 @@
+"""
+Incident notes preprocessor
+
+Compacts raw notes before they are formatted into a prompt. It normalises
+timestamps to one format, drops chat boilerplate (joins, reactions, bot
+noise), and collapses repeated lines and stack traces into one copy with a
+count. If the notes are still over budget, it keeps the highest-signal
+lines. The result is memoised, so the seven formats generated for the same
+notes share one pass.
+"""
+
+import functools
+import os
+import re
+
+# Rough characters per token for budgets given in tokens
+CHARS_PER_TOKEN = 4
+
+# Identical lines collapse from the second copy; lines that only differ in
+# numbers and IDs need this many copies before they are collapsed
+NEAR_DUPLICATE_MIN = 3
+
+# Lines always kept at each end when trimming to the budget, for context
+KEEP_HEAD_LINES = 5
+KEEP_TAIL_LINES = 5
+
+_MONTHS = {name: number for number, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
+
+# Leading timestamps in the formats seen in Slack, PagerDuty and log exports
+TIMESTAMP_PATTERNS = [
+    # 2025-10-09T14:23:05Z, 2025-10-09 14:23:05,123, [2025-10-09 14:23]
+    re.compile(r'^\[?(?P<y>\d{4})-(?P<mo>\d{2})-(?P<d>\d{2})[T ](?P<h>\d{1,2}):(?P<mi>\d{2})(?::(?P<s>\d{2}))?'
+               r'(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2}| ?UTC)?\]?\s*'),
+    # 10/09/2025 2:23 PM, 10/09/2025 14:23:05
+    re.compile(r'^\[?(?P<mo>\d{1,2})/(?P<d>\d{1,2})/(?P<y>\d{4}),? (?P<h>\d{1,2}):(?P<mi>\d{2})(?::(?P<s>\d{2}))?'
+               r'(?: ?(?P<ampm>[AaPp][Mm]))?\]?\s*'),
+    # Oct 9 14:23:05 (syslog)
+    re.compile(r'^\[?(?P<mon>[A-Z][a-z]{2}) +(?P<d>\d{1,2}) (?P<h>\d{1,2}):(?P<mi>\d{2})(?::(?P<s>\d{2}))?\]?\s*'),
+    # [14:23], 14:23:05, [2:23 PM]
+    re.compile(r'^\[?(?P<h>\d{1,2}):(?P<mi>\d{2})(?::(?P<s>\d{2}))?(?: ?(?P<ampm>[AaPp][Mm]))?\]\s*'),
+    re.compile(r'^(?P<h>\d{1,2}):(?P<mi>\d{2}):(?P<s>\d{2})(?: ?(?P<ampm>[AaPp][Mm]))?\s+'),
+]
+
+# Chat and bot noise that carries no incident information
+BOILERPLATE_PATTERNS = [re.compile(pattern, re.I) for pattern in [
+    r'^(@\S+:?\s*)?(has )?(joined|left) (the )?(channel|conversation|#\S+)\.?$',
+    r'^(@\S+:?\s*)?(set|changed|cleared) the channel (topic|purpose|description)',
+    r'^(@\S+:?\s*)?(reacted|added a reaction|removed a reaction)( with)?\b',
+    r'^(@\S+:?\s*)?this message was deleted\.?$',
+    r'^(@\S+:?\s*)?\(edited\)$',
+    r'^(@\S+:?\s*)?(\+1|👍|👀|ack|ack\'?d|on it|thanks!?|thank you!?|ty|lol|ok|okay|k)\.?$',
+    r'^(@\S+:?\s*)?(sent from my \w+|uploaded a file|shared a file)\b',
+    r'^(@\S+:?\s*)?\[?(slackbot|reminder)\]?:? ',
+    r'^(@\S+:?\s*)?pinned a message',
+]]
+
+# Continuation lines of stack traces and multi-line log records
+CONTINUATION_PATTERN = re.compile(r'^(\s+\S|at [\w.$<>]+\(|File "|Caused by:|\.\.\. \d+ more)')
+
+# The exception line that ends a Python traceback
+EXCEPTION_PATTERN = re.compile(r'^[\w.]+(Error|Exception|Interrupt|Exit)\b')
+
+# Lines that are worth keeping when the notes are over budget
+SIGNAL_PATTERN = re.compile(
+    r'\b(root cause|caused by|because|fix(ed)?|deploy(ed|ment)?|roll(ed)? ?back|revert(ed)?|mitigat\w*|'
+    r'resolv\w*|restor\w*|recover\w*|rca|incident|sev ?\d|p[0-4]\b|critical|alert|paged?|pagerduty|'
+    r'outage|down|degraded|impact\w*|customer\w*|error\w*|fail\w*|exception|timeout|latency|5\d\d|oom|'
+    r'crash\w*|breach|compromis\w*|rotat\w*|found it|confirmed|all clear|green)\b',
+    re.I
+)
+
+_VARIABLE_PARTS = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\b0x[0-9a-f]+\b|\b[0-9a-f]{12,}\b|\d+',
+    re.I
+)
+
+
+def normalize_timestamp(line):
+    """
+    Rewrite a leading timestamp as [YYYY-MM-DD HH:MM:SS] or [HH:MM(:SS)].
+    Returns (line, timestamp or None).
+    """
+    for pattern in TIMESTAMP_PATTERNS:
+        match = pattern.match(line)
+        if not match:
+            continue
+        parts = match.groupdict()
+        hour = int(parts['h'])
+        ampm = (parts.get('ampm') or '').lower()
+        if ampm == 'pm' and hour < 12:
+            hour += 12
+        elif ampm == 'am' and hour == 12:
+            hour = 0
+        if hour > 23 or int(parts['mi']) > 59:
+            return line, None
+
+        clock = f"{hour:02d}:{parts['mi']}" + (f":{parts['s']}" if parts.get('s') else '')
+        if parts.get('mon'):
+            month = _MONTHS.get(parts['mon'].lower())
+            if not month:
+                return line, None
+            timestamp = f"{month:02d}-{int(parts['d']):02d} {clock}"
+        elif parts.get('y'):
+            timestamp = f"{parts['y']}-{int(parts['mo']):02d}-{int(parts['d']):02d} {clock}"
+        else:
+            timestamp = clock
+        return f"[{timestamp}] {line[match.end():]}", timestamp
+    return line, None
+
+
+def _signature(text):
+    """Comparison key that ignores numbers, IDs, case and spacing"""
+    return ' '.join(_VARIABLE_PARTS.sub('#', text.lower()).split())
+
+
+class _Entry:
+    """A line plus any continuation lines (stack frames) attached to it"""
+
+    def __init__(self, line, body, timestamp):
+        self.lines = [line]
+        self.body = body
+        self.timestamp = timestamp
+        self.count = 1
+        self.last_timestamp = None
+        self.last_body = None
+        # Headings, code fences and blank lines are structure, never collapsed
+        self.structural = not body.strip() or body.startswith(('#', '```'))
+
+    @property
+    def key(self):
+        return '\n'.join([self.body] + self.lines[1:])
+
+    def render(self):
+        lines = list(self.lines)
+        if self.count > 1:
+            note = f" [×{self.count}"
+            if self.last_timestamp:
+                note += f", last at {self.last_timestamp}"
+            if self.last_body and self.last_body != self.body:
+                # Near-duplicates: the latest variant usually has the newest numbers
+                note += f": {self.last_body.strip()}"
+            lines[0] += note + ']'
+        return '\n'.join(lines)
+
+
+@functools.lru_cache(maxsize=64)
+def compact_notes(incident_notes, max_chars=None):
+    """
+    Compact incident notes. Returns (notes, stats) where stats counts what
+    was normalised, collapsed and dropped. Memoised: callers must not modify
+    the returned stats.
+    """
+    lines = incident_notes.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    stats = {
+        'original_chars': len(incident_notes),
+        'original_lines': len(lines),
+        'timestamps_normalized': 0,
+        'boilerplate_dropped': 0,
+        'duplicates_collapsed': 0,
+        'budget_dropped': 0,
+    }
+
+    # Group stack traces with the line that introduced them, drop boilerplate
+    entries = []
+    for line in lines:
+        line = line.rstrip()
+        previous = entries[-1] if entries else None
+        if previous and line and not previous.structural and (
+                CONTINUATION_PATTERN.match(line) or
+                (len(previous.lines) > 1 and EXCEPTION_PATTERN.match(line))):
+            previous.lines.append(line)
+            continue
+
+        line, timestamp = normalize_timestamp(line)
+        body = line[len(timestamp) + 3:] if timestamp else line
+        if timestamp:
+            stats['timestamps_normalized'] += 1
+        if any(pattern.search(body.strip()) for pattern in BOILERPLATE_PATTERNS):
+            stats['boilerplate_dropped'] += 1
+            continue
+        entries.append(_Entry(line, body, timestamp))
+
+    # Collapse identical entries, and near-identical ones seen often enough
+    exact, similar = {}, {}
+    for entry in entries:
+        if not entry.structural:
+            exact.setdefault(entry.key, []).append(entry)
+            similar.setdefault(_signature(entry.key), []).append(entry)
+
+    dropped = set()
+    for groups, minimum in ((exact, 2), (similar, NEAR_DUPLICATE_MIN)):
+        for group in groups.values():
+            group = [entry for entry in group if id(entry) not in dropped]
+            if len(group) < minimum:
+                continue
+            first, rest = group[0], group[1:]
+            for entry in rest:
+                first.count += entry.count
+                first.last_timestamp = entry.last_timestamp or entry.timestamp or first.last_timestamp
+                first.last_body = entry.last_body or entry.body
+                dropped.add(id(entry))
+                stats['duplicates_collapsed'] += entry.count
+    kept = [entry for entry in entries if id(entry) not in dropped]
+
+    # Over budget: keep both ends plus the highest-signal lines, in order
+    text = '\n'.join(entry.render() for entry in kept).strip()
+    if max_chars and len(text) > max_chars:
+        kept, budget_dropped = _trim_to_budget(kept, max_chars)
+        stats['budget_dropped'] = budget_dropped
+        text = '\n'.join(
+            entry.render() if isinstance(entry, _Entry) else _omitted_marker(entry)
+            for entry in kept
+        ).strip()
+
+    stats['compacted_chars'] = len(text)
+    stats['compacted_lines'] = text.count('\n') + 1 if text else 0
+    stats['removed_chars'] = max(0, stats['original_chars'] - stats['compacted_chars'])
+    return text, stats
+
+
+def _omitted_marker(count):
+    return f"[... {count} line{'' if count == 1 else 's'} omitted ...]"
+
+
+def _trim_to_budget(entries, max_chars):
+    """Choose entries that fit in max_chars; an int marks how many were cut there"""
+    def score(entry):
+        body = entry.key
+        hits = len(SIGNAL_PATTERN.findall(body))
+        # Repeated alerts matter, very long lines are usually dumps
+        return hits * 3 + min(entry.count, 5) + (1 if entry.timestamp else 0) - len(body) / 400
+
+    protected = set(range(min(KEEP_HEAD_LINES, len(entries))))
+    protected.update(range(max(0, len(entries) - KEEP_TAIL_LINES), len(entries)))
+    order = sorted(range(len(entries)), key=lambda i: (i not in protected, -score(entries[i]), i))
+
+    chosen, used = set(), 0
+    for index in order:
+        # Each kept line can open at most one gap, so reserve room for a marker
+        size = len(entries[index].render()) + 1 + len(_omitted_marker(len(entries))) + 1
+        if used + size > max_chars and index not in protected:
+            continue
+        chosen.add(index)
+        used += size
+
+    result = []
+    for index, entry in enumerate(entries):
+        if index in chosen:
+            result.append(entry)
+        elif result and isinstance(result[-1], int):
+            result[-1] += 1
+        else:
+            result.append(1)
+    return result, len(entries) - len(chosen)
+
+
+def budget_from_env():
+    """
+    Character budget from NOTES_MAX_CHARS or NOTES_MAX_TOKENS (whichever is
+    smaller); None when neither is set
+    """
+    budgets = []
+    if os.environ.get('NOTES_MAX_CHARS'):
+        budgets.append(int(os.environ['NOTES_MAX_CHARS']))
+    if os.environ.get('NOTES_MAX_TOKENS'):
+        budgets.append(int(os.environ['NOTES_MAX_TOKENS']) * CHARS_PER_TOKEN)
+    return min(budgets) if budgets else None
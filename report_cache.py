@@ -0,0 +1,144 @@
+"""
+Content-addressed cache for generated reports
+
+Reports are keyed on the normalised incident notes, the output format and a
+hash of the prompt template, so editing a template invalidates its entries
+automatically. Lookups go to an in-memory LRU first and fall back to a SQLite
+file that survives restarts. The file is shared by all the worker processes
+of a production server, in WAL mode so lookups never wait on a write.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_notes(incident_notes):
+    """
+    Normalise notes so cosmetic differences (line endings, trailing
+    whitespace, blank lines at the ends) map to the same cache key
+    """
+    lines = incident_notes.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+
+def make_cache_key(incident_notes, output_format, template):
+    """Build the cache key for one report"""
+    template_hash = hashlib.sha256(template.encode('utf-8')).hexdigest()
+    digest = hashlib.sha256()
+    for part in (normalize_notes(incident_notes), output_format, template_hash):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ReportCache:
+    """
+    Two-tier report cache: a bounded in-memory LRU in front of SQLite.
+
+    Entries expire after `ttl_seconds` in both tiers. The memory tier is
+    bounded by entry count and total content size; pass `db_path=None` to
+    run without the persistent tier.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024,
+                 ttl_seconds=24 * 3600, db_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS reports ('
+                ' key TEXT PRIMARY KEY,'
+                ' content TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' generation_time REAL)'
+            )
+            self._db.execute('DELETE FROM reports WHERE created_at < ?',
+                             (time.time() - ttl_seconds,))
+            self._db.commit()
+
+    def get(self, key):
+        """Return the cached entry dict for `key`, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry['created_at'] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+
+            if entry is None and self._db:
+                row = self._db.execute(
+                    'SELECT content, created_at, generation_time FROM reports WHERE key = ?',
+                    (key,)
+                ).fetchone()
+                if row and now - row[1] <= self.ttl_seconds:
+                    entry = {'content': row[0], 'created_at': row[1], 'generation_time': row[2]}
+                    self._store(key, entry)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, key, content, generation_time=None):
+        """Store a completed report in both tiers"""
+        entry = {'content': content, 'created_at': time.time(), 'generation_time': generation_time}
+        with self._lock:
+            self._store(key, entry)
+            if self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO reports (key, content, created_at, generation_time)'
+                    ' VALUES (?, ?, ?, ?)',
+                    (key, content, entry['created_at'], generation_time)
+                )
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _store(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += len(entry['content'])
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry['content'])
+
+
+def cache_from_env():
+    """Build the report cache from REPORT_CACHE_* environment variables"""
+    return ReportCache(
+        max_entries=int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', '256')),
+        max_bytes=int(os.environ.get('REPORT_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+        ttl_seconds=int(os.environ.get('REPORT_CACHE_TTL_SECONDS', str(24 * 3600))),
+        db_path=os.environ.get('REPORT_CACHE_PATH', 'report_cache.db') or None,
+    )
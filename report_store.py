@@ -0,0 +1,271 @@
+"""
+Persistent post-mortem store
+
+Every report the CLI finishes is kept in SQLite (in WAL mode, so reads are
+not blocked by writes) with the incident notes it was written from, its
+format, the version of the prompt template and its timings. Unlike the
+report cache nothing expires: this is the history of generated
+post-mortems. An FTS5 index over the notes and the reports makes them
+searchable ("replication lag", "terraform lock"). Listings and searches are
+keyset-paginated, so pages stay fast however deep they go.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from report_cache import normalize_notes
+
+# Largest page a listing or search returns
+MAX_PAGE_SIZE = 100
+
+# Characters of each report shown in listings
+PREVIEW_CHARS = 200
+
+_TITLE = re.compile(r'^#+\s*(?:incident:?\s*)?(.+?)\s*$', re.I | re.M)
+_SEARCH_TERM = re.compile(r'"([^"]+)"|(\S+)')
+
+_SUMMARY_COLUMNS = (
+    'reports.id, reports.incident_id, incidents.title, reports.format, reports.template_version,'
+    ' reports.mode, reports.created_at, reports.generation_time, reports.first_output_time,'
+    ' reports.total_time, length(reports.content) AS chars, substr(reports.content, 1, ?) AS preview'
+)
+
+
+def notes_hash(incident_notes):
+    return hashlib.sha256(normalize_notes(incident_notes).encode('utf-8')).hexdigest()
+
+
+def template_version(template):
+    """Short hash identifying the prompt template a report was written with"""
+    return hashlib.sha256(template.encode('utf-8')).hexdigest()[:12]
+
+
+def incident_title(incident_notes):
+    """The notes' first heading, or their first line"""
+    match = _TITLE.search(incident_notes)
+    if match:
+        return match.group(1)[:120]
+    first_line = next((line.strip() for line in incident_notes.split('\n') if line.strip()), '')
+    return first_line[:120]
+
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 query: every word (or "quoted phrase") must
+    appear, with FTS5 operators and punctuation treated as plain text
+    """
+    terms = []
+    for phrase, word in _SEARCH_TERM.findall(text):
+        term = phrase or word
+        terms.append('"' + term.replace('"', '""') + '"')
+    return ' '.join(terms)
+
+
+class ReportStore:
+    """
+    SQLite store of generated reports with full-text search. Writes go
+    through one connection under a lock; reads use a connection per thread.
+    If this SQLite build lacks FTS5, search falls back to LIKE matching.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._db = self._connect()
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS incidents (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                notes TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                incident_id TEXT NOT NULL REFERENCES incidents (id),
+                format TEXT NOT NULL,
+                template_version TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                generation_time REAL,
+                first_output_time REAL,
+                total_time REAL
+            );
+            CREATE INDEX IF NOT EXISTS reports_by_incident ON reports (incident_id, id);
+            CREATE INDEX IF NOT EXISTS reports_by_format ON reports (format, id);
+            CREATE VIEW IF NOT EXISTS report_documents AS
+                SELECT reports.id AS id, reports.content AS content, incidents.notes AS notes
+                FROM reports JOIN incidents ON incidents.id = reports.incident_id;
+        ''')
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5("
+                " content, notes, content='report_documents', content_rowid='id',"
+                " tokenize='porter unicode61')"
+            )
+            self.full_text = True
+        except sqlite3.OperationalError:
+            print("⚠️ SQLite was built without FTS5; report search falls back to substring matching")
+            self.full_text = False
+        self._db.commit()
+
+    def save(self, incident_notes, output_format, template, content, generation_time=None,
+             first_output_time=None, total_time=None, mode='single'):
+        """Store a finished report; returns its ID"""
+        incident_id = notes_hash(incident_notes)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR IGNORE INTO incidents (id, title, notes, created_at) VALUES (?, ?, ?, ?)',
+                (incident_id, incident_title(incident_notes), normalize_notes(incident_notes), now)
+            )
+            report_id = self._db.execute(
+                'INSERT INTO reports (incident_id, format, template_version, mode, content, created_at,'
+                ' generation_time, first_output_time, total_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (incident_id, output_format, template_version(template), mode, content, now,
+                 generation_time, first_output_time, total_time)
+            ).lastrowid
+            if self.full_text:
+                self._db.execute(
+                    'INSERT INTO reports_fts (rowid, content, notes)'
+                    ' SELECT id, content, notes FROM report_documents WHERE id = ?',
+                    (report_id,)
+                )
+            self._db.commit()
+        return report_id
+
+    def list(self, limit=20, before=None, output_format=None, incident_id=None):
+        """
+        Newest reports first, without their content. Pass the returned
+        cursor as `before` for the next page. Returns (reports, next cursor).
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        where, params = self._filters(output_format, incident_id)
+        if before is not None:
+            where.append('reports.id < ?')
+            params.append(int(before))
+        rows = self._read().execute(
+            f'SELECT {_SUMMARY_COLUMNS} FROM reports JOIN incidents ON incidents.id = reports.incident_id'
+            f" {'WHERE ' + ' AND '.join(where) if where else ''}"
+            ' ORDER BY reports.id DESC LIMIT ?',
+            [PREVIEW_CHARS, *params, limit + 1]
+        ).fetchall()
+        page = [self._summary(row) for row in rows[:limit]]
+        return page, (str(page[-1]['id']) if len(rows) > limit else None)
+
+    def get(self, report_id):
+        """A report with its content and incident notes, or None"""
+        row = self._read().execute(
+            'SELECT reports.*, incidents.title, incidents.notes FROM reports'
+            ' JOIN incidents ON incidents.id = reports.incident_id WHERE reports.id = ?',
+            (report_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        report = dict(row)
+        report['created_at'] = datetime.fromtimestamp(report['created_at']).isoformat()
+        return report
+
+    def latest(self, incident_notes, output_format, template):
+        """Content of the newest report on these notes in this format from this template, or None"""
+        row = self._read().execute(
+            'SELECT content FROM reports WHERE incident_id = ? AND format = ? AND template_version = ?'
+            ' ORDER BY id DESC LIMIT 1',
+            (notes_hash(incident_notes), output_format, template_version(template))
+        ).fetchone()
+        return row['content'] if row else None
+
+    def search(self, text, limit=20, after=None, output_format=None):
+        """
+        Reports whose content or notes match every search term, best match
+        first, each with a highlighted `snippet`. Pass the returned cursor
+        as `after` for the next page. Returns (reports, next cursor).
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        query = fts_query(text)
+        if not query:
+            return [], None
+        if not self.full_text:
+            return self._search_like(text, limit, after, output_format)
+
+        where, params = self._filters(output_format, None)
+        where.insert(0, 'reports_fts MATCH ?')
+        params.insert(0, query)
+        if after:
+            rank, last_id = after.split(':')
+            where.append('(reports_fts.rank > ? OR (reports_fts.rank = ? AND reports.id > ?))')
+            params += [float(rank), float(rank), int(last_id)]
+        rows = self._read().execute(
+            f"SELECT {_SUMMARY_COLUMNS}, reports_fts.rank AS rank,"
+            " snippet(reports_fts, -1, '**', '**', '…', 16) AS snippet"
+            ' FROM reports_fts JOIN reports ON reports.id = reports_fts.rowid'
+            ' JOIN incidents ON incidents.id = reports.incident_id'
+            f" WHERE {' AND '.join(where)} ORDER BY reports_fts.rank, reports.id LIMIT ?",
+            [PREVIEW_CHARS, *params, limit + 1]
+        ).fetchall()
+        page = [self._summary(row) for row in rows[:limit]]
+        cursor = f"{rows[limit - 1]['rank']!r}:{rows[limit - 1]['id']}" if len(rows) > limit else None
+        for report in page:
+            del report['rank']
+        return page, cursor
+
+    def stats(self):
+        row = self._read().execute('SELECT count(*), (SELECT count(*) FROM incidents) FROM reports').fetchone()
+        return {'reports': row[0], 'incidents': row[1]}
+
+    def _search_like(self, text, limit, after, output_format):
+        where, params = self._filters(output_format, None)
+        for phrase, word in _SEARCH_TERM.findall(text):
+            where.append("(reports.content LIKE ? ESCAPE '\\' OR incidents.notes LIKE ? ESCAPE '\\')")
+            pattern = '%' + re.sub(r'([%_\\])', r'\\\1', phrase or word) + '%'
+            params += [pattern, pattern]
+        if after:
+            where.append('reports.id < ?')
+            params.append(int(after))
+        rows = self._read().execute(
+            f'SELECT {_SUMMARY_COLUMNS} FROM reports JOIN incidents ON incidents.id = reports.incident_id'
+            f" WHERE {' AND '.join(where)} ORDER BY reports.id DESC LIMIT ?",
+            [PREVIEW_CHARS, *params, limit + 1]
+        ).fetchall()
+        page = [self._summary(row) for row in rows[:limit]]
+        return page, (str(page[-1]['id']) if len(rows) > limit else None)
+
+    def _filters(self, output_format, incident_id):
+        where, params = [], []
+        if output_format:
+            where.append('reports.format = ?')
+            params.append(output_format)
+        if incident_id:
+            where.append('reports.incident_id = ?')
+            params.append(incident_id)
+        return where, params
+
+    def _summary(self, row):
+        summary = dict(row)
+        summary['created_at'] = datetime.fromtimestamp(summary['created_at']).isoformat()
+        return summary
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _read(self):
+        """This thread's read connection; WAL lets it read while another thread writes"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+
+def store_from_env():
+    """Build the report store from REPORT_STORE_PATH; None when it is set empty"""
+    db_path = os.environ.get('REPORT_STORE_PATH', 'reports.db')
+    return ReportStore(db_path) if db_path else None
@@ -0,0 +1,475 @@
+"""
+Resilience layer around the generation backend
+
+Wraps a backend (see backends.py) behind the same `iter_output()` /
+`aiter_output()` interface and adds, per call label (usually the report
+format):
+
+- Adaptive timeouts: a rolling window of first-output and total latencies
+  gives each label its own timeouts (a multiple of the p99, within bounds),
+  so a stuck CLI is given up on after seconds rather than minutes once
+  there is history.
+- Hedging (optional): if the first fragment has not arrived by the p95, a
+  duplicate call is started and whichever streams first wins; the other is
+  killed. Output is never switched once it has started streaming.
+- Retries: calls that fail before producing any output are retried a
+  bounded number of times with exponential backoff and full jitter. All
+  attempts, hedges and backoff share the call's one overall timeout, so a
+  hung CLI is reported after that timeout, never a multiple of it.
+- Circuit breaker: after enough consecutive failures calls fail fast with
+  CircuitOpenError for a cooldown, then one probe call decides whether to
+  close it again.
+"""
+
+import asyncio
+import contextvars
+import os
+import queue
+import random
+import subprocess
+import threading
+import time
+from collections import deque
+
+from backends import CLAUDE_TIMEOUT_SECONDS, ClaudeCLIError
+from jobs import Job, JobCancelled
+from metrics import CLI_HEDGES, CLI_RETRIES
+
+
+class CircuitOpenError(ClaudeCLIError):
+    """Raised instead of calling the backend while the circuit breaker is open"""
+
+    def __init__(self, failures, retry_after):
+        super().__init__(f'Claude CLI is failing repeatedly ({failures} failures in a row); '
+                         f'not trying again for {retry_after:.0f}s')
+        self.failures = failures
+        self.retry_after = retry_after
+
+
+class _FailedBeforeOutput(Exception):
+    """Every attempt of a call failed before streaming anything; safe to retry"""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LatencyWindow:
+    """The last `size` first-output and total latencies of successful calls"""
+
+    def __init__(self, size=200):
+        self.first_output = deque(maxlen=size)
+        self.total = deque(maxlen=size)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed attempts. While open,
+    calls fail fast; after `cooldown_seconds` one probe call is let through
+    and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call may not go ahead; returns True for the probe call"""
+        with self._lock:
+            if self.state == 'open':
+                remaining = self._opened_at + self.cooldown_seconds - time.time()
+                if remaining > 0:
+                    raise CircuitOpenError(self.failures, remaining)
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open':
+                if self._probing:
+                    raise CircuitOpenError(self.failures, self.cooldown_seconds)
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                print("✅ Claude CLI recovered, circuit breaker closed")
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.state = 'open'
+                self.trips += 1
+                self._opened_at = time.time()
+                self._probing = False
+                print(f"🔌 Circuit breaker open after {self.failures} failures; "
+                      f"failing fast for {self.cooldown_seconds:.0f}s")
+
+    def abandon_probe(self):
+        """The probe call ended without an outcome (it was cancelled); let another one through"""
+        with self._lock:
+            self._probing = False
+
+
+class ResilientBackend:
+    """
+    A backend wrapper with adaptive timeouts, optional hedging, retries and
+    a circuit breaker. `label` (an extra keyword on both iter methods)
+    selects the latency window; timeouts and hedging only adapt once a label
+    has `min_samples` successful calls.
+    """
+
+    def __init__(self, backend, min_samples=20, timeout_multiplier=3.0, min_timeout=30.0,
+                 hedge=False, max_retries=2, retry_base_seconds=1.0, breaker=None):
+        self.backend = backend
+        self.name = backend.name
+        self.min_samples = min_samples
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.hedge = hedge
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def timeouts(self, label, ceiling=CLAUDE_TIMEOUT_SECONDS):
+        """(first-output timeout, total timeout) for a call, in seconds, neither above `ceiling`"""
+        with self._lock:
+            window = self._windows.get(label)
+            if window is None or len(window.total) < self.min_samples:
+                return ceiling, ceiling
+            first_output, total = percentile(window.first_output, 0.99), percentile(window.total, 0.99)
+
+        def bound(seconds):
+            return min(ceiling, max(self.min_timeout, seconds * self.timeout_multiplier))
+        return bound(first_output), bound(total)
+
+    def hedge_delay(self, label):
+        """Seconds without output after which to hedge a call, or None"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            window = self._windows.get(label)
+            if window is None or len(window.first_output) < self.min_samples:
+                return None
+            return percentile(window.first_output, 0.95)
+
+    def record_latency(self, label, first_output, total):
+        with self._lock:
+            window = self._windows.setdefault(label, LatencyWindow())
+            window.first_output.append(first_output)
+            window.total.append(total)
+
+    def stats(self):
+        with self._lock:
+            latencies = {
+                label: {
+                    'samples': len(window.total),
+                    'p95_first_output': round(percentile(window.first_output, 0.95), 2),
+                    'p95_total': round(percentile(window.total, 0.95), 2),
+                }
+                for label, window in self._windows.items() if window.total
+            }
+        return {'breaker': self.breaker.state, 'breaker_trips': self.breaker.trips, 'latencies': latencies}
+
+    def retry_delay(self, retry):
+        """Full-jitter exponential backoff, capped at 10s"""
+        return random.uniform(0, min(10.0, self.retry_base_seconds * 2 ** retry))
+
+    def time_for_retry(self, deadline, delay, label):
+        """Whether a retry after `delay` would still have a useful share of the call's timeout"""
+        if deadline - time.time() - delay >= self.min_timeout:
+            return True
+        print(f"⏱️ {label} failed before any output; not retrying, its timeout is nearly used up")
+        return False
+
+    def iter_output(self, prompt, on_started=None, timeout=CLAUDE_TIMEOUT_SECONDS, job=None,
+                    label='unknown', on_retry=None):
+        """
+        Same contract as the wrapped backend's iter_output. `on_retry(retry,
+        error, delay)` is called before each retry. Raises CircuitOpenError
+        without calling the backend while the breaker is open. `timeout`
+        bounds the whole call, retries included.
+        """
+        deadline = time.time() + timeout
+        retry = 0
+        while True:
+            probe = self.breaker.before_call()
+            try:
+                yield from self._race(prompt, on_started if retry == 0 else None, deadline - time.time(), job, label)
+                return
+            except _FailedBeforeOutput as e:
+                if retry >= self.max_retries or (job and job.cancelled):
+                    raise e.error
+                retry += 1
+                delay = self.retry_delay(retry)
+                if not self.time_for_retry(deadline, delay, label):
+                    raise e.error
+                print(f"🔁 {label} failed before any output ({e}); retry {retry}/{self.max_retries} in {delay:.1f}s")
+                CLI_RETRIES.inc(format=label)
+                if on_retry:
+                    on_retry(retry, e.error, delay)
+                wait_unless_cancelled(delay, job)
+            finally:
+                if probe:
+                    self.breaker.abandon_probe()
+
+    def _race(self, prompt, on_started, timeout, job, label):
+        """
+        Run one call, hedged if it is slow to start, yielding the first
+        attempt to stream. Raises _FailedBeforeOutput if every attempt
+        failed before any output.
+        """
+        first_timeout, total_timeout = self.timeouts(label, timeout)
+        hedge_after = self.hedge_delay(label)
+        # A hedge started later gets what is left of the call's timeout, not a fresh one
+        call_deadline = time.time() + timeout
+        events = queue.Queue()
+        attempts = []
+
+        def launch(started_callback):
+            if job:
+                job.raise_if_cancelled()
+            attempt = Job(f'{label} attempt')
+            attempt.started_at = time.time()
+            attempt.first_output_deadline = min(attempt.started_at + first_timeout, call_deadline)
+            attempt.timed_out = False
+            attempts.append(attempt)
+            attempt_timeout = min(total_timeout, call_deadline - attempt.started_at)
+
+            def run():
+                try:
+                    for chunk in self.backend.iter_output(prompt, on_started=started_callback,
+                                                          timeout=attempt_timeout, job=attempt):
+                        events.put((attempt, 'chunk', chunk))
+                    events.put((attempt, 'done', None))
+                except Exception as e:
+                    events.put((attempt, 'error', e))
+
+            # Copies the caller's context, so the attempt logs under its request ID
+            threading.Thread(target=contextvars.copy_context().run, args=(run,), name=f'cli-attempt-{label}',
+                             daemon=True).start()
+
+        def cancel_attempts(reason, spare=None):
+            for attempt in list(attempts):
+                if attempt is not spare:
+                    attempt.cancel(reason)
+
+        unregister_cancel = (job.add_cancel_callback(lambda: cancel_attempts(job.cancel_reason))
+                             if job else lambda: None)
+        winner = None
+        first_output_time = None
+        live = set()
+        last_error = None
+        try:
+            launch(on_started)
+            live.add(attempts[0])
+            call_start = attempts[0].started_at
+            while True:
+                wait = None
+                if winner is None:
+                    # Timed-out attempts are already being killed; wait for their error
+                    deadlines = [attempt.first_output_deadline for attempt in live if not attempt.timed_out]
+                    if hedge_after is not None and len(attempts) == 1:
+                        deadlines.append(call_start + hedge_after)
+                    wait = max(0.0, min(deadlines) - time.time()) if deadlines else None
+                try:
+                    attempt, kind, payload = events.get(timeout=wait)
+                except queue.Empty:
+                    now = time.time()
+                    if hedge_after is not None and len(attempts) == 1 and now >= call_start + hedge_after:
+                        print(f"🏁 Hedging {label}: no output after {hedge_after:.1f}s (p95)")
+                        launch(None)
+                        live.add(attempts[-1])
+                    for attempt in live:
+                        if not attempt.timed_out and now >= attempt.first_output_deadline:
+                            attempt.timed_out = True
+                            attempt.cancel(f'no output after {now - attempt.started_at:.0f}s')
+                    continue
+
+                if winner is not None and attempt is not winner:
+                    continue
+                if kind == 'chunk':
+                    if winner is None:
+                        if attempt.timed_out:
+                            continue
+                        winner = attempt
+                        first_output_time = time.time() - attempt.started_at
+                        if len(attempts) > 1:
+                            CLI_HEDGES.inc(format=label, winner='hedge' if attempt is attempts[-1] else 'primary')
+                        cancel_attempts('another attempt answered first', spare=winner)
+                    yield payload
+                elif kind == 'done':
+                    self.breaker.record_success()
+                    total = time.time() - attempt.started_at
+                    self.record_latency(label, first_output_time if first_output_time is not None else total, total)
+                    return
+                else:
+                    if isinstance(payload, JobCancelled) and job and job.cancelled:
+                        raise payload
+                    if isinstance(payload, JobCancelled) and attempt.timed_out:
+                        payload = subprocess.TimeoutExpired(label, attempt.first_output_deadline - attempt.started_at)
+                    self.breaker.record_failure()
+                    if attempt is winner:
+                        raise payload
+                    live.discard(attempt)
+                    last_error = payload
+                    if not live:
+                        raise _FailedBeforeOutput(last_error)
+        finally:
+            unregister_cancel()
+            cancel_attempts('call finished')
+
+    async def aiter_output(self, prompt, timeout=CLAUDE_TIMEOUT_SECONDS, label='unknown'):
+        """
+        Same contract as the wrapped backend's aiter_output: timeouts raise
+        asyncio.TimeoutError. Raises CircuitOpenError while the breaker is open.
+        `timeout` bounds the whole call, retries included.
+        """
+        deadline = time.time() + timeout
+        retry = 0
+        while True:
+            probe = self.breaker.before_call()
+            try:
+                async for chunk in self._arace(prompt, deadline - time.time(), label):
+                    yield chunk
+                return
+            except _FailedBeforeOutput as e:
+                if retry >= self.max_retries:
+                    raise e.error
+                retry += 1
+                delay = self.retry_delay(retry)
+                if not self.time_for_retry(deadline, delay, label):
+                    raise e.error
+                print(f"🔁 {label} failed before any output ({e}); retry {retry}/{self.max_retries} in {delay:.1f}s")
+                CLI_RETRIES.inc(format=label)
+                await asyncio.sleep(delay)
+            finally:
+                if probe:
+                    self.breaker.abandon_probe()
+
+    async def _arace(self, prompt, timeout, label):
+        """Async version of _race; attempts are tasks and are cancelled to stop them"""
+        first_timeout, total_timeout = self.timeouts(label, timeout)
+        hedge_after = self.hedge_delay(label)
+        call_deadline = time.time() + timeout
+        events = asyncio.Queue()
+        attempts = []
+
+        def launch():
+            async def run(attempt):
+                try:
+                    async for chunk in self.backend.aiter_output(
+                            prompt, timeout=min(total_timeout, call_deadline - attempt['started_at'])):
+                        await events.put((attempt, 'chunk', chunk))
+                    await events.put((attempt, 'done', None))
+                except Exception as e:
+                    await events.put((attempt, 'error', e))
+
+            started_at = time.time()
+            attempt = {'started_at': started_at,
+                       'first_output_deadline': min(started_at + first_timeout, call_deadline)}
+            attempt['task'] = asyncio.ensure_future(run(attempt))
+            attempts.append(attempt)
+            return attempt
+
+        winner = None
+        first_output_time = None
+        try:
+            live = [launch()]
+            call_start = live[0]['started_at']
+            while True:
+                wait = None
+                if winner is None:
+                    deadlines = [attempt['first_output_deadline'] for attempt in live]
+                    if hedge_after is not None and len(attempts) == 1:
+                        deadlines.append(call_start + hedge_after)
+                    wait = max(0.0, min(deadlines) - time.time())
+                try:
+                    attempt, kind, payload = await asyncio.wait_for(events.get(), wait)
+                except asyncio.TimeoutError:
+                    now = time.time()
+                    if hedge_after is not None and len(attempts) == 1 and now >= call_start + hedge_after:
+                        print(f"🏁 Hedging {label}: no output after {hedge_after:.1f}s (p95)")
+                        live.append(launch())
+                    for attempt in [a for a in live if now >= a['first_output_deadline']]:
+                        attempt['task'].cancel()
+                        live.remove(attempt)
+                        self.breaker.record_failure()
+                    if not live:
+                        raise _FailedBeforeOutput(asyncio.TimeoutError())
+                    continue
+
+                if attempt is not winner and (winner is not None or attempt not in live):
+                    continue
+                if kind == 'chunk':
+                    if winner is None:
+                        winner = attempt
+                        first_output_time = time.time() - attempt['started_at']
+                        if len(attempts) > 1:
+                            CLI_HEDGES.inc(format=label, winner='hedge' if attempt is attempts[-1] else 'primary')
+                        for other in attempts:
+                            if other is not attempt:
+                                other['task'].cancel()
+                    yield payload
+                elif kind == 'done':
+                    self.breaker.record_success()
+                    total = time.time() - attempt['started_at']
+                    self.record_latency(label, first_output_time if first_output_time is not None else total, total)
+                    return
+                else:
+                    self.breaker.record_failure()
+                    if attempt is winner:
+                        raise payload
+                    live.remove(attempt)
+                    if not live:
+                        raise _FailedBeforeOutput(payload)
+        finally:
+            for attempt in attempts:
+                attempt['task'].cancel()
+
+
+def wait_unless_cancelled(seconds, job=None):
+    """Sleep, raising JobCancelled as soon as `job` is cancelled"""
+    if not job:
+        time.sleep(seconds)
+        return
+    cancelled = threading.Event()
+    unregister_cancel = job.add_cancel_callback(cancelled.set)
+    try:
+        if cancelled.wait(seconds):
+            raise JobCancelled(job.cancel_reason)
+    finally:
+        unregister_cancel()
+
+
+def resilient_from_env(backend):
+    """Wrap a backend using the CLI_* environment variables"""
+    return ResilientBackend(
+        backend,
+        min_samples=int(os.environ.get('CLI_ADAPTIVE_MIN_SAMPLES', '20')),
+        timeout_multiplier=float(os.environ.get('CLI_TIMEOUT_MULTIPLIER', '3')),
+        min_timeout=float(os.environ.get('CLI_MIN_TIMEOUT_SECONDS', '30')),
+        hedge=os.environ.get('CLI_HEDGE', 'false').lower() in ('1', 'true', 'yes'),
+        max_retries=int(os.environ.get('CLI_MAX_RETRIES', '2')),
+        retry_base_seconds=float(os.environ.get('CLI_RETRY_BASE_SECONDS', '1')),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.environ.get('CLI_BREAKER_FAILURES', '5')),
+            cooldown_seconds=float(os.environ.get('CLI_BREAKER_COOLDOWN_SECONDS', '30')),
+        ),
+    )
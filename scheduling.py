@@ -0,0 +1,165 @@
+"""
+Priority classes and fair queuing for generation requests
+
+Generations that have to wait for a worker are not served first come first
+served. Each request gets a priority class, given explicitly or detected
+from the notes: a SEV1 breach outranks a low-severity restart, and within
+an incident the exec-facing formats go first. Within a class, clients
+(API keys, or addresses when there is none) take turns in proportion to
+their weight, so one client backfilling a hundred reports cannot crowd out
+everyone else. Waiting requests are promoted one class for every
+`aging_seconds` they wait, so nothing starves.
+"""
+
+import itertools
+import os
+import re
+import time
+
+# Most urgent first
+PRIORITIES = ('critical', 'high', 'normal', 'low')
+
+# Formats read by executives and customers during the incident
+EXEC_FORMATS = ('executive_summary', 'executive_communication')
+
+_SEVERITY_MARKER = re.compile(r'\b(?:sev|severity)[\s:-]*([0-4])\b|\bp([0-4])\b', re.I)
+_CRITICAL_TERMS = re.compile(
+    r'security incident|compromised|breach|exfiltrat|ransomware|data loss|all regions|multi-region'
+    r'|(?:complete|full|total|global) outage|major incident',
+    re.I
+)
+_HIGH_TERMS = re.compile(
+    r'outage|data inconsistency|customers? (?:are |were )?(?:affected|impacted|reporting)|revenue'
+    r'|payments? (?:failing|down)|alert: high',
+    re.I
+)
+_RESPONDER = re.compile(r'@([\w.-]+)')
+
+
+def detect_severity(incident_notes):
+    """
+    Priority class of an incident from its notes: an explicit SEVn or Pn
+    marker when there is one, otherwise keywords and the number of
+    responders. Cheap enough to run on every request.
+    """
+    levels = [int(sev or p) for sev, p in _SEVERITY_MARKER.findall(incident_notes)]
+    if levels:
+        return PRIORITIES[max(0, min(levels) - 1)]
+    if _CRITICAL_TERMS.search(incident_notes):
+        return 'critical'
+    responders = len(set(_RESPONDER.findall(incident_notes)))
+    if responders >= 6:
+        return 'critical'
+    if responders >= 4 or _HIGH_TERMS.search(incident_notes):
+        return 'high'
+    lines = sum(1 for line in incident_notes.split('\n') if line.strip())
+    return 'normal' if lines >= 20 else 'low'
+
+
+def request_priority(incident_notes, output_format, requested=None):
+    """
+    Priority class for generating `output_format` from the notes. A valid
+    `requested` class wins; otherwise the detected severity, one class
+    higher for exec-facing formats.
+    """
+    if requested in PRIORITIES:
+        return requested
+    level = PRIORITIES.index(detect_severity(incident_notes))
+    if output_format in EXEC_FORMATS:
+        level = max(0, level - 1)
+    return PRIORITIES[level]
+
+
+class FairQueue:
+    """
+    Wait queue ordered by priority class, then by start-time fair queuing
+    among the clients in each class. Every entry needs `priority`, `client`
+    and `enqueued_at` attributes. Not thread-safe: the pool holds its lock
+    around every call.
+
+    The queue is bounded by the pool, so `pop()` and `ordered()` simply
+    scan it; aging changes entries' classes while they wait anyway.
+    """
+
+    def __init__(self, client_weights=None, aging_seconds=60.0):
+        self.client_weights = client_weights or {}
+        self.aging_seconds = aging_seconds
+        self._entries = []
+        self._sequence = itertools.count()
+        # Per class: virtual time of the last dispatched entry, and the
+        # virtual finish time of each client's latest entry
+        self._virtual_time = {name: 0.0 for name in PRIORITIES}
+        self._client_finish = {name: {} for name in PRIORITIES}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entry):
+        return entry in self._entries
+
+    def push(self, entry):
+        if entry.priority not in PRIORITIES:
+            entry.priority = 'normal'
+        finish = self._client_finish[entry.priority]
+        start = max(self._virtual_time[entry.priority], finish.get(entry.client, 0.0))
+        finish[entry.client] = start + 1.0 / self.client_weights.get(entry.client, 1.0)
+        entry.virtual_start = start
+        entry.sequence = next(self._sequence)
+        self._entries.append(entry)
+
+    def pop(self):
+        """Remove and return the entry that should run next"""
+        now = time.time()
+        entry = min(self._entries, key=lambda e: self._rank(e, now))
+        self._entries.remove(entry)
+        self._virtual_time[entry.priority] = entry.virtual_start
+        finish = self._client_finish[entry.priority]
+        for client in [c for c, t in finish.items() if t <= entry.virtual_start]:
+            del finish[client]
+        return entry
+
+    def remove(self, entry):
+        self._entries.remove(entry)
+
+    def ordered(self):
+        """Waiting entries in the order they would run"""
+        now = time.time()
+        return sorted(self._entries, key=lambda e: self._rank(e, now))
+
+    def counts(self):
+        """Waiting entries per priority class"""
+        counts = dict.fromkeys(PRIORITIES, 0)
+        for entry in self._entries:
+            counts[entry.priority] += 1
+        return counts
+
+    def effective_priority(self, entry, now=None):
+        """The entry's class after promotion for the time it has waited"""
+        waited = (now or time.time()) - entry.enqueued_at
+        promotions = int(waited // self.aging_seconds) if self.aging_seconds > 0 else 0
+        return max(0, PRIORITIES.index(entry.priority) - promotions)
+
+    def _rank(self, entry, now):
+        level = self.effective_priority(entry, now)
+        if level < PRIORITIES.index(entry.priority):
+            # Promoted entries go ahead of the class they joined, oldest first
+            return (level, 0, entry.enqueued_at, entry.sequence)
+        return (level, 1, entry.virtual_start, entry.sequence)
+
+
+def parse_client_weights(text):
+    """'team-a=4,team-b=2' -> {'team-a': 4.0, 'team-b': 2.0}"""
+    weights = {}
+    for item in text.split(','):
+        if '=' in item:
+            client, weight = item.rsplit('=', 1)
+            weights[client.strip()] = max(0.01, float(weight))
+    return weights
+
+
+def queue_from_env():
+    """Build a fair queue from SCHEDULER_* environment variables"""
+    return FairQueue(
+        client_weights=parse_client_weights(os.environ.get('SCHEDULER_CLIENT_WEIGHTS', '')),
+        aging_seconds=float(os.environ.get('SCHEDULER_AGING_SECONDS', '60')),
+    )
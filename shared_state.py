@@ -0,0 +1,525 @@
+"""
+Host-local state shared by the worker processes of one server
+
+A production server runs several worker processes (see gunicorn.conf.py),
+each with its own worker pool, caches and job registry. When
+SHARED_STATE_PATH is set they coordinate through one SQLite file in WAL
+mode:
+
+- CLI slots: at most SHARED_CLI_MAX_CONCURRENT Claude CLI calls run at once
+  on the host, however many workers there are (SlotLimitedBackend).
+- Jobs: each job's single-flight key, subscriber count and events. An
+  identical request, or a /api/jobs/<id> call, that lands on another worker
+  follows the job through a local mirror fed from the file instead of
+  starting a second CLI run (SharedJobRegistry). Event IDs are the same on
+  every worker, so a stream can resume anywhere.
+
+Every worker heartbeats into the file once a second. Slots held by a worker
+that stops heartbeating are reclaimed and its unfinished jobs are failed.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from backends import CLAUDE_TIMEOUT_SECONDS
+from jobs import Job, JobCancelled, JobRegistry
+from resilience import wait_unless_cancelled
+
+# How often finished jobs older than the retention window are deleted from the file
+PURGE_INTERVAL_SECONDS = 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cli_slots (
+    slot INTEGER PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    acquired_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT,
+    description TEXT NOT NULL,
+    worker_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    done_at REAL,
+    detached INTEGER NOT NULL DEFAULT 0,
+    subscribers INTEGER NOT NULL DEFAULT 0,
+    event_count INTEGER,
+    cancel_request TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_key ON jobs (key, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (job_id, position)
+) WITHOUT ROWID;
+'''
+
+
+class SharedState:
+    """
+    The coordination file, plus this process's heartbeat in it. Connections
+    are per thread; `stale_seconds` without a heartbeat marks a worker dead.
+    """
+
+    def __init__(self, db_path, heartbeat_seconds=1.0, stale_seconds=10.0):
+        self.db_path = db_path
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.worker_id = uuid.uuid4().hex
+        self._local = threading.local()
+        self._pid = os.getpid()
+        db = self.db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        self._beat()
+        threading.Thread(target=self._heartbeat, name='shared-state', daemon=True).start()
+
+    def db(self):
+        """This thread's connection, in autocommit mode"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.db = sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None)
+            self._local.db.execute('PRAGMA synchronous=NORMAL')
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    @contextmanager
+    def transaction(self):
+        """A write transaction, taken up front so concurrent writers queue instead of failing"""
+        db = self.db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def live_since(self):
+        """Heartbeats older than this belong to dead workers"""
+        return time.time() - self.stale_seconds
+
+    def acquire_slot(self, limit):
+        """Lease the lowest free CLI slot below `limit`; None when all are taken"""
+        with self.transaction() as db:
+            db.execute(
+                'DELETE FROM cli_slots WHERE worker_id NOT IN (SELECT id FROM workers WHERE seen_at > ?)',
+                (self.live_since(),)
+            )
+            taken = {row[0] for row in db.execute('SELECT slot FROM cli_slots')}
+            slot = next((s for s in range(limit) if s not in taken), None)
+            if slot is not None:
+                db.execute('INSERT INTO cli_slots VALUES (?, ?, ?)', (slot, self.worker_id, time.time()))
+            return slot
+
+    def release_slot(self, slot):
+        self.db().execute('DELETE FROM cli_slots WHERE slot = ? AND worker_id = ?', (slot, self.worker_id))
+
+    def stats(self):
+        db = self.db()
+        since = self.live_since()
+        workers = db.execute('SELECT COUNT(*) FROM workers WHERE seen_at > ?', (since,)).fetchone()[0]
+        slots = db.execute(
+            'SELECT COUNT(*) FROM cli_slots WHERE worker_id IN (SELECT id FROM workers WHERE seen_at > ?)',
+            (since,)
+        ).fetchone()[0]
+        return {'workers': workers, 'cli_slots_in_use': slots}
+
+    def _beat(self):
+        self.db().execute(
+            'INSERT OR REPLACE INTO workers VALUES (?, ?, ?)', (self.worker_id, self._pid, time.time())
+        )
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            try:
+                self._beat()
+            except sqlite3.Error as e:
+                print(f"⚠️ Shared state heartbeat failed: {e}")
+
+
+class SlotLimitedBackend:
+    """
+    A backend wrapper that holds one of the host's `limit` CLI slots for the
+    duration of every call, waiting (and honouring job cancellation) while
+    all are taken. Wrap it around the resilient backend so slot waits do not
+    count against its timeouts; a hedged call's duplicate shares its slot.
+    """
+
+    def __init__(self, backend, state, limit=4, poll_seconds=0.05, max_poll_seconds=0.5):
+        self.backend = backend
+        self.name = backend.name
+        self.state = state
+        self.limit = limit
+        self.poll_seconds = poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+
+    def iter_output(self, prompt, on_started=None, timeout=CLAUDE_TIMEOUT_SECONDS, job=None, **kwargs):
+        slot = self._wait_for_slot(job)
+        try:
+            yield from self.backend.iter_output(
+                prompt, on_started=on_started, timeout=timeout, job=job, **kwargs
+            )
+        finally:
+            self.state.release_slot(slot)
+
+    async def aiter_output(self, prompt, **kwargs):
+        # Slot leases are SQLite transactions that can wait on other
+        # workers' locks, so they run on threads rather than the event loop
+        delay = self.poll_seconds
+        slot = await self._aacquire_slot()
+        while slot is None:
+            await asyncio.sleep(delay)
+            delay = min(self.max_poll_seconds, delay * 2)
+            slot = await self._aacquire_slot()
+        try:
+            async for chunk in self.backend.aiter_output(prompt, **kwargs):
+                yield chunk
+        finally:
+            # Shielded so a cancelled call still gives its slot back
+            await asyncio.shield(asyncio.to_thread(self.state.release_slot, slot))
+
+    def stats(self):
+        stats = self.backend.stats() if hasattr(self.backend, 'stats') else {}
+        return dict(stats, cli_slots={'limit': self.limit, **self.state.stats()})
+
+    async def _aacquire_slot(self):
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.state.acquire_slot, self.limit))
+        try:
+            return await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The lease may still succeed after the caller has gone; hand it back
+            acquiring.add_done_callback(self._release_abandoned_slot)
+            raise
+
+    def _release_abandoned_slot(self, acquiring):
+        if not acquiring.cancelled() and acquiring.exception() is None and acquiring.result() is not None:
+            threading.Thread(target=self.state.release_slot, args=(acquiring.result(),), daemon=True).start()
+
+    def _wait_for_slot(self, job):
+        delay = self.poll_seconds
+        slot = self.state.acquire_slot(self.limit)
+        while slot is None:
+            wait_unless_cancelled(delay, job)
+            delay = min(self.max_poll_seconds, delay * 2)
+            slot = self.state.acquire_slot(self.limit)
+        if job and job.cancelled:
+            self.state.release_slot(slot)
+            raise JobCancelled(job.cancel_reason)
+        return slot
+
+
+class SharedJobRegistry(JobRegistry):
+    """
+    JobRegistry whose keys, subscriber counts and events are shared with the
+    other workers. Jobs registered here are published to the shared file; a
+    job started by another worker is followed through a local mirror Job
+    (same ID, same event positions) that a background thread feeds from the
+    file every `poll_seconds`. Cancelling a mirror asks its owner to cancel.
+    """
+
+    def __init__(self, state, retention_seconds=900, poll_seconds=0.05):
+        super().__init__(retention_seconds)
+        self.state = state
+        self.poll_seconds = poll_seconds
+        self.followed = 0
+        # job id -> mirror Job, and the next event position to read for it
+        self._mirrors = {}
+        self._next_position = {}
+        # (job id, position, message) published here, not yet written
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._last_purge = 0.0
+        threading.Thread(target=self._sync, name='shared-jobs', daemon=True).start()
+
+    def get(self, job_id):
+        job = super().get(job_id)
+        if job is None:
+            with self._lock:
+                job = self._follow(job_id)
+        return job
+
+    def claim(self, job, include_finished=True, detached=False):
+        with self._lock:
+            self._purge()
+            existing = self._by_key.get(job.key) if job.key else None
+            if existing and not existing.cancelled and (
+                    not existing.done or (include_finished and existing.succeeded)):
+                self.coalesced += 1
+                existing.detached = existing.detached or detached
+                self._add_subscriber(existing, detached)
+                return existing.subscribe(), False
+
+            with self.state.transaction() as db:
+                row = db.execute(
+                    'SELECT id, status FROM jobs WHERE key = ? AND worker_id != ? AND worker_id IN '
+                    '(SELECT id FROM workers WHERE seen_at > ?) ORDER BY created_at DESC LIMIT 1',
+                    (job.key, self.state.worker_id, self.state.live_since())
+                ).fetchone() if job.key else None
+                if row and (row[1] == 'running' or (include_finished and row[1] == 'succeeded')):
+                    db.execute(
+                        'UPDATE jobs SET subscribers = subscribers + 1, detached = detached OR ? WHERE id = ?',
+                        (detached, row[0])
+                    )
+                    remote_id = row[0]
+                else:
+                    remote_id = None
+                    db.execute(
+                        'INSERT INTO jobs (id, key, description, worker_id, created_at, detached, subscribers)'
+                        ' VALUES (?, ?, ?, ?, ?, ?, 1)',
+                        (job.id, job.key, job.description, self.state.worker_id, job.created_at, detached)
+                    )
+
+            if remote_id is not None:
+                mirror = self._jobs.get(remote_id) or self._follow(remote_id)
+                if mirror is not None:
+                    self.coalesced += 1
+                    mirror.detached = mirror.detached or detached
+                    return mirror.subscribe(), False
+
+            job.detached = detached
+            job.events.on_put = lambda position, entry: self._queue_event(job.id, position, entry)
+            self._jobs[job.id] = job
+            if job.key:
+                self._by_key[job.key] = job
+            return job.subscribe(), True
+
+    def subscribe(self, job_id, start=0):
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id) or self._follow(job_id)
+            if not job:
+                return None
+            self._add_subscriber(job, False)
+            return job.subscribe(start)
+
+    def release(self, subscription):
+        """
+        Called when a client stops reading. The job is cancelled when no
+        worker has a client left for it, unless it finished or is detached.
+        """
+        job = subscription.job
+        with self._lock:
+            job.unsubscribe()
+            remaining = self.state.db().execute(
+                'UPDATE jobs SET subscribers = MAX(0, subscribers - 1) WHERE id = ? RETURNING subscribers',
+                (job.id,)
+            ).fetchone()
+            abandoned = ((remaining is None or remaining[0] == 0) and not subscription.finished
+                         and not job.done and not job.detached)
+            if abandoned:
+                self._forget_key(job)
+        if abandoned:
+            self.cancel(job, 'timed out' if subscription.timed_out else 'client disconnected')
+
+    def finish(self, job, succeeded):
+        super().finish(job, succeeded)
+        self._flush()
+        self.state.db().execute(
+            'UPDATE jobs SET status = ?, done_at = ?, event_count = ? WHERE id = ?',
+            (job.status, job.done_at, len(job.events), job.id)
+        )
+
+    def cancel(self, job, reason):
+        if job.id in self._mirrors:
+            self.state.db().execute(
+                "UPDATE jobs SET cancel_request = ? WHERE id = ? AND status = 'running'", (reason, job.id)
+            )
+            print(f"🛑 Asked the owning worker to cancel job {job.id} ({job.description}): {reason}")
+            return True
+        if not super().cancel(job, reason):
+            return False
+        self.state.db().execute(
+            "UPDATE jobs SET status = 'cancelled', done_at = ? WHERE id = ? AND status = 'running'",
+            (job.cancelled_at, job.id)
+        )
+        return True
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['followed'] = self.followed
+        return stats
+
+    def _add_subscriber(self, job, detached):
+        self.state.db().execute(
+            'UPDATE jobs SET subscribers = subscribers + 1, detached = detached OR ? WHERE id = ?',
+            (detached, job.id)
+        )
+
+    def _follow(self, job_id):
+        """
+        A mirror of a job another worker published, caught up with the
+        events written so far; None if the file has no such job. Holds _lock.
+        """
+        row = self.state.db().execute(
+            'SELECT description, key, created_at, detached FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        mirror = Job(row[0], key=row[1])
+        mirror.id = job_id
+        mirror.created_at = row[2]
+        mirror.detached = bool(row[3])
+        self._jobs[job_id] = mirror
+        if mirror.key:
+            self._by_key[mirror.key] = mirror
+        self._mirrors[job_id] = mirror
+        self._next_position[job_id] = 0
+        self.followed += 1
+        self._tail(mirror)
+        print(f"🔗 Following job {job_id} ({mirror.description}) from another worker")
+        return mirror
+
+    def _tail(self, mirror):
+        """Copy newly written events into a mirror, and finish it once its owner has"""
+        db = self.state.db()
+        position = self._next_position[mirror.id]
+        rows = db.execute(
+            'SELECT position, message FROM job_events WHERE job_id = ? AND position >= ? ORDER BY position',
+            (mirror.id, position)
+        ).fetchall()
+        for row_position, message in rows:
+            if row_position != position:
+                # The owner writes in batches; wait for the gap to fill
+                break
+            event = json.loads(message)
+            mirror.events.put(message, event)
+            mirror.record_event(event)
+            position += 1
+        self._next_position[mirror.id] = position
+
+        row = db.execute(
+            'SELECT j.status, j.event_count, j.done_at, w.seen_at FROM jobs j'
+            ' LEFT JOIN workers w ON w.id = j.worker_id WHERE j.id = ?', (mirror.id,)
+        ).fetchone()
+        if row is None:
+            return
+        status, event_count, done_at, seen_at = row
+        if status == 'running':
+            if (seen_at or 0) <= self.state.live_since():
+                self._fail_orphan(mirror)
+            return
+        if event_count is None:
+            # Cancelled and not finished (yet): a job cancelled while queued
+            # never is, so stop waiting after a while
+            caught_up = mirror.final_event is not None or done_at < self.state.live_since()
+        else:
+            caught_up = position >= event_count
+        if caught_up:
+            mirror.succeeded = status == 'succeeded'
+            if status == 'cancelled':
+                mirror.cancel('cancelled by its worker')
+            mirror.done_at = time.time()
+            if not mirror.succeeded:
+                self._forget_key(mirror)
+
+    def _fail_orphan(self, mirror):
+        """The owning worker died mid-job: end the mirror's stream with an error"""
+        error = {'type': 'error', 'error': 'The worker running this job stopped; please retry'}
+        mirror.events.put(json.dumps(error), error)
+        mirror.record_event(error)
+        mirror.done_at = time.time()
+        self._forget_key(mirror)
+        self.state.db().execute(
+            "UPDATE jobs SET status = 'failed', done_at = ? WHERE id = ? AND status = 'running'",
+            (mirror.done_at, mirror.id)
+        )
+        print(f"⚠️ Worker running job {mirror.id} stopped heartbeating; failed the job")
+
+    def _queue_event(self, job_id, position, entry):
+        with self._pending_lock:
+            self._pending.append((job_id, position, entry))
+
+    def _flush(self):
+        """Write the events published here since the last flush"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            with self.state.transaction() as db:
+                db.executemany(
+                    'INSERT OR IGNORE INTO job_events VALUES (?, ?, ?)',
+                    [(job_id, position, entry.encoded) for job_id, position, entry in pending]
+                )
+
+    def _sync(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self._flush()
+                with self._lock:
+                    for job_id, mirror in list(self._mirrors.items()):
+                        if job_id not in self._jobs:
+                            del self._mirrors[job_id], self._next_position[job_id]
+                        elif not mirror.done:
+                            self._tail(mirror)
+                    running_here = any(
+                        not job.done and not job.cancelled and job.id not in self._mirrors
+                        for job in self._jobs.values()
+                    )
+                if running_here:
+                    self._apply_cancel_requests()
+                if time.time() - self._last_purge >= PURGE_INTERVAL_SECONDS:
+                    self._last_purge = time.time()
+                    self._purge_shared()
+            except sqlite3.Error as e:
+                print(f"⚠️ Shared job sync failed: {e}")
+
+    def _apply_cancel_requests(self):
+        requests = self.state.db().execute(
+            "SELECT id, cancel_request FROM jobs WHERE worker_id = ? AND status = 'running'"
+            ' AND cancel_request IS NOT NULL', (self.state.worker_id,)
+        ).fetchall()
+        for job_id, reason in requests:
+            job = super().get(job_id)
+            if job:
+                self.cancel(job, reason)
+
+    def _purge_shared(self):
+        cutoff = time.time() - self.retention_seconds
+        with self.state.transaction() as db:
+            db.execute(
+                'DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE done_at < ?)', (cutoff,)
+            )
+            db.execute('DELETE FROM jobs WHERE done_at < ?', (cutoff,))
+            db.execute('DELETE FROM workers WHERE seen_at < ?', (cutoff,))
+
+
+def shared_state_from_env():
+    """The coordination file from SHARED_STATE_PATH; None (no sharing) when unset"""
+    db_path = os.environ.get('SHARED_STATE_PATH')
+    if not db_path:
+        return None
+    print(f"🤝 Sharing CLI slots and jobs with other workers through {db_path}")
+    return SharedState(
+        db_path,
+        stale_seconds=float(os.environ.get('SHARED_STATE_STALE_SECONDS', '10')),
+    )
+
+
+def slot_limited_from_env(backend, state):
+    """Limit `backend` to SHARED_CLI_MAX_CONCURRENT host-wide CLI slots"""
+    return SlotLimitedBackend(
+        backend, state, limit=int(os.environ.get('SHARED_CLI_MAX_CONCURRENT', '4')),
+    )
+
+
+def shared_registry_from_env(state):
+    """Build a shared job registry from JOB_* environment variables"""
+    return SharedJobRegistry(
+        state,
+        retention_seconds=int(os.environ.get('JOB_RETENTION_SECONDS', '900')),
+    )
@@ -0,0 +1,241 @@
+"""
+Near-duplicate incident detection
+
+The exact report cache misses when a second responder pastes the same
+incident with one extra line, or with different whitespace and timestamp
+formats. This index keeps a MinHash signature of every set of notes that
+reports were requested for, bucketed by LSH bands, so notes that share most
+of their word shingles with earlier ones are found with a handful of dict
+lookups however many incidents are stored. Each indexed incident remembers
+the report cache keys of its formats. The index is updated as requests
+arrive and persisted to SQLite.
+"""
+
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+# Words per shingle
+SHINGLE_WORDS = 3
+
+# Signature length = BANDS * ROWS. Two signatures share a band bucket with
+# probability J^ROWS, so notes with Jaccard similarity J become candidates
+# with probability 1 - (1 - J^ROWS)^BANDS: ~0.99 at J=0.8, ~0.2 at J=0.5
+BANDS = 16
+ROWS = 8
+NUM_PERM = BANDS * ROWS
+
+# Notes with fewer shingles are too short to compare meaningfully
+MIN_SHINGLES = 10
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _permutations():
+    """Fixed (a, b) pairs so signatures stay comparable across restarts"""
+    pairs = []
+    for i in range(NUM_PERM):
+        seed = hashlib.sha256(f'minhash-{i}'.encode()).digest()
+        a, b = struct.unpack('<QQ', seed[:16])
+        pairs.append((a % (_MERSENNE_PRIME - 1) + 1, b % _MERSENNE_PRIME))
+    return pairs
+
+
+_PERMUTATIONS = _permutations()
+
+# Leading timestamps in any format, dropped so only the text is compared
+_TIMESTAMP = re.compile(r'^\s*\[?(?:[\d/\-]+[T ])?\d{1,2}:\d{2}(?::\d{2})?(?:[.,]\d+)?'
+                        r'(?:Z|[+-]\d{2}:?\d{2}| ?UTC)?(?: ?[AaPp][Mm])?\]?\s*')
+_WORD = re.compile(r'\w+')
+
+
+def shingles(incident_notes):
+    """Hashed word shingles of the notes, ignoring case, spacing and timestamps"""
+    words = []
+    for line in incident_notes.split('\n'):
+        words.extend(_WORD.findall(_TIMESTAMP.sub('', line).lower()))
+    grams = {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    return {zlib.crc32(gram.encode('utf-8')) for gram in grams if gram}
+
+
+def minhash(shingle_hashes):
+    """MinHash signature of a set of shingle hashes, as an array of NUM_PERM ints"""
+    return array('Q', (
+        min(((a * x + b) % _MERSENNE_PRIME) & _MAX_HASH for x in shingle_hashes)
+        for a, b in _PERMUTATIONS
+    ))
+
+
+def estimate_similarity(signature, other):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return sum(1 for x, y in zip(signature, other) if x == y) / NUM_PERM
+
+
+@functools.lru_cache(maxsize=64)
+def notes_signature(incident_notes):
+    """
+    (incident id, MinHash signature) for a set of notes, or (id, None) when
+    they are too short to compare. Memoised: a request looks the notes up and
+    then adds them.
+    """
+    incident_id = hashlib.sha256(incident_notes.encode('utf-8')).hexdigest()
+    shingle_hashes = shingles(incident_notes)
+    return incident_id, minhash(shingle_hashes) if len(shingle_hashes) >= MIN_SHINGLES else None
+
+
+def _bands(signature):
+    raw = signature.tobytes()
+    width = ROWS * signature.itemsize
+    return [raw[i * width:(i + 1) * width] for i in range(BANDS)]
+
+
+class SimilarityIndex:
+    """
+    MinHash/LSH index of incident notes. `add()` records which report
+    cache keys belong to a set of notes; `query()` returns earlier notes
+    whose estimated similarity is at least `threshold`, most similar first.
+
+    Incidents are identified by a hash of their notes. At most
+    `max_entries` are kept, dropping the oldest; pass `db_path=None` to
+    keep the index in memory only.
+    """
+
+    def __init__(self, threshold=0.8, max_entries=50000, db_path=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.db_path = db_path
+
+        # incident id -> {'signature', 'reports': {format: cache key}, 'created_at'}
+        self._entries = {}
+        self._buckets = [{} for _ in range(BANDS)]
+        self._lock = threading.Lock()
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS incidents ('
+                ' id TEXT PRIMARY KEY,'
+                ' signature BLOB NOT NULL,'
+                ' created_at REAL NOT NULL)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS incident_reports ('
+                ' incident_id TEXT NOT NULL,'
+                ' format TEXT NOT NULL,'
+                ' cache_key TEXT NOT NULL,'
+                ' PRIMARY KEY (incident_id, format))'
+            )
+            self._db.commit()
+            self._load()
+
+    def add(self, incident_notes, reports):
+        """Record the report cache keys ({format: key}) for a set of notes"""
+        incident_id, minhash_signature = notes_signature(incident_notes)
+        if minhash_signature is None:
+            return
+        with self._lock:
+            entry = self._entries.get(incident_id)
+            if entry is None:
+                entry = {'signature': minhash_signature, 'reports': {}, 'created_at': time.time()}
+                self._insert(incident_id, entry)
+                if self._db:
+                    self._db.execute('INSERT OR REPLACE INTO incidents (id, signature, created_at) VALUES (?, ?, ?)',
+                                     (incident_id, minhash_signature.tobytes(), entry['created_at']))
+                self._evict()
+            new_reports = {name: key for name, key in reports.items() if entry['reports'].get(name) != key}
+            entry['reports'].update(new_reports)
+            if self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO incident_reports (incident_id, format, cache_key) VALUES (?, ?, ?)',
+                    [(incident_id, name, key) for name, key in new_reports.items()]
+                )
+                self._db.commit()
+
+    def query(self, incident_notes, output_format):
+        """
+        Earlier incidents at least `threshold` similar to these notes, as
+        (similarity, cache key) pairs for `output_format`, most similar
+        first. The notes themselves are never returned.
+        """
+        incident_id, minhash_signature = notes_signature(incident_notes)
+        if minhash_signature is None:
+            return []
+        with self._lock:
+            candidates = set()
+            for bucket, band in zip(self._buckets, _bands(minhash_signature)):
+                candidates.update(bucket.get(band, ()))
+            candidates.discard(incident_id)
+
+            matches = []
+            for candidate in candidates:
+                entry = self._entries[candidate]
+                key = entry['reports'].get(output_format)
+                if key is None:
+                    continue
+                similarity = estimate_similarity(minhash_signature, entry['signature'])
+                if similarity >= self.threshold:
+                    matches.append((similarity, key))
+        return sorted(matches, reverse=True)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries)}
+
+    def _insert(self, incident_id, entry):
+        self._entries[incident_id] = entry
+        for bucket, band in zip(self._buckets, _bands(entry['signature'])):
+            bucket.setdefault(band, set()).add(incident_id)
+
+    def _evict(self):
+        # Entries are inserted in age order, so the oldest come first
+        while len(self._entries) > self.max_entries:
+            incident_id = next(iter(self._entries))
+            entry = self._entries.pop(incident_id)
+            for bucket, band in zip(self._buckets, _bands(entry['signature'])):
+                members = bucket[band]
+                members.discard(incident_id)
+                if not members:
+                    del bucket[band]
+            if self._db:
+                self._db.execute('DELETE FROM incidents WHERE id = ?', (incident_id,))
+                self._db.execute('DELETE FROM incident_reports WHERE incident_id = ?', (incident_id,))
+
+    def _load(self):
+        rows = self._db.execute(
+            'SELECT id, signature, created_at FROM incidents ORDER BY created_at DESC LIMIT ?',
+            (self.max_entries,)
+        ).fetchall()
+        for incident_id, raw, created_at in reversed(rows):
+            signature = array('Q')
+            signature.frombytes(raw)
+            if len(signature) == NUM_PERM:
+                self._insert(incident_id, {'signature': signature, 'reports': {}, 'created_at': created_at})
+        for incident_id, name, key in self._db.execute('SELECT incident_id, format, cache_key FROM incident_reports'):
+            if incident_id in self._entries:
+                self._entries[incident_id]['reports'][name] = key
+        print(f"🔎 Loaded {len(self._entries)} incidents into the similarity index")
+
+
+def index_from_env():
+    """
+    Build the similarity index from SIMILARITY_* environment variables;
+    None when SIMILARITY_THRESHOLD is 0
+    """
+    threshold = float(os.environ.get('SIMILARITY_THRESHOLD', '0.8'))
+    if threshold <= 0:
+        return None
+    return SimilarityIndex(
+        threshold=threshold,
+        max_entries=int(os.environ.get('SIMILARITY_INDEX_MAX', '50000')),
+        db_path=os.environ.get('SIMILARITY_INDEX_PATH', 'similarity_index.db') or None,
+    )
@@ -0,0 +1,54 @@
+import json
+
+from backends import StreamJsonParser, parse_stream_json_line
+
+
+def stream_event(text):
+    return json.dumps({
+        'type': 'stream_event',
+        'event': {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': text}},
+    }) + '\n'
+
+
+def feed_all(lines):
+    parser = StreamJsonParser()
+    return [parser.feed(line) for line in lines]
+
+
+def test_text_delta():
+    assert parse_stream_json_line(stream_event('## Impact')) == ('text', '## Impact')
+
+
+def test_result_message():
+    result = {'type': 'result', 'is_error': False, 'result': 'done'}
+    assert parse_stream_json_line(json.dumps(result) + '\n') == ('result', result)
+
+
+def test_other_messages_and_blank_lines_are_skipped():
+    assert parse_stream_json_line('{"type": "system", "subtype": "init"}\n') == (None, None)
+    assert parse_stream_json_line('\n') == (None, None)
+
+
+def test_plain_text_keeps_indentation():
+    assert parse_stream_json_line('    - nested item\r\n') == ('text', '    - nested item\n')
+
+
+def test_non_object_json_is_text():
+    assert parse_stream_json_line('42\n') == ('text', '42\n')
+    assert parse_stream_json_line('[1, 2]\n') == ('text', '[1, 2]\n')
+
+
+def test_text_mode_keeps_blank_lines_and_json_looking_lines():
+    lines = ['# Summary\n', '\n', 'true\n', '{"type": "result"}\n', '  - item\n']
+    assert parse_stream_json_line('\n', text_mode=True) == ('text', '\n')
+    assert [parse_stream_json_line(line, text_mode=True) for line in lines] == [('text', line) for line in lines]
+
+
+def test_parser_switches_to_text_mode_on_plain_output():
+    lines = ['# Summary\n', '\n', 'Paragraph one.\n', '\n', '- item\n', '42\n']
+    assert feed_all(lines) == [('text', line) for line in lines]
+
+
+def test_parser_stays_in_stream_json_mode():
+    lines = ['{"type": "system", "subtype": "init"}\n', '\n', stream_event('Hello'), stream_event('\n\n')]
+    assert feed_all(lines) == [(None, None), (None, None), ('text', 'Hello'), ('text', '\n\n')]
@@ -0,0 +1,25 @@
+from report_cache import ReportCache
+
+
+def test_disk_only_cache_serves_hits_from_sqlite(tmp_path):
+    cache = ReportCache(max_entries=0, db_path=str(tmp_path / 'cache.db'))
+    cache.put('key', 'report')
+
+    assert cache.get('key')['content'] == 'report'
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['hits'] == 1
+
+
+def test_report_larger_than_memory_tier_is_served_from_sqlite(tmp_path):
+    cache = ReportCache(max_bytes=10, db_path=str(tmp_path / 'cache.db'))
+    cache.put('key', 'a report longer than ten bytes')
+
+    assert cache.get('key')['content'] == 'a report longer than ten bytes'
+    assert cache.stats()['bytes'] == 0
+
+
+def test_missing_key_counts_a_miss(tmp_path):
+    cache = ReportCache(max_entries=0, db_path=str(tmp_path / 'cache.db'))
+
+    assert cache.get('missing') is None
+    assert cache.stats()['misses'] == 1
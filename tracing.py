@@ -0,0 +1,232 @@
+"""
+Per-request tracing
+
+Every API request gets a request ID: the client's X-Request-ID header, or a
+new one. It is returned in the X-Request-ID response header, added to every
+event streamed to that client and prefixed to every log line printed while
+the request, or the generation it started, is being handled.
+
+A sampled fraction of requests (TRACE_SAMPLE_RATE, default 1) also record
+spans: request parsing, notes preprocessing, cache lookups, prompt
+formatting, the queue wait, the CLI spawn, time to first output, the
+generation itself and the event stream to the client, split into time spent
+waiting for events and time spent writing them. The last TRACE_BUFFER_SIZE
+finished traces (default 200) are kept in a ring buffer and served by
+GET /debug/traces as Chrome trace-event JSON, which loads in Perfetto
+(ui.perfetto.dev) or chrome://tracing. Each request is a process track,
+with a thread track for every server thread (or asyncio task) that worked
+on it.
+"""
+
+import asyncio
+import contextvars
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# The trace of the request being handled, in this thread or task
+CURRENT_TRACE = contextvars.ContextVar('current_trace', default=None)
+
+# Client-supplied request IDs are echoed into events and logs, so only safe ones are kept
+_REQUEST_ID = re.compile(r'[A-Za-z0-9._:-]{1,64}')
+
+
+class Trace:
+    """
+    Spans recorded for one request. Unsampled traces keep the request ID but
+    record nothing. A trace goes into its recorder's buffer when the request
+    finishes; a detached job it started keeps adding spans after that.
+    """
+
+    def __init__(self, request_id, name='request', sampled=True, recorder=None, max_spans=2000):
+        self.request_id = request_id
+        self.name = name
+        self.sampled = sampled
+        self.max_spans = max_spans
+        self.started_at = time.time()
+        self.finished_at = None
+        self.dropped_spans = 0
+        # (name, start, end or None for an instant, thread or task name, args)
+        self.spans = []
+        self._recorder = recorder
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **args):
+        """Record the time spent in the block; the block may add to the yielded args dict"""
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.add_span(name, start, time.time(), **args)
+
+    def add_span(self, name, start, end=None, **args):
+        """Record a span that has already ended, or an instant event when `end` is None"""
+        if not self.sampled:
+            return
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append((name, start, end, _track(), args))
+            else:
+                self.dropped_spans += 1
+
+    def mark(self, name, **args):
+        self.add_span(name, time.time(), **args)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.spans)
+
+    def finish(self):
+        """Mark the request done and keep the trace, if sampled"""
+        with self._lock:
+            if self.finished_at is not None:
+                return
+            self.finished_at = time.time()
+        if self._recorder is not None and self.sampled:
+            self._recorder.record(self)
+
+
+class TraceRecorder:
+    """Starts traces, sampling `sample_rate` of them, and keeps the last `capacity` finished ones"""
+
+    def __init__(self, capacity=200, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.started = 0
+        self.sampled = 0
+        self._traces = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def start(self, name='request', request_id=None):
+        """A new trace; `request_id` (e.g. from an X-Request-ID header) is kept if it is well formed"""
+        if not (request_id and _REQUEST_ID.fullmatch(request_id)):
+            request_id = new_request_id()
+        sampled = random.random() < self.sample_rate
+        with self._lock:
+            self.started += 1
+            self.sampled += sampled
+        return Trace(request_id, name, sampled=sampled, recorder=self)
+
+    def record(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def traces(self, name=None, request_id=None, limit=None):
+        """Finished traces, oldest first, optionally filtered by name and request ID"""
+        with self._lock:
+            traces = list(self._traces)
+        traces = [
+            trace for trace in traces
+            if (name is None or trace.name == name) and (request_id is None or trace.request_id == request_id)
+        ]
+        return traces[-limit:] if limit else traces
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace():
+    """The current request's trace, or an unsampled stand-in outside a request"""
+    return CURRENT_TRACE.get() or _UNTRACED
+
+
+@contextmanager
+def bind(trace):
+    """Make `trace` the current trace for the block, e.g. on a worker thread"""
+    token = CURRENT_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        CURRENT_TRACE.reset(token)
+
+
+def span(name, **args):
+    """A span in the current trace"""
+    return current_trace().span(name, **args)
+
+
+def chrome_trace(traces):
+    """Chrome trace-event JSON for `traces`: one process per request, one thread track per thread or task"""
+    events = []
+    for pid, trace in enumerate(traces, start=1):
+        events.append({'ph': 'M', 'name': 'process_name', 'pid': pid,
+                       'args': {'name': f'{trace.name} {trace.request_id}'}})
+        events.append({'ph': 'M', 'name': 'process_sort_index', 'pid': pid, 'args': {'sort_index': pid}})
+        threads = {}
+        if trace.finished_at is not None:
+            threads['request'] = 1
+            events.append({'name': 'request', 'cat': trace.name, 'ph': 'X', 'pid': pid, 'tid': 1,
+                           'ts': _micros(trace.started_at), 'dur': _micros(trace.finished_at - trace.started_at),
+                           'args': {'request_id': trace.request_id, 'dropped_spans': trace.dropped_spans}})
+        for name, start, end, thread, args in trace.snapshot():
+            tid = threads.setdefault(thread, len(threads) + 1)
+            event = {'name': name, 'cat': trace.name, 'pid': pid, 'tid': tid, 'ts': _micros(start), 'args': args}
+            if end is None:
+                event.update(ph='i', s='t')
+            else:
+                event.update(ph='X', dur=_micros(end - start))
+            events.append(event)
+        for thread, tid in threads.items():
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def _track():
+    """The asyncio task a span was recorded in, else its thread"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task.get_name() if task else threading.current_thread().name
+
+
+def _micros(seconds):
+    return round(seconds * 1_000_000)
+
+
+class RequestIdWriter:
+    """Wraps a text stream so lines written during a request start with its request ID"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._line_start = threading.local()
+
+    def write(self, text):
+        trace = CURRENT_TRACE.get()
+        at_line_start = getattr(self._line_start, 'value', True)
+        self._line_start.value = text.endswith('\n')
+        if trace is not None and text:
+            prefix = f'[{trace.request_id}] '
+            lines = text.split('\n')
+            text = '\n'.join(
+                prefix + line if line and (index > 0 or at_line_start) else line
+                for index, line in enumerate(lines)
+            )
+        return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def install_log_prefix():
+    """Prefix log lines printed to stdout with the current request ID"""
+    if not isinstance(sys.stdout, RequestIdWriter):
+        sys.stdout = RequestIdWriter(sys.stdout)
+
+
+def recorder_from_env():
+    """Build the trace recorder from TRACE_* environment variables"""
+    return TraceRecorder(
+        capacity=int(os.environ.get('TRACE_BUFFER_SIZE', '200')),
+        sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', '1')),
+    )
+
+
+_UNTRACED = Trace('', sampled=False)
@@ -0,0 +1,334 @@
+"""
+Bounded generation pool with admission control
+
+A fixed set of worker threads runs report generations, so the number of
+concurrent Claude CLI processes never exceeds `max_concurrent`. Requests
+beyond that wait in a bounded queue, ordered by priority class and fair
+between clients (see scheduling.py), and are told their position and
+estimated wait; once the queue is full new requests are rejected up front.
+"""
+
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+from metrics import QUEUE_WAIT_SECONDS
+from scheduling import FairQueue, queue_from_env
+
+
+class PoolFullError(Exception):
+    """Raised when the wait queue is full and a request cannot be admitted"""
+
+    def __init__(self, retry_after):
+        super().__init__('Server is busy generating other reports, please retry shortly')
+        self.retry_after = retry_after
+
+
+class _Job:
+    def __init__(self, fn, output_queue, job, priority, client):
+        self.fn = fn
+        self.output_queue = output_queue
+        self.job = job
+        self.priority = priority
+        self.client = client
+        self.enqueued_at = time.time()
+        self.position = None
+        self.unregister_cancel = lambda: None
+
+
+class GenerationPool:
+    """
+    Runs generation jobs on at most `max_concurrent` threads with at most
+    `max_queue` jobs waiting. Waiting jobs get `status` events on their
+    output queue whenever their position changes, and one saying how long
+    they waited when they start.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=32, initial_estimate=30.0, waiting=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.borrowed = 0
+        self.completed = 0
+        self.rejected = 0
+
+        # Exponential moving average of job duration, used for wait estimates
+        self._average_duration = initial_estimate
+        self._waiting = waiting if waiting is not None else FairQueue()
+        self._lock = threading.Condition()
+        self._workers = []
+
+    def submit(self, fn, output_queue, job=None, priority='normal', client=None):
+        """
+        Queue `fn` to run on a worker thread, ahead of lower `priority`
+        classes and taking turns with other clients. Raises PoolFullError
+        when no worker is free and the wait queue is already full. If `job`
+        (a jobs.Job) is cancelled while waiting, it leaves the queue without
+        running.
+        """
+        entry = _Job(fn, output_queue, job, priority, client)
+        if job:
+            # Unregistered once the entry leaves the queue: a live session's
+            # job is submitted again for every update
+            entry.unregister_cancel = job.add_cancel_callback(lambda: self._discard(entry))
+
+        with self._lock:
+            self._start_workers()
+            # Jobs that idle workers are about to take do not count as waiting
+            waiting = len(self._waiting) - self._idle_workers()
+            if waiting >= self.max_queue:
+                self.rejected += 1
+                entry.unregister_cancel()
+                raise PoolFullError(retry_after=self.estimated_wait(waiting + 1))
+
+            self._waiting.push(entry)
+            self._lock.notify()
+            if len(self._waiting) > self._idle_workers():
+                self._notify_positions()
+
+    def borrow(self, wanted):
+        """
+        Take up to `wanted` idle slots for extra CLI calls made by a running
+        job (the windows of a map-reduce pass), so they count towards
+        `max_concurrent`. Slots are only lent while nothing is waiting.
+        Returns how many were taken; hand them back with `give_back`.
+        """
+        with self._lock:
+            count = max(0, min(wanted, self._idle_workers() - len(self._waiting)))
+            self.active += count
+            self.borrowed += count
+            return count
+
+    def give_back(self, count):
+        with self._lock:
+            self.active -= count
+            self.borrowed -= count
+            self._lock.notify_all()
+
+    def estimated_wait(self, position):
+        """Seconds until the job at `position` in the queue starts, roughly"""
+        return math.ceil(position / self.max_concurrent) * self._average_duration
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'borrowed': self.borrowed,
+                'queued': len(self._waiting),
+                'queued_by_priority': self._waiting.counts(),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'average_duration': round(self._average_duration, 1),
+            }
+
+    def _idle_workers(self):
+        return self.max_concurrent - self.active
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_concurrent:
+            worker = threading.Thread(
+                target=self._run_worker,
+                name=f'generation-worker-{len(self._workers)}',
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _run_worker(self):
+        while True:
+            with self._lock:
+                # Borrowed slots leave workers idle without a slot to run in
+                while not self._waiting or self._idle_workers() <= 0:
+                    self._lock.wait()
+                job = self._waiting.pop()
+                job.unregister_cancel()
+                if job.job and job.job.cancelled:
+                    continue
+                self.active += 1
+                self._notify_positions()
+            record_queue_wait(job, job.output_queue.put)
+
+            started = time.time()
+            try:
+                job.fn()
+            except Exception as e:
+                print(f"❌ Generation job failed: {str(e)}")
+            finally:
+                duration = time.time() - started
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+
+    def _discard(self, entry):
+        """Drop a cancelled job from the wait queue so it frees its place"""
+        with self._lock:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+                self._notify_positions()
+
+    def _notify_positions(self):
+        idle = self._idle_workers()
+        for index, waiting_job in enumerate(self._waiting.ordered(), start=1):
+            position = index - idle
+            if position > 0 and position != waiting_job.position:
+                waiting_job.position = position
+                waiting_job.output_queue.put(json.dumps(
+                    queue_status_event(position, self.estimated_wait(position), waiting_job.priority)
+                ))
+
+
+class AsyncGenerationPool:
+    """
+    asyncio counterpart of GenerationPool for the ASGI server. Jobs run on
+    the event loop, so the pool only hands out slots: `submit()` admits or
+    rejects, `acquire()` waits for a slot and `release()` gives it back.
+    Must only be used from the event loop thread.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=32, initial_estimate=30.0, waiting=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.borrowed = 0
+        self.completed = 0
+        self.rejected = 0
+
+        self._average_duration = initial_estimate
+        self._waiting = waiting if waiting is not None else FairQueue()
+
+    estimated_wait = GenerationPool.estimated_wait
+
+    def borrow(self, wanted):
+        """Take up to `wanted` idle slots for a running job's extra CLI calls; see GenerationPool.borrow"""
+        count = max(0, min(wanted, self.max_concurrent - self.active - len(self._waiting)))
+        self.active += count
+        self.borrowed += count
+        return count
+
+    def give_back(self, count):
+        self.active -= count
+        self.borrowed -= count
+        self._dispatch()
+
+    def submit(self, notify, priority='normal', client=None):
+        """
+        Reserve a place in line, ordered by `priority` class and fair
+        between clients. `notify(event)` receives queue status events while
+        waiting. Raises PoolFullError when the wait queue is full.
+        """
+        if self.active >= self.max_concurrent and len(self._waiting) >= self.max_queue:
+            self.rejected += 1
+            raise PoolFullError(retry_after=self.estimated_wait(len(self._waiting) + 1))
+
+        ticket = _AsyncTicket(notify, priority, client)
+        self._waiting.push(ticket)
+        self._dispatch()
+        if not ticket.started.is_set():
+            self._notify_positions()
+        return ticket
+
+    async def acquire(self, ticket):
+        """Wait until the ticket has a generation slot"""
+        await ticket.started.wait()
+        ticket.started_at = time.time()
+
+    def release(self, ticket):
+        """Give the slot back, or leave the queue if it never started"""
+        if not ticket.started.is_set():
+            self._waiting.remove(ticket)
+            return
+        duration = time.time() - (ticket.started_at or time.time())
+        self.active -= 1
+        self.completed += 1
+        self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+        self._dispatch()
+
+    def stats(self):
+        return {
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'active': self.active,
+            'borrowed': self.borrowed,
+            'queued': len(self._waiting),
+            'queued_by_priority': self._waiting.counts(),
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'average_duration': round(self._average_duration, 1),
+        }
+
+    def _dispatch(self):
+        started = False
+        while self._waiting and self.active < self.max_concurrent:
+            ticket = self._waiting.pop()
+            self.active += 1
+            record_queue_wait(ticket, ticket.notify, encode=False)
+            ticket.started.set()
+            started = True
+        if started:
+            self._notify_positions()
+
+    def _notify_positions(self):
+        for position, ticket in enumerate(self._waiting.ordered(), start=1):
+            if position != ticket.position:
+                ticket.position = position
+                ticket.notify(queue_status_event(position, self.estimated_wait(position), ticket.priority))
+
+
+class _AsyncTicket:
+    def __init__(self, notify, priority, client):
+        self.notify = notify
+        self.priority = priority
+        self.client = client
+        self.enqueued_at = time.time()
+        self.position = None
+        self.started = asyncio.Event()
+        self.started_at = None
+
+
+def record_queue_wait(entry, notify, encode=True):
+    """
+    Record how long an entry waited for a worker in the metrics, and tell
+    its client if it had been told it was queued
+    """
+    wait = time.time() - entry.enqueued_at
+    QUEUE_WAIT_SECONDS.observe(wait, priority=entry.priority)
+    if entry.position is not None:
+        event = {
+            'type': 'status',
+            'message': f'▶️ Starting after {wait:.1f}s in the queue ({entry.priority} priority)',
+            'priority': entry.priority,
+            'queue_wait': f"{wait:.1f}s",
+            'timestamp': datetime.now().isoformat()
+        }
+        notify(json.dumps(event) if encode else event)
+
+
+def queue_status_event(position, wait, priority='normal'):
+    """Status event telling a waiting client where it is in the queue"""
+    return {
+        'type': 'status',
+        'message': f'⏳ Waiting in queue: position {position}, about {wait:.0f}s ({priority} priority)',
+        'queue_position': position,
+        'estimated_wait': f"{wait:.0f}s",
+        'priority': priority,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def pool_from_env(pool_class=GenerationPool):
+    """
+    Build a generation pool from GENERATION_* environment variables, with
+    a wait queue from the SCHEDULER_* ones
+    """
+    return pool_class(
+        max_concurrent=int(os.environ.get('GENERATION_MAX_CONCURRENT', '4')),
+        max_queue=int(os.environ.get('GENERATION_MAX_QUEUE', '32')),
+        waiting=queue_from_env(),
+    )